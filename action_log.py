@@ -0,0 +1,347 @@
+"""
+Журнал игровых действий: давка, отправка змия, радёмка, смена ника.
+
+Действия дописываются в конец сегментов storage/action_log/segment_NNNNNN.log
+записями фиксированного размера (struct), а проекции - статистика таймингов,
+суммы по чатам, лидерборды - обновляются из них по одной записи.
+Снимок проекций с позицией в журнале пишется вместе со сбросом журнала,
+поэтому при старте проигрывается только хвост после последнего снимка.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import struct
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import ACTION_LOG_CONFIG, TIMING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Типы действий
+ACTION_DAVKA = 1      # user_id, chat_id (0 - личка), вес змия
+ACTION_ULETET = 2     # user_id, 0, вес змия
+ACTION_FIGHT = 3      # победитель, проигравший, сколько забрано
+ACTION_NICKNAME = 4   # user_id, 0, 0
+
+# тип, время (сек), user_id, второй id, значение - 29 байт
+RECORD = struct.Struct("<BIqqd")
+RECORD_SIZE = RECORD.size
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_TEMPLATE = "segment_{:06d}.log"
+
+
+class TimingProjection:
+    """
+    Статистика давок игрока без хранения истории:
+    [давок, первая, последняя, сумма ожиданий, мин. ожидание, макс. ожидание].
+    """
+
+    name = "timing"
+
+    def __init__(self):
+        self.users: Dict[int, List[float]] = {}
+
+    def apply(self, kind: int, timestamp: int, user_id: int, other_id: int, value: float):
+        if kind != ACTION_DAVKA:
+            return
+        stats = self.users.get(user_id)
+        if stats is None:
+            self.users[user_id] = [1, timestamp, timestamp, 0, 0, 0]
+            return
+        wait = timestamp - stats[2]
+        stats[4] = wait if stats[0] == 1 else min(stats[4], wait)
+        stats[5] = max(stats[5], wait)
+        stats[3] += wait
+        stats[0] += 1
+        stats[2] = timestamp
+
+    def stats(self, user_id: int, now: Optional[float] = None) -> Dict[str, Any]:
+        stats = self.users.get(user_id)
+        if stats is None:
+            return {
+                'total_davki': 0,
+                'avg_wait_time': 0,
+                'last_davka_time': 0,
+                'longest_wait': 0,
+                'shortest_wait': 0,
+                'efficiency': 0
+            }
+        count, first, last, wait_sum, shortest, longest = stats
+        # Эффективность: сколько давок сделано из возможных с первой давки
+        possible = ((now or time.time()) - first) / TIMING_CONFIG["base_davka_cooldown"]
+        return {
+            'total_davki': count,
+            'avg_wait_time': wait_sum / (count - 1) if count > 1 else 0,
+            'last_davka_time': last,
+            'longest_wait': longest,
+            'shortest_wait': shortest,
+            'efficiency': min(100, count / possible * 100) if possible > 0 else 0
+        }
+
+    def dump(self) -> Dict[str, Any]:
+        return {str(user_id): list(stats) for user_id, stats in self.users.items()}
+
+    def load(self, state: Dict[str, Any]):
+        self.users = {int(user_id): stats for user_id, stats in state.items()}
+
+
+class ChatTotalsProjection:
+    """Суммы по чатам: [давок, граммов змия, последняя давка]."""
+
+    name = "chats"
+
+    def __init__(self):
+        self.chats: Dict[int, List[float]] = {}
+
+    def apply(self, kind: int, timestamp: int, user_id: int, other_id: int, value: float):
+        if kind != ACTION_DAVKA or not other_id:
+            return
+        totals = self.chats.setdefault(other_id, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += value
+        totals[2] = timestamp
+
+    def totals(self, chat_id: int) -> Dict[str, Any]:
+        davki, grams, last = self.chats.get(chat_id, (0, 0.0, 0))
+        return {'davki': davki, 'zmiy_grams': grams, 'last_davka': last}
+
+    def dump(self) -> Dict[str, Any]:
+        return {str(chat_id): list(totals) for chat_id, totals in self.chats.items()}
+
+    def load(self, state: Dict[str, Any]):
+        self.chats = {int(chat_id): totals for chat_id, totals in state.items()}
+
+
+class LeaderboardProjection:
+    """Очки игроков: [выдавлено граммов, отправлено граммов, побед, поражений]."""
+
+    name = "leaderboard"
+    FIELDS = ('zmiy_grams', 'uletet_grams', 'wins', 'losses')
+
+    def __init__(self):
+        self.players: Dict[int, List[float]] = {}
+
+    def _row(self, user_id: int) -> List[float]:
+        row = self.players.get(user_id)
+        if row is None:
+            row = self.players[user_id] = [0.0, 0.0, 0, 0]
+        return row
+
+    def apply(self, kind: int, timestamp: int, user_id: int, other_id: int, value: float):
+        if kind == ACTION_DAVKA:
+            self._row(user_id)[0] += value
+        elif kind == ACTION_ULETET:
+            self._row(user_id)[1] += value
+        elif kind == ACTION_FIGHT:
+            self._row(user_id)[2] += 1
+            self._row(other_id)[3] += 1
+
+    def top(self, limit: int = 10, by: str = 'zmiy_grams') -> List[Tuple[int, float]]:
+        column = self.FIELDS.index(by)
+        return heapq.nlargest(
+            limit, ((user_id, row[column]) for user_id, row in self.players.items()), key=lambda item: item[1]
+        )
+
+    def dump(self) -> Dict[str, Any]:
+        return {str(user_id): list(row) for user_id, row in self.players.items()}
+
+    def load(self, state: Dict[str, Any]):
+        self.players = {int(user_id): row for user_id, row in state.items()}
+
+
+class ActionLog:
+    """
+    Журнал действий и его проекции.
+
+    append() кладёт запись в буфер и сразу применяет её к проекциям;
+    flush() дописывает буфер в текущий сегмент (в отдельном потоке) и раз в
+    snapshot_every записей сохраняет снимок проекций. Пока журнал не запущен
+    (start), append ничего не делает - скрипты и бенчмарки его не задевают.
+    """
+
+    def __init__(self, directory: str = "storage/action_log", segment_size: int = 16 * 1024 * 1024,
+                 snapshot_every: int = 10000):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.snapshot_every = snapshot_every
+        self.timing = TimingProjection()
+        self.chats = ChatTotalsProjection()
+        self.leaderboard = LeaderboardProjection()
+        self.projections = (self.timing, self.chats, self.leaderboard)
+        self.started = False
+        self._buffer: List[bytes] = []
+        self._segment = 1
+        self._position = 0
+        self._since_snapshot = 0
+        self._lock = asyncio.Lock()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, SEGMENT_TEMPLATE.format(segment))
+
+    def _segments(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment_") and name.endswith(".log")
+        )
+
+    def _apply(self, kind: int, timestamp: int, user_id: int, other_id: int, value: float):
+        for projection in self.projections:
+            projection.apply(kind, timestamp, user_id, other_id, value)
+
+    def append(self, kind: int, user_id: int, other_id: int = 0, value: float = 0.0,
+               timestamp: Optional[int] = None):
+        if not self.started:
+            return
+        timestamp = timestamp or int(time.time())
+        self._buffer.append(RECORD.pack(kind, timestamp, user_id, other_id or 0, value))
+        self._apply(kind, timestamp, user_id, other_id or 0, value)
+
+    # ---------- запуск и проигрывание ----------
+
+    def _read_records(self, segment: int, position: int) -> Iterator[Tuple]:
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(position)
+            data = f.read()
+        usable = len(data) - len(data) % RECORD_SIZE
+        yield from RECORD.iter_unpack(data[:usable])
+
+    def _load(self) -> int:
+        """Снимок + хвост журнала; возвращает число проигранных записей."""
+        os.makedirs(self.directory, exist_ok=True)
+        segment, position = 1, 0
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            segment, position = snapshot["segment"], snapshot["position"]
+            for projection in self.projections:
+                projection.load(snapshot["projections"].get(projection.name, {}))
+
+        replayed = 0
+        segments = [number for number in self._segments() if number >= segment]
+        for number in segments:
+            start = position if number == segment else 0
+            for record in self._read_records(number, start):
+                self._apply(*record)
+                replayed += 1
+
+        self._segment = segments[-1] if segments else segment
+        path = self._segment_path(self._segment)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        # Недописанная при падении запись в конце сегмента отрезается
+        self._position = size - size % RECORD_SIZE
+        if self._position != size:
+            with open(path, "r+b") as f:
+                f.truncate(self._position)
+        self._since_snapshot = replayed
+        return replayed
+
+    async def start(self):
+        replayed = await asyncio.to_thread(self._load)
+        self.started = True
+        logger.info("📜 Журнал действий: сегмент %s, проиграно записей после снимка: %s", self._segment, replayed)
+
+    # ---------- запись ----------
+
+    def _write(self, records: bytes, snapshot: Optional[Dict[str, Any]]):
+        if records:
+            if self._position >= self.segment_size:
+                self._segment += 1
+                self._position = 0
+            with open(self._segment_path(self._segment), "ab") as f:
+                f.write(records)
+            self._position += len(records)
+        if snapshot is not None:
+            snapshot["segment"], snapshot["position"] = self._segment, self._position
+            snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+            with open(snapshot_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+
+    async def flush(self, force_snapshot: bool = False) -> int:
+        """Дописывает буфер в журнал; возвращает число записанных записей."""
+        async with self._lock:
+            pending, self._buffer = self._buffer, []
+            self._since_snapshot += len(pending)
+            snapshot = None
+            if force_snapshot or self._since_snapshot >= self.snapshot_every:
+                # Состояние проекций снимается сейчас, вместе с буфером:
+                # оно включает ровно записи до конца pending. dump() копирует
+                # строки - append() меняет живые списки, пока снимок пишется в потоке
+                snapshot = {
+                    "created_at": int(time.time()),
+                    "projections": {p.name: p.dump() for p in self.projections},
+                }
+                self._since_snapshot = 0
+            if not pending and snapshot is None:
+                return 0
+            await asyncio.to_thread(self._write, b"".join(pending), snapshot)
+            return len(pending)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'segment': self._segment,
+            'position': self._position,
+            'buffered': len(self._buffer),
+            'since_snapshot': self._since_snapshot,
+            'players': len(self.leaderboard.players),
+        }
+
+
+_action_log: Optional[ActionLog] = None
+_flush_task = None
+
+
+def get_action_log() -> ActionLog:
+    """Глобальный журнал действий"""
+    global _action_log
+    if _action_log is None:
+        _action_log = ActionLog(
+            directory=ACTION_LOG_CONFIG.get("dir", "storage/action_log"),
+            segment_size=ACTION_LOG_CONFIG.get("segment_size", 16 * 1024 * 1024),
+            snapshot_every=ACTION_LOG_CONFIG.get("snapshot_every", 10000),
+        )
+    return _action_log
+
+
+async def action_log_flush_loop(interval_seconds: float):
+    """Фоновая запись журнала действий."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await get_action_log().flush()
+        except Exception as e:
+            logger.error("❌ Ошибка записи журнала действий: %s", e)
+
+
+async def start_action_log(interval_seconds: Optional[float] = None):
+    """Загружает снимок, проигрывает хвост журнала и запускает фоновую запись."""
+    global _flush_task
+    await get_action_log().start()
+    if _flush_task is None or _flush_task.done():
+        interval = interval_seconds or ACTION_LOG_CONFIG.get("flush_interval", 5)
+        _flush_task = asyncio.create_task(action_log_flush_loop(interval))
+        logger.info("✅ Запись журнала действий запущена (каждые %s сек)", interval)
+
+
+async def stop_action_log():
+    """Останавливает фоновую запись, дописывает буфер и сохраняет снимок."""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    log = get_action_log()
+    if log.started:
+        await log.flush(force_snapshot=True)
+        logger.info("📜 Журнал действий записан, снимок сохранён")
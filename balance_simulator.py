@@ -0,0 +1,293 @@
+"""
+Симулятор баланса: давка и радёмки всей базы игроков на N дней вперёд.
+
+Игроки загружаются из таблицы users (или генерируются) в массивы NumPy,
+каждый шаг симуляции - несколько векторных операций над всей популяцией.
+Формулы те же, что у бота (utils.game_formulas, уровни из config.GOFRY_MM),
+поэтому правку баланса в config.py можно проверить до выкладки:
+
+    python balance_simulator.py --players 1000000 --days 30
+    python balance_simulator.py --db storage/bot_database.db --days 14 --csv curves.csv
+"""
+
+import argparse
+import csv
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from config import ATM_MAX, ATM_BASE_TIME, MATCHMAKING_CONFIG
+from utils.gofra_levels import GOFRA_LEVELS
+from utils.game_formulas import (
+    PVP_ATTACK_REWARD, PVP_DEFENCE_REWARD, davka_gains, pvp_chance, pvp_gofra_gain
+)
+
+DAY_SECONDS = 86400
+
+
+class Population:
+    """Состояние всех игроков: по массиву на поле."""
+
+    def __init__(self, gofra_mm, cable_mm, atm, activity):
+        self.gofra_mm = np.asarray(gofra_mm, dtype=np.float64)
+        self.cable_mm = np.asarray(cable_mm, dtype=np.float64)
+        self.atm = np.asarray(atm, dtype=np.float64)
+        # Доля доступных давок и радёмок, которые игрок реально делает
+        self.activity = np.asarray(activity, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.gofra_mm)
+
+    @classmethod
+    def generate(cls, players: int, rng) -> "Population":
+        """Новые игроки (как после регистрации) с разной активностью."""
+        return cls(
+            gofra_mm=np.full(players, 10.0),
+            cable_mm=np.full(players, 10.0),
+            atm=np.full(players, float(ATM_MAX)),
+            activity=rng.beta(2.0, 3.0, players),
+        )
+
+    @classmethod
+    def load(cls, db_path: str, rng) -> "Population":
+        """Игроки из базы бота; активность не хранится и задаётся случайно."""
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT gofra_mm, cable_mm, atm_count FROM users").fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            raise ValueError(f"В {db_path} нет игроков")
+        data = np.array(rows, dtype=np.float64)
+        return cls(data[:, 0], data[:, 1], data[:, 2], rng.beta(2.0, 3.0, len(rows)))
+
+
+class BalanceSimulator:
+    """
+    Шаг симуляции - tick_hours часов:
+    восстановление атмосфер по скорости уровня, давка у тех, у кого 12 атмосфер
+    (с вероятностью activity), и радёмки со случайными целями.
+
+    Радёмки идут двумя путями, как в боте: доля chat_share - вызовы в чате
+    (handle_chat_fight), где проигравший нападение защитник получает
+    PVP_DEFENCE_REWARD; остальные - личные (rademka_confirm), там защитнику
+    ничего не достаётся. Лимит fights_per_hour считается на шаг целиком:
+    боёв за шаг у игрока не больше fights_per_hour * tick_hours.
+    """
+
+    def __init__(self, population: Population, tick_hours: float = 3.0,
+                 pvp_per_day: float = 3.0, top_size: int = 100, seed: Optional[int] = None,
+                 chat_share: float = 0.5,
+                 fights_per_hour: int = MATCHMAKING_CONFIG.get("fights_per_hour", 10)):
+        self.population = population
+        self.tick_seconds = tick_hours * 3600
+        self.ticks_per_day = max(int(round(DAY_SECONDS / self.tick_seconds)), 1)
+        # Среднее число радёмок за шаг у игрока с activity = 1
+        self.pvp_per_tick = pvp_per_day / self.ticks_per_day
+        self.chat_share = chat_share
+        self.fights_per_tick = max(int(fights_per_hour * tick_hours), 1)
+        self.top_size = min(top_size, len(population))
+        self.rng = np.random.default_rng(seed)
+
+        self.thresholds = np.array([level.threshold for level in GOFRA_LEVELS])
+        self.min_grams = np.array([level.min_grams for level in GOFRA_LEVELS], dtype=np.float64)
+        self.grams_span = np.array(
+            [level.max_grams - level.min_grams + 1 for level in GOFRA_LEVELS], dtype=np.float64
+        )
+        # Атмосфер за шаг на каждом уровне
+        self.atm_per_tick = np.array(
+            [self.tick_seconds * level.atm_speed / ATM_BASE_TIME for level in GOFRA_LEVELS]
+        )
+        self._previous_top = None
+
+        # Уровень игрока пересчитывается только у тех, чья гофра изменилась,
+        # а атмосферы хранятся как номер шага, к которому их снова будет 12
+        self.tick = 0
+        self.levels = self.level_indexes(population.gofra_mm)
+        missing = np.maximum(ATM_MAX - population.atm, 0.0)
+        self.ready_at = np.ceil(missing / self.atm_per_tick[self.levels]).astype(np.int64)
+
+    def level_indexes(self, gofra_mm):
+        return np.maximum(np.searchsorted(self.thresholds, gofra_mm, side="right") - 1, 0)
+
+    def _refresh_levels(self, players):
+        self.levels[players] = self.level_indexes(self.population.gofra_mm[players])
+
+    def step(self) -> Dict[str, int]:
+        p = self.population
+        n = len(p)
+        rng = self.rng
+
+        # Давка: у кого накопилось 12 атмосфер, с вероятностью activity;
+        # вес - как random.randint(min_grams, max_grams) уровня
+        ready = np.flatnonzero(self.ready_at <= self.tick)
+        davka = ready[rng.random(len(ready)) < p.activity[ready]]
+        if len(davka):
+            davka_levels = self.levels[davka]
+            grams = self.min_grams[davka_levels] + np.floor(
+                rng.random(len(davka)) * self.grams_span[davka_levels]
+            )
+            gofra_gain, cable_gain = davka_gains(grams)
+            p.gofra_mm[davka] += gofra_gain
+            p.cable_mm[davka] += cable_gain
+            self._refresh_levels(davka)
+            self.ready_at[davka] = self.tick + np.ceil(ATM_MAX / self.atm_per_tick[self.levels[davka]]).astype(np.int64)
+
+        # Радёмки: число попыток за шаг у игрока - пуассоновское со средним
+        # pvp_per_tick * activity, цели случайные, порядок попыток случайный
+        fights = chat_fights = capped = 0
+        if n > 1:
+            attackers = rng.permutation(np.repeat(np.arange(n), rng.poisson(self.pvp_per_tick * p.activity)))
+            targets = rng.integers(0, n - 1, len(attackers))
+            targets += targets >= attackers  # без боёв с самим собой
+            allowed = self._within_limit(attackers, targets)
+            capped = len(attackers) - int(allowed.sum())
+            attackers, targets = attackers[allowed], targets[allowed]
+
+            a_gofra, t_gofra = p.gofra_mm[attackers], p.gofra_mm[targets]
+            chance = pvp_chance(a_gofra, p.cable_mm[attackers], t_gofra, p.cable_mm[targets])
+            won = rng.random(len(attackers)) * 100 < chance
+            in_chat = rng.random(len(attackers)) < self.chat_share
+            # Награда за защиту - только в чате; в личной радёмке проигрыш нападающего защитнику ничего не даёт
+            rewarded = ~won & in_chat
+            winners, defenders = attackers[won], targets[rewarded]
+            attack_gain = pvp_gofra_gain(a_gofra[won], t_gofra[won])
+            defence_gain = pvp_gofra_gain(t_gofra[rewarded], a_gofra[rewarded], PVP_DEFENCE_REWARD)
+            np.add.at(p.gofra_mm, winners, attack_gain)
+            np.add.at(p.cable_mm, winners, PVP_ATTACK_REWARD["cable_mm"])
+            np.add.at(p.gofra_mm, defenders, defence_gain)
+            np.add.at(p.cable_mm, defenders, PVP_DEFENCE_REWARD["cable_mm"])
+            self._refresh_levels(np.concatenate((winners, defenders)))
+            fights = len(attackers)
+            chat_fights = int(in_chat.sum())
+
+        self.tick += 1
+        return {"davki": len(davka), "fights": fights, "chat_fights": chat_fights, "capped": capped}
+
+    def _within_limit(self, attackers, targets):
+        """
+        Какие попытки проходят лимит боёв: у обоих участников это не больше
+        fights_per_tick-го боя за шаг. Номер боя игрока считается по всем
+        попыткам шага, включая отклонённые, - лимит чуть строже, чем в боте.
+        """
+        participants = np.column_stack((attackers, targets)).ravel()
+        order = np.argsort(participants, kind="stable")
+        ordered = participants[order]
+        # Начало группы каждого игрока в отсортированном массиве
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        sizes = np.diff(np.r_[starts, len(ordered)])
+        rank = np.empty(len(participants), dtype=np.int64)
+        rank[order] = np.arange(len(ordered)) - np.repeat(starts, sizes)
+        return (rank.reshape(-1, 2) < self.fights_per_tick).all(axis=1)
+
+    def snapshot(self, day: int, davki: int, fights: int, chat_fights: int = 0,
+                 capped: int = 0) -> Dict[str, Any]:
+        """Кривые прогресса и обновление топа за день."""
+        p = self.population
+        gofra = p.gofra_mm
+        top = np.argpartition(gofra, len(p) - self.top_size)[len(p) - self.top_size:]
+        if self._previous_top is None:
+            churn = 0.0
+        else:
+            churn = 1.0 - len(np.intersect1d(top, self._previous_top, assume_unique=True)) / self.top_size
+        self._previous_top = top
+        p10, p50, p90, p99 = np.percentile(gofra, [10, 50, 90, 99])
+        return {
+            "day": day,
+            "gofra_p10": p10,
+            "gofra_p50": p50,
+            "gofra_p90": p90,
+            "gofra_p99": p99,
+            "gofra_max": float(gofra.max()),
+            "cable_p50": float(np.median(p.cable_mm)),
+            "top_churn": churn,
+            "top_entry": float(gofra[top].min()),
+            "davki": davki,
+            "fights": fights,
+            "chat_fights": chat_fights,
+            "capped": capped,
+            "levels": np.bincount(self.levels, minlength=len(GOFRA_LEVELS)).tolist(),
+        }
+
+    def run(self, days: int) -> List[Dict[str, Any]]:
+        history = [self.snapshot(0, 0, 0)]
+        for day in range(1, days + 1):
+            totals = {"davki": 0, "fights": 0, "chat_fights": 0, "capped": 0}
+            for _ in range(self.ticks_per_day):
+                for name, count in self.step().items():
+                    totals[name] += count
+            history.append(self.snapshot(day, **totals))
+        return history
+
+
+def print_report(history: List[Dict[str, Any]], players: int, elapsed: float):
+    print(f"Игроков: {players:,}  дней: {len(history) - 1}  время: {elapsed:.2f} с\n")
+    print(f"{'день':>4} {'p10':>8} {'p50':>8} {'p90':>9} {'p99':>9} {'макс':>9} "
+          f"{'кабель':>8} {'вход в топ':>10} {'смена топа':>10} {'давок':>10} {'радёмок':>10} "
+          f"{'в чате':>10} {'лимит':>8}")
+    for row in history:
+        print(f"{row['day']:>4} {row['gofra_p10']:>8.1f} {row['gofra_p50']:>8.1f} {row['gofra_p90']:>9.1f} "
+              f"{row['gofra_p99']:>9.1f} {row['gofra_max']:>9.1f} {row['cable_p50']:>8.1f} "
+              f"{row['top_entry']:>10.1f} {row['top_churn']:>9.0%} {row['davki']:>10,} {row['fights']:>10,} "
+              f"{row['chat_fights']:>10,} {row['capped']:>8,}")
+    last = history[-1]
+    print("\nУровни в конце:")
+    for level, count in zip(GOFRA_LEVELS, last["levels"]):
+        print(f"  {level.emoji} {level.name:<22} {count:>10,}  {count / players:6.1%}")
+
+
+def write_csv(history: List[Dict[str, Any]], path: str):
+    level_columns = [f"level_{index}" for index in range(len(GOFRA_LEVELS))]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        fields = [key for key in history[0] if key != "levels"]
+        writer.writerow(fields + level_columns)
+        for row in history:
+            writer.writerow([row[key] for key in fields] + row["levels"])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Офлайн-симуляция баланса гофроцентрала")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", help="взять игроков из базы бота (только чтение)")
+    source.add_argument("--players", type=int, default=100_000, help="сгенерировать столько новых игроков")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--tick-hours", type=float, default=3.0, help="длина шага симуляции")
+    parser.add_argument("--pvp-per-day", type=float, default=3.0,
+                        help="радёмок в день у самого активного игрока")
+    parser.add_argument("--chat-share", type=float, default=0.5,
+                        help="доля радёмок через вызов в чате (там защитник получает награду)")
+    parser.add_argument("--fights-per-hour", type=int, default=MATCHMAKING_CONFIG.get("fights_per_hour", 10),
+                        help="лимит боёв в час на игрока")
+    parser.add_argument("--top", type=int, default=100, help="размер топа для смены лидеров")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--csv", help="записать кривые по дням в CSV")
+    args = parser.parse_args(argv)
+
+    if not NUMPY_AVAILABLE:
+        print("❌ Для симулятора нужен NumPy: pip install -r requirements-tools.txt", file=sys.stderr)
+        return 1
+
+    rng = np.random.default_rng(args.seed)
+    population = Population.load(args.db, rng) if args.db else Population.generate(args.players, rng)
+    simulator = BalanceSimulator(population, tick_hours=args.tick_hours, pvp_per_day=args.pvp_per_day,
+                                 top_size=args.top, seed=args.seed, chat_share=args.chat_share,
+                                 fights_per_hour=args.fights_per_hour)
+    started = time.perf_counter()
+    history = simulator.run(args.days)
+    print_report(history, len(population), time.perf_counter() - started)
+    if args.csv:
+        write_csv(history, args.csv)
+        print(f"\n📄 Кривые записаны в {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
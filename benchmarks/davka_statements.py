@@ -0,0 +1,116 @@
+"""
+Сколько SQL-операторов и коммитов стоит одна давка.
+
+Сравнивает davka_zmiy (одна транзакция) с прежней цепочкой
+get_patsan -> save_patsan -> ChatManager.update_user_chat_stats
+на временной базе. Запуск из корня репозитория:
+
+    python benchmarks/davka_statements.py --users 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_manager
+from db_manager import (
+    ChatManager, davka_zmiy, get_patsan, save_patsan, invalidate_cached_patsan,
+    get_connection, close_pool, init_db
+)
+
+CHAT_ID = -100
+
+
+class StatementCounter:
+    """Считает операторы, которые SQLite реально выполнил (set_trace_callback)."""
+
+    def __init__(self):
+        self.kinds = Counter()
+
+    def __call__(self, sql: str):
+        self.kinds[sql.lstrip().split(None, 1)[0].upper()] += 1
+
+    def reset(self):
+        self.kinds.clear()
+
+    @property
+    def total(self) -> int:
+        return sum(self.kinds.values())
+
+
+async def legacy_davka(user_id: int, chat_id: int):
+    """Прежний путь: чтение игрока, расчёт в Python, сохранение, статистика чата."""
+    patsan = await get_patsan(user_id)
+    grams = 50
+    patsan['atm_count'] = 0
+    patsan['zmiy_grams'] = grams
+    patsan['total_zmiy_grams'] = patsan.get('total_zmiy_grams', 0) + grams
+    patsan['gofra_mm'] = patsan.get('gofra_mm', 10.0) + grams * 0.025
+    patsan['last_davka'] = int(time.time())
+    await save_patsan(patsan)
+    await ChatManager.update_user_chat_stats(user_id, chat_id, grams)
+
+
+async def refill_atmospheres(conn, user_ids):
+    await conn.execute(
+        f"UPDATE users SET atm_count = 12 WHERE user_id IN ({','.join('?' * len(user_ids))})",
+        user_ids
+    )
+    await conn.commit()
+
+
+async def measure(name: str, action, user_ids, counter: StatementCounter, cold: bool):
+    conn = await get_connection()
+    await refill_atmospheres(conn, user_ids)
+    for user_id in user_ids:
+        # Прогрев/сброс кэша игрока не входит в замер
+        if cold:
+            await invalidate_cached_patsan(user_id)
+        else:
+            await get_patsan(user_id)
+    counter.reset()
+    started = time.perf_counter()
+    for user_id in user_ids:
+        await action(user_id, CHAT_ID)
+    elapsed = time.perf_counter() - started
+    per_action = counter.total / len(user_ids)
+    commits = counter.kinds.get('COMMIT', 0) / len(user_ids)
+    print(f"{name:<28} {per_action:6.2f} операторов  {commits:4.2f} коммитов  "
+          f"{elapsed / len(user_ids) * 1000:7.3f} мс на давку")
+    return per_action
+
+
+async def main(users: int):
+    workdir = tempfile.mkdtemp(prefix="davka_bench_")
+    os.chdir(workdir)
+    db_manager.DB_PATH = os.path.join(workdir, "bench.db")
+    counter = StatementCounter()
+    try:
+        await init_db()
+        await ChatManager.register_chat(CHAT_ID, "bench", "group")
+        user_ids = list(range(1, users + 1))
+        for user_id in user_ids:
+            await get_patsan(user_id)
+        conn = await get_connection()
+        await conn.set_trace_callback(counter)
+
+        print(f"Игроков: {users}, база: {db_manager.DB_PATH}\n")
+        for cold in (False, True):
+            print("Холодный кэш игрока:" if cold else "Тёплый кэш игрока:")
+            legacy = await measure("get_patsan + save_patsan", legacy_davka, user_ids, counter, cold)
+            engine = await measure("davka_zmiy", davka_zmiy, user_ids, counter, cold)
+            print(f"{'меньше операторов в':<28} {legacy / engine:6.2f} раза\n")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="игроков (давок на замер)")
+    asyncio.run(main(parser.parse_args().users))
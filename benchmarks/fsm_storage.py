@@ -0,0 +1,129 @@
+"""
+Сколько стоит сценарий смены ника в разных хранилищах FSM.
+
+Сценарий на игрока: set_state -> get_state -> set_data -> get_data ->
+get_state -> set_state(None) + set_data({}) - как в process_nickname_input.
+Сравниваются файловое хранилище (JSON-файл на ключ с синхронной записью,
+как прежний FileStorage), SQLiteStorage, MemoryStorage и RedisStorage,
+если Redis из REDIS_CONFIG доступен. Запуск из корня репозитория:
+
+    python benchmarks/fsm_storage.py --users 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import db_manager
+from db_manager import close_pool, init_db
+from fsm_storage import SQLiteStorage, _redis_storage
+
+BOT_ID = 1
+
+
+class NicknameStates(StatesGroup):
+    waiting_for_nickname = State()
+
+
+class JsonFileStorage(BaseStorage):
+    """Базовая линия: файл на ключ, каждое изменение - синхронная перезапись файла."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: StorageKey) -> str:
+        return os.path.join(self.path, f"{key.bot_id}_{key.chat_id}_{key.user_id}_{key.destiny}.json")
+
+    def _read(self, key: StorageKey) -> Dict[str, Any]:
+        try:
+            with open(self._file(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"state": None, "data": {}}
+
+    def _write(self, key: StorageKey, record: Dict[str, Any]):
+        with open(self._file(key), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._read(key)
+        record["state"] = state.state if isinstance(state, State) else state
+        self._write(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._read(key)["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._read(key)
+        record["data"] = data
+        self._write(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._read(key)["data"]
+
+    async def close(self) -> None:
+        pass
+
+
+async def nickname_flow(storage: BaseStorage, user_id: int):
+    key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+    await storage.set_state(key, NicknameStates.waiting_for_nickname)
+    assert await storage.get_state(key) == NicknameStates.waiting_for_nickname.state
+    await storage.set_data(key, {"old_nickname": f"Пацанчик_{user_id}"})
+    await storage.get_data(key)
+    await storage.get_state(key)
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+
+
+async def measure(name: str, storage: BaseStorage, users: int):
+    started = time.perf_counter()
+    for user_id in range(1, users + 1):
+        await nickname_flow(storage, user_id)
+    elapsed = time.perf_counter() - started
+    # Отложенная запись входит в замер отдельно - её платит фоновая задача
+    flush_started = time.perf_counter()
+    await storage.close()
+    flushed = time.perf_counter() - flush_started
+    print(f"{name:<20} {elapsed / users * 1000:8.3f} мс на сценарий  "
+          f"{users / elapsed:10,.0f} сценариев/с  закрытие {flushed * 1000:7.1f} мс")
+    return elapsed
+
+
+async def main(users: int):
+    workdir = tempfile.mkdtemp(prefix="fsm_bench_")
+    os.chdir(workdir)
+    db_manager.DB_PATH = os.path.join(workdir, "bench.db")
+    try:
+        await init_db()
+        print(f"Игроков: {users}, каталог: {workdir}\n")
+        baseline = await measure("файлы JSON", JsonFileStorage(os.path.join(workdir, "fsm")), users)
+        # flush_interval больше замера: в сценарии все записи остаются в памяти
+        sqlite = await measure("SQLiteStorage", SQLiteStorage(flush_interval=60), users)
+        await measure("MemoryStorage", MemoryStorage(), users)
+        redis = await _redis_storage()
+        if redis is not None:
+            await measure("RedisStorage", redis, users)
+        else:
+            print(f"{'RedisStorage':<20} пропущен - Redis недоступен")
+        print(f"\nSQLiteStorage быстрее файлов в {baseline / sqlite:.1f} раза")
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="игроков (сценариев на замер)")
+    asyncio.run(main(parser.parse_args().users))
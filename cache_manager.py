@@ -6,17 +6,32 @@ Redis-кеширование с локальным fallback для Telegram бо
 - Локальное кэширование в качестве fallback при недоступности Redis
 - Автоматическое переключение между Redis и локальным кэшем
 - Поддержку TTL (времени жизни) для кэшированных данных
-- Сериализацию данных в JSON для совместимости
+- Бинарный кодек (msgpack, JSON как fallback) с тегом версии формата
+- Автоматическую склейку команд Redis одного тика event loop в pipeline
+- Пул соединений с лимитами из REDIS_CONFIG
+- Индексы ключей по префиксам в Redis и курсорный SCAN вместо KEYS
+- Stale-while-revalidate (мягкий и жёсткий TTL) и упреждающее обновление горячих ключей
+- Двухуровневый кэш: локальный L1 перед Redis L2 с инвалидацией через pub/sub
+  и штампами версий, отсекающими устаревшие записи L1
 """
 
+import abc
 import asyncio
 import json
 import logging
+import os
 import time
-from typing import Any, Dict, Optional, Union, List
+from fnmatch import fnmatchcase
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional, Union, List, Tuple
 from datetime import datetime, timedelta
 import threading
+import struct
+import uuid
 from collections import OrderedDict
+from urllib.parse import quote
+
+from tracing import instrument_class
 
 try:
     import redis.asyncio as redis
@@ -24,15 +39,158 @@ try:
 except ImportError:
     REDIS_AVAILABLE = False
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+class CacheCodec:
+    """
+    Бинарный кодек значений в Redis.
+
+    Первый байт значения - тег формата и его версии, дальше полезная нагрузка.
+    Версионированные теги после тега хранят 8 байт штампа версии записи.
+    Значения без тега считаются JSON-строками из старых версий бота.
+    """
+
+    TAG_MSGPACK_V1 = 0x01
+    TAG_JSON_V1 = 0x02
+    TAG_MSGPACK_VERSIONED = 0x03
+    TAG_JSON_VERSIONED = 0x04
+
+    _VERSION = struct.Struct('>Q')
+
+    def __init__(self, use_msgpack: bool = MSGPACK_AVAILABLE):
+        self.use_msgpack = use_msgpack and MSGPACK_AVAILABLE
+
+    def encode(self, data: Any, version: Optional[int] = None) -> bytes:
+        """Кодирует значение в байты с тегом формата и, если задан, штампом версии."""
+        header = b'' if version is None else self._VERSION.pack(version)
+        if self.use_msgpack:
+            try:
+                tag = self.TAG_MSGPACK_V1 if version is None else self.TAG_MSGPACK_VERSIONED
+                return bytes((tag,)) + header + msgpack.packb(data, use_bin_type=True, default=str)
+            except Exception as e:
+                logger.warning("⚠️ msgpack не справился, пишем JSON: %s", e)
+        tag = self.TAG_JSON_V1 if version is None else self.TAG_JSON_VERSIONED
+        payload = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        return bytes((tag,)) + header + payload
+
+    def decode(self, raw: Union[bytes, str]) -> Any:
+        """Декодирует значение, поддерживая старый JSON без тега."""
+        return self.decode_versioned(raw)[1]
+
+    def decode_versioned(self, raw: Union[bytes, str]) -> Tuple[int, Any]:
+        """Декодирует значение и возвращает пару (версия, данные); без штампа версия 0."""
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        if not raw:
+            return 0, None
+
+        tag = raw[0]
+        version = 0
+        body = raw[1:]
+        if tag in (self.TAG_MSGPACK_VERSIONED, self.TAG_JSON_VERSIONED):
+            version = self._VERSION.unpack_from(raw, 1)[0]
+            body = raw[1 + self._VERSION.size:]
+
+        if tag in (self.TAG_MSGPACK_V1, self.TAG_MSGPACK_VERSIONED):
+            if not MSGPACK_AVAILABLE:
+                raise ValueError("значение записано в msgpack, но msgpack не установлен")
+            return version, msgpack.unpackb(body, raw=False, strict_map_key=False)
+        if tag in (self.TAG_JSON_V1, self.TAG_JSON_VERSIONED):
+            return version, json.loads(body.decode('utf-8'))
+        # Старый формат: чистый JSON без тега
+        return 0, json.loads(raw.decode('utf-8'))
+
+class RedisAutoPipeline:
+    """
+    Автоматический pipeline для Redis.
+
+    Команды, выданные корутинами в одном тике event loop, копятся в очереди
+    и уходят на сервер одним pipeline, то есть за один round trip.
+    """
+
+    def __init__(self, client: "redis.Redis", max_batch: int = 512):
+        self.client = client
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, tuple, asyncio.Future]] = []
+        self._flush_scheduled = False
+        self._flush_tasks: set = set()
+        self.batches = 0
+        self.commands = 0
+
+    def execute(self, command: str, *args) -> asyncio.Future:
+        """Ставит команду в очередь текущего тика и возвращает future с результатом."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((command, args, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif not self._flush_scheduled:
+            # call_soon выполнится после всех корутин, уже готовых в этом тике
+            self._flush_scheduled = True
+            loop.call_soon(self._start_flush)
+        return future
+
+    def _start_flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        task = asyncio.ensure_future(self._flush(pending))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, pending: List[Tuple[str, tuple, asyncio.Future]]):
+        self.batches += 1
+        self.commands += len(pending)
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for command, args, _ in pending:
+                getattr(pipe, command)(*args)
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(pending, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
 class LocalCache:
-    """Локальный кэш с поддержкой TTL и LRU eviction."""
+    """
+    Локальный кэш с поддержкой TTL и LRU eviction.
+
+    Каждая запись хранит штамп версии. После инвалидации ключа запоминается
+    "пол" версии: запись со штампом не новее пола в кэш не попадёт, так что
+    чтение из Redis, начатое до чужой записи, не вернёт в L1 старое значение.
+    """
     
-    def __init__(self, max_size: int = 1000, default_ttl: int = 300):
+    def __init__(self, max_size: int = 1000, default_ttl: int = 300,
+                 max_floors: int = 10000, floor_ttl: int = 300):
         self.max_size = max_size
         self.default_ttl = default_ttl
+        self.max_floors = max_floors
+        self.floor_ttl = floor_ttl
         self._cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        # Индекс пространство имён ("user:") -> ключи, чтобы чистка по префиксу
+        # не перебирала весь кэш
+        self._prefix_index: Dict[str, set] = {}
+        # key -> (версия, expires_at); ограничен по размеру и по времени
+        self._floors: OrderedDict[str, Tuple[int, float]] = OrderedDict()
+        self._prefix_floors: Dict[str, Tuple[int, float]] = {}
         self._lock = threading.Lock()
         
     def _cleanup_expired(self):
@@ -45,7 +203,54 @@ class LocalCache:
                 expired_keys.append(key)
         
         for key in expired_keys:
-            del self._cache[key]
+            self._remove(key)
+    
+    @staticmethod
+    def _namespace(key: str) -> str:
+        """Пространство имён ключа: всё до первого двоеточия включительно."""
+        idx = key.find(':')
+        return key[:idx + 1] if idx >= 0 else ''
+    
+    def _remove(self, key: str) -> None:
+        """Удаляет запись вместе с её местом в индексе префиксов."""
+        del self._cache[key]
+        bucket = self._prefix_index.get(self._namespace(key))
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._prefix_index[self._namespace(key)]
+    
+    def _keys_with_prefix(self, prefix: str) -> List[str]:
+        """Ключи с префиксом; по индексу, если префикс не уже пространства имён."""
+        namespace = self._namespace(prefix)
+        if namespace and len(prefix) >= len(namespace):
+            bucket = self._prefix_index.get(namespace, ())
+            return [k for k in bucket if k.startswith(prefix)]
+        return [k for k in self._cache if k.startswith(prefix)]
+    
+    def keys_with_prefix(self, prefix: str) -> List[str]:
+        """Возвращает ключи L1 с заданным префиксом."""
+        with self._lock:
+            return self._keys_with_prefix(prefix)
+    
+    def _floor(self, key: str) -> int:
+        """Возвращает минимально допустимую версию для ключа (0 - без ограничений)."""
+        current_time = time.time()
+        floor = 0
+        
+        entry = self._floors.get(key)
+        if entry is not None:
+            if current_time > entry[1]:
+                del self._floors[key]
+            else:
+                floor = entry[0]
+        
+        for prefix, (version, expires_at) in list(self._prefix_floors.items()):
+            if current_time > expires_at:
+                del self._prefix_floors[prefix]
+            elif key.startswith(prefix) and version > floor:
+                floor = version
+        return floor
     
     def get(self, key: str) -> Optional[Any]:
         """Получает значение из локального кэша."""
@@ -59,46 +264,90 @@ class LocalCache:
             current_time = time.time()
             
             if current_time > value['expires_at']:
-                del self._cache[key]
+                self._remove(key)
                 return None
             
             # Обновляем порядок использования (LRU)
             self._cache.move_to_end(key)
             return value['data']
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
-        """Сохраняет значение в локальный кэш."""
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, version: int = 0) -> bool:
+        """
+        Сохраняет значение в локальный кэш.
+        
+        Возвращает False, если запись отклонена как устаревшая по версии.
+        """
         with self._lock:
             self._cleanup_expired()
             
+            if version and version <= self._floor(key):
+                return False
+            current = self._cache.get(key)
+            if current is not None and current['version'] > version:
+                return False
+            
             if ttl is None:
                 ttl = self.default_ttl
             
             expires_at = time.time() + ttl
             
             # Если достигли лимита, удаляем самую старую запись
-            if len(self._cache) >= self.max_size:
-                self._cache.popitem(last=False)
+            if current is None and len(self._cache) >= self.max_size:
+                self._remove(next(iter(self._cache)))
             
             self._cache[key] = {
                 'data': value,
-                'expires_at': expires_at
+                'expires_at': expires_at,
+                'version': version
             }
+            if current is None:
+                self._prefix_index.setdefault(self._namespace(key), set()).add(key)
             # Перемещаем в конец (самая свежая запись)
             self._cache.move_to_end(key)
+            return True
     
     def delete(self, key: str) -> bool:
         """Удаляет значение из локального кэша."""
         with self._lock:
             if key in self._cache:
-                del self._cache[key]
+                self._remove(key)
                 return True
             return False
     
+    def invalidate(self, key: str, version: int) -> bool:
+        """Удаляет запись не новее version и запрещает возврат более старых версий."""
+        with self._lock:
+            entry = self._floors.get(key)
+            if entry is None or entry[0] < version:
+                self._floors[key] = (version, time.time() + self.floor_ttl)
+                self._floors.move_to_end(key)
+                while len(self._floors) > self.max_floors:
+                    self._floors.popitem(last=False)
+            
+            current = self._cache.get(key)
+            if current is not None and current['version'] <= version:
+                self._remove(key)
+                return True
+            return False
+    
+    def invalidate_prefix(self, prefix: str, version: int) -> int:
+        """Инвалидирует все записи с префиксом; пустой префикс - весь кэш."""
+        with self._lock:
+            entry = self._prefix_floors.get(prefix)
+            if entry is None or entry[0] < version:
+                self._prefix_floors[prefix] = (version, time.time() + self.floor_ttl)
+            
+            keys_to_delete = [k for k in self._keys_with_prefix(prefix)
+                              if self._cache[k]['version'] <= version]
+            for key in keys_to_delete:
+                self._remove(key)
+            return len(keys_to_delete)
+    
     def clear(self) -> None:
         """Очищает весь локальный кэш."""
         with self._lock:
             self._cache.clear()
+            self._prefix_index.clear()
     
     def size(self) -> int:
         """Возвращает количество записей в кэше."""
@@ -106,18 +355,184 @@ class LocalCache:
             self._cleanup_expired()
             return len(self._cache)
 
+class InvalidationBus(abc.ABC):
+    """
+    Шина сообщений об инвалидации L1 между процессами бота.
+
+    Сообщение - словарь {'origin', 'version'} плюс один из ключей
+    'key', 'keys' или 'prefix'. Обработчик on_reset вызывается, когда
+    сообщения могли быть потеряны (переподключение), и должен сбросить L1.
+    """
+
+    # Шине нужен живой Redis: пока он недоступен, публикация пропускается
+    requires_redis = False
+
+    @abc.abstractmethod
+    async def subscribe(self, handler: Callable[[Dict[str, Any]], None],
+                        on_reset: Optional[Callable[[], None]] = None) -> None:
+        """Подписывает обработчик на сообщения остальных процессов."""
+
+    @abc.abstractmethod
+    async def publish(self, message: Dict[str, Any]) -> None:
+        """Рассылает сообщение всем подписчикам."""
+
+    async def close(self) -> None:
+        pass
+
+class InMemoryInvalidationBus(InvalidationBus):
+    """
+    Шина в памяти: для одного процесса с несколькими менеджерами и для проверок без Redis.
+
+    Один экземпляр передаётся в несколько CacheManager, сообщения доставляются синхронно.
+    """
+
+    def __init__(self):
+        self._handlers: List[Callable[[Dict[str, Any]], None]] = []
+        self.published = 0
+
+    async def subscribe(self, handler: Callable[[Dict[str, Any]], None],
+                        on_reset: Optional[Callable[[], None]] = None) -> None:
+        self._handlers.append(handler)
+
+    async def unsubscribe(self, handler: Callable[[Dict[str, Any]], None]) -> None:
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    async def publish(self, message: Dict[str, Any]) -> None:
+        self.published += 1
+        for handler in list(self._handlers):
+            handler(dict(message))
+
+    async def close(self) -> None:
+        self._handlers.clear()
+
+class RedisInvalidationBus(InvalidationBus):
+    """
+    Шина поверх Redis pub/sub.
+
+    Публикация идёт через автоматический pipeline, подписка держит отдельное
+    соединение из пула. При обрыве подписки L1 сбрасывается целиком: сообщения
+    pub/sub не хранятся, и пропущенные инвалидации иначе не восстановить.
+    """
+
+    requires_redis = True
+
+    def __init__(self, client: "redis.Redis", channel: str, codec: CacheCodec,
+                 pipeline: Optional[RedisAutoPipeline] = None, reconnect_delay: float = 1.0):
+        self.client = client
+        self.channel = channel
+        self.codec = codec
+        self.pipeline = pipeline
+        self.reconnect_delay = reconnect_delay
+        self._listener_task: Optional[asyncio.Task] = None
+        self._handler: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._on_reset: Optional[Callable[[], None]] = None
+
+    async def subscribe(self, handler: Callable[[Dict[str, Any]], None],
+                        on_reset: Optional[Callable[[], None]] = None) -> None:
+        self._handler = handler
+        self._on_reset = on_reset
+        self._listener_task = asyncio.create_task(self._listen())
+
+    async def publish(self, message: Dict[str, Any]) -> None:
+        payload = self.codec.encode(message)
+        if self.pipeline is not None:
+            await self.pipeline.execute('publish', self.channel, payload)
+        else:
+            await self.client.publish(self.channel, payload)
+
+    async def _listen(self):
+        """Слушает канал инвалидации, переподписываясь после ошибок."""
+        delay = self.reconnect_delay
+        first_connect = True
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                if not first_connect and self._on_reset:
+                    logger.info("🔄 Подписка на инвалидацию восстановлена, сбрасываем L1")
+                    self._on_reset()
+                first_connect = False
+                delay = self.reconnect_delay
+                
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is None or message.get('type') != 'message':
+                        continue
+                    try:
+                        self._handler(self.codec.decode(message['data']))
+                    except Exception as e:
+                        logger.error("❌ Ошибка обработки сообщения инвалидации: %s", e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if delay == self.reconnect_delay:
+                    logger.warning("⚠️ Подписка на инвалидацию кэша прервана: %s", e)
+                else:
+                    logger.debug("Подписка на инвалидацию кэша всё ещё недоступна: %s", e)
+                first_connect = False
+                if self._on_reset:
+                    self._on_reset()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def close(self) -> None:
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+
 class CacheManager:
-    """Менеджер кэширования с поддержкой Redis и локального fallback."""
+    """
+    Менеджер кэширования с поддержкой Redis и локального fallback.
     
-    def __init__(self, redis_url: Optional[str] = None, local_cache_size: int = 1000):
+    Локальный кэш работает как L1 перед Redis (L2): чтение сначала идёт в L1,
+    записи и удаления рассылают инвалидацию остальным процессам через шину.
+    """
+    
+    def __init__(self, redis_url: Optional[str] = None, local_cache_size: int = 1000,
+                 max_connections: int = 20, connection_timeout: float = 5,
+                 near_cache_ttl: int = 60, invalidation_channel: str = "gofrobot:cache:invalidate",
+                 invalidation_bus: Optional[InvalidationBus] = None, scan_count: int = 500,
+                 refresh_ahead_interval: float = 10, hot_key_threshold: int = 5,
+                 hot_key_window: float = 300, max_refresh_candidates: int = 1000):
         self.redis_url = redis_url
+        self.scan_count = scan_count
+        self.index_prefix = "idx:"
+        self._index_prune_every = 10  # Чистить индексы каждую 10-ю проверку Redis
         self.redis_client: Optional[redis.Redis] = None
-        self.local_cache = LocalCache(max_size=local_cache_size)
+        self.max_connections = max_connections
+        self.connection_timeout = connection_timeout
+        self.codec = CacheCodec()
+        self._pool = None
+        self._pipeline: Optional[RedisAutoPipeline] = None
+        self.local_cache = LocalCache(max_size=local_cache_size, floor_ttl=max(near_cache_ttl, 1) * 2)
+        self.near_cache_ttl = near_cache_ttl
+        self.invalidation_channel = invalidation_channel
+        self.invalidation_bus = invalidation_bus
+        self.instance_id = uuid.uuid4().hex
+        self._last_version = 0
         self._redis_available = False
         self._redis_check_lock = asyncio.Lock()
         self._redis_check_task: Optional[asyncio.Task] = None
         self._redis_check_interval = 30  # Проверять доступность Redis каждые 30 секунд
         
+        # Stale-while-revalidate: загрузки в полёте и кандидаты на упреждающее обновление
+        self._inflight_loads: Dict[str, asyncio.Future] = {}
+        self._refresh_candidates: Dict[str, Dict[str, Any]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refresh_ahead_interval = refresh_ahead_interval
+        self.hot_key_threshold = hot_key_threshold
+        self.hot_key_window = hot_key_window
+        self.max_refresh_candidates = max_refresh_candidates
+        
         # Префиксы для разных типов данных
         self.prefixes = {
             'user': 'user:',
@@ -135,42 +550,74 @@ class CacheManager:
             'local_hits': 0,
             'local_misses': 0,
             'redis_errors': 0,
-            'fallbacks': 0
+            'fallbacks': 0,
+            'invalidations_sent': 0,
+            'invalidations_received': 0,
+            'stale_rejected': 0,
+            'stale_served': 0,
+            'swr_loads': 0,
+            'background_refreshes': 0,
+            'refresh_ahead': 0
         }
     
     async def initialize(self):
         """Инициализирует Redis-клиент и запускает фоновую проверку."""
         if REDIS_AVAILABLE and self.redis_url:
             try:
-                self.redis_client = redis.from_url(self.redis_url, decode_responses=True)
+                # Блокирующий пул: при исчерпании лимита ждём свободное соединение,
+                # а не падаем с "Too many connections"
+                self._pool = redis.BlockingConnectionPool.from_url(
+                    self.redis_url,
+                    max_connections=self.max_connections,
+                    timeout=self.connection_timeout,
+                    socket_connect_timeout=self.connection_timeout,
+                    socket_timeout=self.connection_timeout,
+                )
+                self.redis_client = redis.Redis(connection_pool=self._pool)
+                self._pipeline = RedisAutoPipeline(self.redis_client)
+                if self.invalidation_bus is None:
+                    self.invalidation_bus = RedisInvalidationBus(
+                        self.redis_client, self.invalidation_channel, self.codec, self._pipeline
+                    )
                 # Проверяем доступность Redis
                 await self.redis_client.ping()
                 self._redis_available = True
                 logger.info("✅ Redis подключен и доступен")
             except Exception as e:
-                logger.warning(f"⚠️ Redis недоступен, будет использоваться локальный кэш: {e}")
+                logger.warning("⚠️ Redis недоступен, будет использоваться локальный кэш: %s", e)
                 self._redis_available = False
         else:
             logger.info("📝 Redis не доступен, будет использоваться локальный кэш")
             self._redis_available = False
         
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.subscribe(self._on_invalidation, self._on_invalidation_reset)
+        
         # Запускаем фоновую проверку доступности Redis
         self._redis_check_task = asyncio.create_task(self._redis_health_check())
+        self._refresh_task = asyncio.create_task(self._refresh_ahead_loop())
     
     async def close(self):
         """Закрывает соединение с Redis."""
-        if self._redis_check_task:
-            self._redis_check_task.cancel()
-            try:
-                await self._redis_check_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self._redis_check_task, self._refresh_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        
+        if self.invalidation_bus is not None:
+            await self.invalidation_bus.close()
         
         if self.redis_client:
             await self.redis_client.close()
+        if self._pool is not None:
+            await self._pool.disconnect()
     
     async def _redis_health_check(self):
         """Фоновая проверка доступности Redis."""
+        checks = 0
         while True:
             try:
                 await asyncio.sleep(self._redis_check_interval)
@@ -184,10 +631,14 @@ class CacheManager:
                     logger.info("✅ Redis снова доступен")
                     self._redis_available = True
                     self.stats['fallbacks'] += 1
+                
+                checks += 1
+                if checks % self._index_prune_every == 0:
+                    await self._prune_indexes()
                     
             except Exception as e:
                 if self._redis_available:
-                    logger.warning(f"⚠️ Redis недоступен, переключаемся на локальный кэш: {e}")
+                    logger.warning("⚠️ Redis недоступен, переключаемся на локальный кэш: %s", e)
                     self._redis_available = False
                     self.stats['fallbacks'] += 1
                     self.stats['redis_errors'] += 1
@@ -196,85 +647,232 @@ class CacheManager:
         """Формирует полный ключ с префиксом."""
         return f"{self.prefixes.get(prefix, prefix)}{key}"
     
-    def _serialize(self, data: Any) -> str:
-        """Сериализует данные в JSON."""
+    def _index_key(self, namespace: str) -> str:
+        """Ключ множества Redis, в котором лежат все ключи пространства имён."""
+        return f"{self.index_prefix}{namespace}"
+    
+    async def _scan_index(self, namespace: str, pattern: str = "*"):
+        """
+        Обходит индекс префикса курсором SSCAN порциями по scan_count.
+        
+        Ключи, которые уже истекли по TTL, выбрасываются из индекса по пути,
+        наружу отдаются только существующие.
+        """
+        index_key = self._index_key(namespace)
+        cursor = 0
+        while True:
+            cursor, members = await self.redis_client.sscan(index_key, cursor, count=self.scan_count)
+            members = [m.decode('utf-8') if isinstance(m, bytes) else m for m in members]
+            if members:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for member in members:
+                    pipe.exists(member)
+                alive = await pipe.execute()
+                missing = [m for m, ok in zip(members, alive) if not ok]
+                if missing:
+                    await self.redis_client.srem(index_key, *missing)
+                batch = [m for m, ok in zip(members, alive) if ok and fnmatchcase(m, namespace + pattern)]
+                if batch:
+                    yield batch
+            if cursor == 0:
+                break
+    
+    async def _prune_indexes(self) -> None:
+        """Убирает из индексов ключи, истёкшие по TTL."""
+        for namespace in self.prefixes.values():
+            try:
+                async for _ in self._scan_index(namespace):
+                    pass
+            except Exception as e:
+                logger.warning("⚠️ Не удалось почистить индекс %s: %s", namespace, e)
+                return
+    
+    async def rebuild_prefix_index(self, prefix: str) -> int:
+        """
+        Заполняет индекс префикса по существующим ключам (SCAN MATCH).
+        
+        Нужен один раз для ключей, записанных до появления индексов.
+        """
+        namespace = self.prefixes.get(prefix, prefix)
+        index_key = self._index_key(namespace)
+        added = 0
+        batch = []
+        async for key in self.redis_client.scan_iter(match=f"{namespace}*", count=self.scan_count):
+            batch.append(key)
+            if len(batch) >= self.scan_count:
+                added += await self.redis_client.sadd(index_key, *batch)
+                batch = []
+        if batch:
+            added += await self.redis_client.sadd(index_key, *batch)
+        return added
+    
+    async def ensure_prefix_indexes(self) -> int:
+        """
+        Строит индексы префиксов, которых ещё нет в Redis.
+        
+        Ключи, записанные до появления индексов, иначе не видны keys/clear:
+        restore_all_data после clear('user') оставил бы старых игроков.
+        """
+        if not self._redis_available:
+            return 0
+        added = 0
+        for prefix, namespace in self.prefixes.items():
+            try:
+                if await self.redis_client.exists(self._index_key(namespace)):
+                    continue
+                rebuilt = await self.rebuild_prefix_index(prefix)
+            except Exception as e:
+                logger.warning("⚠️ Не удалось построить индекс %s: %s", namespace, e)
+                continue
+            if rebuilt:
+                logger.info("🗂 Индекс %s построен: %d ключей", namespace, rebuilt)
+            added += rebuilt
+        return added
+    
+    def _serialize(self, data: Any, version: Optional[int] = None) -> bytes:
+        """Сериализует данные бинарным кодеком."""
         try:
-            return json.dumps(data, ensure_ascii=False, default=str)
+            return self.codec.encode(data, version)
         except Exception as e:
-            logger.error(f"❌ Ошибка сериализации данных: {e}")
-            return json.dumps({"error": "serialization_failed", "data": str(data)})
+            logger.error("❌ Ошибка сериализации данных: %s", e)
+            return self.codec.encode({"error": "serialization_failed", "data": str(data)}, version)
     
-    def _deserialize(self, data: str) -> Any:
-        """Десериализует данные из JSON."""
+    def _deserialize(self, data: Union[bytes, str]) -> Tuple[int, Any]:
+        """Десериализует данные бинарным кодеком, возвращая (версия, данные)."""
         try:
-            return json.loads(data)
+            return self.codec.decode_versioned(data)
         except Exception as e:
-            logger.error(f"❌ Ошибка десериализации данных: {e}")
-            return None
+            logger.error("❌ Ошибка десериализации данных: %s", e)
+            return 0, None
+    
+    def _next_version(self) -> int:
+        """Монотонный штамп версии записи (наносекунды, строго возрастает в процессе)."""
+        self._last_version = max(time.time_ns(), self._last_version + 1)
+        return self._last_version
+    
+    def _local_ttl(self, ttl: Optional[int]) -> Optional[int]:
+        """TTL записи в L1: при живом Redis не дольше near_cache_ttl."""
+        if not self._redis_available:
+            return ttl
+        if ttl is None:
+            return self.near_cache_ttl
+        return min(ttl, self.near_cache_ttl)
+    
+    def _fill_local(self, full_key: str, value: Any, ttl: Optional[int], version: int) -> None:
+        """Кладёт значение в L1, учитывая отказ по версии."""
+        if not self.local_cache.set(full_key, value, ttl, version):
+            self.stats['stale_rejected'] += 1
+    
+    async def _publish_invalidation(self, message: Dict[str, Any]) -> None:
+        """Рассылает инвалидацию остальным процессам."""
+        if self.invalidation_bus is None:
+            return
+        if self.invalidation_bus.requires_redis and not self._redis_available:
+            # Без Redis сообщение всё равно не дойдёт, а пул заставит ждать таймаут
+            return
+        message['origin'] = self.instance_id
+        try:
+            await self.invalidation_bus.publish(message)
+            self.stats['invalidations_sent'] += 1
+        except Exception as e:
+            logger.warning("⚠️ Не удалось разослать инвалидацию кэша: %s", e)
+    
+    def _on_invalidation(self, message: Dict[str, Any]) -> None:
+        """Применяет чужую инвалидацию к L1."""
+        if message.get('origin') == self.instance_id:
+            return
+        self.stats['invalidations_received'] += 1
+        version = int(message.get('version', 0))
+        if 'key' in message:
+            self.local_cache.invalidate(message['key'], version)
+        for key in message.get('keys', ()):
+            self.local_cache.invalidate(key, version)
+        if 'prefix' in message:
+            self.local_cache.invalidate_prefix(message['prefix'], version)
+    
+    def _on_invalidation_reset(self) -> None:
+        """Сообщения могли потеряться - L1 больше не доверяем."""
+        self.local_cache.clear()
+    
+    def _redis(self, command: str, *args) -> asyncio.Future:
+        """Отправляет команду Redis через автоматический pipeline."""
+        return self._pipeline.execute(command, *args)
     
     async def get(self, prefix: str, key: str) -> Optional[Any]:
-        """Получает значение из кэша (Redis или локального)."""
+        """Получает значение из кэша: сначала L1, затем Redis."""
         full_key = self._get_key(prefix, key)
         
+        value = self.local_cache.get(full_key)
+        if value is not None:
+            self.stats['local_hits'] += 1
+            return value
+        self.stats['local_misses'] += 1
+        
         if self._redis_available:
             try:
-                value = await self.redis_client.get(full_key)
-                if value is not None:
+                raw = await self._redis('get', full_key)
+                if raw is not None:
                     self.stats['redis_hits'] += 1
-                    return self._deserialize(value)
+                    version, value = self._deserialize(raw)
+                    if value is not None:
+                        self._fill_local(full_key, value, self.near_cache_ttl, version)
+                    return value
                 else:
                     self.stats['redis_misses'] += 1
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при получении {full_key}: {e}")
+                logger.error("❌ Ошибка Redis при получении %s: %s", full_key, e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
-        # Fallback на локальный кэш
-        value = self.local_cache.get(full_key)
-        if value is not None:
-            self.stats['local_hits'] += 1
-            return value
-        else:
-            self.stats['local_misses'] += 1
-            return None
+        return None
     
     async def set(self, prefix: str, key: str, value: Any, ttl: Optional[int] = None) -> None:
-        """Сохраняет значение в кэш (Redis или локальный)."""
+        """Сохраняет значение в кэш (Redis и L1) и инвалидирует L1 других процессов."""
         full_key = self._get_key(prefix, key)
-        serialized_value = self._serialize(value)
+        version = self._next_version()
+        serialized_value = self._serialize(value, version)
         
         # Сохраняем в Redis, если он доступен
         if self._redis_available:
             try:
                 if ttl:
-                    await self.redis_client.setex(full_key, ttl, serialized_value)
+                    write = self._redis('setex', full_key, ttl, serialized_value)
                 else:
-                    await self.redis_client.set(full_key, serialized_value)
+                    write = self._redis('set', full_key, serialized_value)
+                # Запись и индекс уходят в одном pipeline
+                index = self._redis('sadd', self._index_key(self.prefixes.get(prefix, prefix)), full_key)
+                await asyncio.gather(write, index)
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при сохранении {full_key}: {e}")
+                logger.error("❌ Ошибка Redis при сохранении %s: %s", full_key, e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
         # Сохраняем в локальный кэш
-        self.local_cache.set(full_key, value, ttl)
+        self._fill_local(full_key, value, self._local_ttl(ttl), version)
+        await self._publish_invalidation({'key': full_key, 'version': version})
     
     async def delete(self, prefix: str, key: str) -> bool:
         """Удаляет значение из кэша."""
         full_key = self._get_key(prefix, key)
+        version = self._next_version()
         deleted = False
         
         # Удаляем из Redis
         if self._redis_available:
             try:
-                result = await self.redis_client.delete(full_key)
+                result, _ = await asyncio.gather(
+                    self._redis('unlink', full_key),
+                    self._redis('srem', self._index_key(self.prefixes.get(prefix, prefix)), full_key),
+                )
                 deleted = result > 0
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при удалении {full_key}: {e}")
+                logger.error("❌ Ошибка Redis при удалении %s: %s", full_key, e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
         # Удаляем из локального кэша
-        local_deleted = self.local_cache.delete(full_key)
+        local_deleted = self.local_cache.invalidate(full_key, version)
+        await self._publish_invalidation({'key': full_key, 'version': version})
         
         return deleted or local_deleted
     
@@ -284,63 +882,72 @@ class CacheManager:
         
         if self._redis_available:
             try:
-                result = await self.redis_client.exists(full_key)
+                result = await self._redis('exists', full_key)
                 if result > 0:
                     return True
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при проверке существования {full_key}: {e}")
+                logger.error("❌ Ошибка Redis при проверке существования %s: %s", full_key, e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
         return self.local_cache.get(full_key) is not None
     
     async def keys(self, prefix: str, pattern: str = "*") -> List[str]:
-        """Получает список ключей по шаблону."""
-        full_pattern = f"{self.prefixes.get(prefix, prefix)}{pattern}"
+        """Получает список ключей по шаблону (через индекс префикса, без KEYS)."""
+        namespace = self.prefixes.get(prefix, prefix)
         keys = []
         
         if self._redis_available:
             try:
-                redis_keys = await self.redis_client.keys(full_pattern)
-                keys.extend(redis_keys)
+                async for batch in self._scan_index(namespace, pattern):
+                    keys.extend(batch)
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при получении ключей по шаблону {full_pattern}: {e}")
+                logger.error("❌ Ошибка Redis при получении ключей %s%s: %s", namespace, pattern, e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
         # Добавляем ключи из локального кэша
-        local_keys = [k for k in self.local_cache._cache.keys() if k.startswith(full_pattern[:-1])]
-        keys.extend(local_keys)
+        full_pattern = namespace + pattern
+        keys.extend(k for k in self.local_cache.keys_with_prefix(namespace) if fnmatchcase(k, full_pattern))
         
         return list(set(keys))  # Удаляем дубликаты
     
     async def clear(self, prefix: Optional[str] = None) -> None:
-        """Очищает кэш (всего или по префиксу)."""
-        if prefix:
-            pattern = f"{self.prefixes.get(prefix, prefix)}*"
-        else:
-            pattern = "*"
+        """
+        Очищает кэш (всего или по префиксу).
+        
+        По префиксу удаляются ключи из его индекса порциями UNLINK, полная
+        очистка идёт курсором SCAN - Redis не блокируется на весь keyspace.
+        """
+        version = self._next_version()
+        namespace = self.prefixes.get(prefix, prefix) if prefix else None
         
         # Очищаем Redis
         if self._redis_available:
             try:
-                keys = await self.redis_client.keys(pattern)
-                if keys:
-                    await self.redis_client.delete(*keys)
+                if namespace is not None:
+                    index_key = self._index_key(namespace)
+                    async for batch in self._scan_index(namespace):
+                        await self.redis_client.unlink(*batch)
+                        await self.redis_client.srem(index_key, *batch)
+                else:
+                    batch = []
+                    async for key in self.redis_client.scan_iter(match="*", count=self.scan_count):
+                        batch.append(key)
+                        if len(batch) >= self.scan_count:
+                            await self.redis_client.unlink(*batch)
+                            batch = []
+                    if batch:
+                        await self.redis_client.unlink(*batch)
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при очистке кэша по шаблону {pattern}: {e}")
+                logger.error("❌ Ошибка Redis при очистке кэша %s: %s", namespace or '*', e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
-        # Очищаем локальный кэш
-        if prefix:
-            # Удаляем только ключи с указанным префиксом
-            keys_to_delete = [k for k in self.local_cache._cache.keys() if k.startswith(self.prefixes.get(prefix, prefix))]
-            for key in keys_to_delete:
-                self.local_cache.delete(key)
-        else:
-            # Очищаем весь локальный кэш
-            self.local_cache.clear()
+        # Очищаем локальный кэш: пустой префикс инвалидирует всё
+        local_prefix = namespace or ''
+        self.local_cache.invalidate_prefix(local_prefix, version)
+        await self._publish_invalidation({'prefix': local_prefix, 'version': version})
     
     def get_stats(self) -> Dict[str, Any]:
         """Возвращает статистику использования кэша."""
@@ -348,8 +955,11 @@ class CacheManager:
             **self.stats,
             'local_cache_size': self.local_cache.size(),
             'redis_available': self._redis_available,
+            'pipeline_batches': self._pipeline.batches if self._pipeline else 0,
+            'pipelined_commands': self._pipeline.commands if self._pipeline else 0,
             'total_hits': self.stats['redis_hits'] + self.stats['local_hits'],
             'total_misses': self.stats['redis_misses'] + self.stats['local_misses'],
+            'hot_keys': sum(1 for spec in self._refresh_candidates.values() if self._is_hot(spec)),
             'hit_rate': self._calculate_hit_rate()
         }
     
@@ -363,81 +973,229 @@ class CacheManager:
         
         return (total_hits / total_requests) * 100
     
-    async def warmup_cache(self, data_loader_func, prefix: str, keys: List[str]) -> None:
-        """Прогревает кэш, загружая данные из источника."""
-        logger.info(f"🔥 Прогрев кэша для {prefix}, ключи: {len(keys)}")
+    # ==================== STALE-WHILE-REVALIDATE ====================
+    
+    async def get_or_load(self, prefix: str, key: str, loader: Callable[[], Awaitable[Any]],
+                          soft_ttl: int, hard_ttl: int) -> Any:
+        """
+        Возвращает значение с семантикой stale-while-revalidate.
         
-        for key in keys:
+        До soft_ttl значение свежее. После soft_ttl и до hard_ttl отдаётся
+        сразу, а в фоне запускается одна перезагрузка на ключ. После hard_ttl
+        (ключ истёк в кэше) вызов ждёт loader, параллельные вызовы ждут одну загрузку.
+        """
+        full_key = self._get_key(prefix, key)
+        spec = self._track_access(full_key, prefix, key, loader, soft_ttl, hard_ttl)
+        
+        envelope = await self.get(prefix, key)
+        if isinstance(envelope, dict) and envelope.get('__swr__'):
+            if spec is not None:
+                spec['soft_expires_at'] = envelope['soft_expires_at']
+            if time.time() < envelope['soft_expires_at']:
+                return envelope['value']
+            
+            self.stats['stale_served'] += 1
+            if full_key not in self._inflight_loads:
+                self.stats['background_refreshes'] += 1
+                self._start_load(full_key, prefix, key, loader, soft_ttl, hard_ttl)
+            return envelope['value']
+        
+        return await asyncio.shield(self._start_load(full_key, prefix, key, loader, soft_ttl, hard_ttl))
+    
+    def register_hot_key(self, prefix: str, key: str, loader: Callable[[], Awaitable[Any]],
+                         soft_ttl: int, hard_ttl: int) -> None:
+        """Закрепляет ключ за упреждающим обновлением независимо от числа обращений."""
+        full_key = self._get_key(prefix, key)
+        self._refresh_candidates[full_key] = {
+            'prefix': prefix, 'key': key, 'loader': loader,
+            'soft_ttl': soft_ttl, 'hard_ttl': hard_ttl,
+            'soft_expires_at': 0.0, 'hits': 0, 'pinned': True
+        }
+    
+    def _track_access(self, full_key: str, prefix: str, key: str, loader: Callable[[], Awaitable[Any]],
+                      soft_ttl: int, hard_ttl: int) -> Optional[Dict[str, Any]]:
+        """Считает обращения к ключу, чтобы выявлять горячие ключи."""
+        spec = self._refresh_candidates.get(full_key)
+        if spec is None:
+            if len(self._refresh_candidates) >= self.max_refresh_candidates:
+                return None
+            spec = {
+                'prefix': prefix, 'key': key, 'soft_expires_at': 0.0,
+                'hits': 0, 'pinned': False
+            }
+            self._refresh_candidates[full_key] = spec
+        spec.update(loader=loader, soft_ttl=soft_ttl, hard_ttl=hard_ttl)
+        spec['hits'] += 1
+        return spec
+    
+    def _is_hot(self, spec: Dict[str, Any]) -> bool:
+        return spec['pinned'] or spec['hits'] >= self.hot_key_threshold
+    
+    def _start_load(self, full_key: str, prefix: str, key: str, loader: Callable[[], Awaitable[Any]],
+                    soft_ttl: int, hard_ttl: int) -> asyncio.Future:
+        """Запускает загрузку ключа или возвращает уже идущую."""
+        task = self._inflight_loads.get(full_key)
+        if task is not None:
+            return task
+        
+        task = asyncio.ensure_future(self._load_and_store(full_key, prefix, key, loader, soft_ttl, hard_ttl))
+        self._inflight_loads[full_key] = task
+        
+        def _done(t: asyncio.Future):
+            if self._inflight_loads.get(full_key) is t:
+                del self._inflight_loads[full_key]
+            if not t.cancelled() and t.exception() is not None:
+                logger.error("❌ Ошибка загрузки %s в кэш: %s", full_key, t.exception())
+        
+        task.add_done_callback(_done)
+        return task
+    
+    async def _load_and_store(self, full_key: str, prefix: str, key: str,
+                              loader: Callable[[], Awaitable[Any]], soft_ttl: int, hard_ttl: int) -> Any:
+        self.stats['swr_loads'] += 1
+        value = await loader()
+        soft_expires_at = time.time() + soft_ttl
+        await self.set(prefix, key, {'__swr__': 1, 'value': value, 'soft_expires_at': soft_expires_at}, ttl=hard_ttl)
+        
+        spec = self._refresh_candidates.get(full_key)
+        if spec is not None:
+            spec['soft_expires_at'] = soft_expires_at
+        return value
+    
+    async def _refresh_ahead_loop(self):
+        """
+        Упреждающее обновление горячих ключей.
+        
+        Горячий ключ (закреплённый или с hot_key_threshold обращений за окно)
+        перезагружается, когда до его мягкого TTL остаётся меньше двух тиков,
+        так что читатели не видят ни промаха, ни устаревшего значения.
+        """
+        window_started = time.time()
+        while True:
             try:
-                # Проверяем, есть ли уже в кэше
-                if await self.exists(prefix, key):
-                    continue
+                await asyncio.sleep(self.refresh_ahead_interval)
+                now = time.time()
+                margin = self.refresh_ahead_interval * 2
                 
-                # Загружаем данные из источника
-                data = await data_loader_func(key)
-                if data is not None:
-                    await self.set(prefix, key, data, ttl=3600)  # TTL 1 час
-                    
+                for full_key, spec in list(self._refresh_candidates.items()):
+                    if not self._is_hot(spec) or full_key in self._inflight_loads:
+                        continue
+                    if spec['soft_expires_at'] - now < margin:
+                        self.stats['refresh_ahead'] += 1
+                        self._start_load(full_key, spec['prefix'], spec['key'], spec['loader'],
+                                         spec['soft_ttl'], spec['hard_ttl'])
+                
+                # Новое окно подсчёта: холодные ключи забываем
+                if now - window_started >= self.hot_key_window:
+                    window_started = now
+                    for full_key, spec in list(self._refresh_candidates.items()):
+                        if spec['pinned']:
+                            continue
+                        if spec['hits'] == 0:
+                            del self._refresh_candidates[full_key]
+                        else:
+                            spec['hits'] = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ Ошибка упреждающего обновления кэша: %s", e)
+    
+    async def warmup_cache(self, data_loader_func: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+                           prefix: str, keys: List[str], ttl: int = 3600, batch_size: int = 200,
+                           soft_ttl: Optional[int] = None,
+                           guard: Optional[Callable[[List[str]], AsyncContextManager]] = None) -> int:
+        """
+        Прогревает кэш пачками: один запрос к источнику и один batch_set на пачку.
+        
+        data_loader_func получает список ключей и возвращает {ключ: значение}.
+        С soft_ttl значения кладутся в формате stale-while-revalidate (для get_or_load).
+        guard(пачка) - контекст, под которым пачка читается и пишется в кэш
+        (очереди игроков: иначе прогрев затрёт запись, закоммиченную между ними).
+        Возвращает число записей, попавших в кэш.
+        """
+        loaded = 0
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            try:
+                async with guard(chunk) if guard is not None else nullcontext():
+                    data = await data_loader_func(chunk)
+                    if not data:
+                        continue
+                    if soft_ttl is not None:
+                        soft_expires_at = time.time() + soft_ttl
+                        data = {key: {'__swr__': 1, 'value': value, 'soft_expires_at': soft_expires_at}
+                                for key, value in data.items()}
+                    await self.batch_set(prefix, data, ttl=ttl)
+                loaded += len(data)
             except Exception as e:
-                logger.error(f"❌ Ошибка при прогреве кэша для {prefix}:{key}: {e}")
+                logger.error("❌ Ошибка при прогреве кэша для %s (%s ключей): %s", prefix, len(chunk), e)
+        return loaded
     
     async def batch_get(self, prefix: str, keys: List[str]) -> Dict[str, Optional[Any]]:
-        """Пакетное получение значений из кэша."""
+        """Пакетное получение значений из кэша: L1, затем один MGET по промахам."""
         results = {}
+        missing = []
         
-        if self._redis_available:
+        for key in keys:
+            value = self.local_cache.get(self._get_key(prefix, key))
+            if value is not None:
+                results[key] = value
+                self.stats['local_hits'] += 1
+            else:
+                missing.append(key)
+                self.stats['local_misses'] += 1
+        
+        if missing and self._redis_available:
             try:
-                full_keys = [self._get_key(prefix, key) for key in keys]
+                full_keys = [self._get_key(prefix, key) for key in missing]
                 values = await self.redis_client.mget(*full_keys)
                 
-                for key, value in zip(keys, values):
-                    if value is not None:
-                        results[key] = self._deserialize(value)
+                for key, full_key, raw in zip(missing, full_keys, values):
+                    if raw is not None:
+                        version, value = self._deserialize(raw)
+                        results[key] = value
                         self.stats['redis_hits'] += 1
+                        if value is not None:
+                            self._fill_local(full_key, value, self.near_cache_ttl, version)
                     else:
                         self.stats['redis_misses'] += 1
                         
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при пакетном получении: {e}")
+                logger.error("❌ Ошибка Redis при пакетном получении: %s", e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
-        # Fallback на локальный кэш для пропущенных ключей
-        for key in keys:
-            if key not in results:
-                full_key = self._get_key(prefix, key)
-                value = self.local_cache.get(full_key)
-                if value is not None:
-                    results[key] = value
-                    self.stats['local_hits'] += 1
-                else:
-                    self.stats['local_misses'] += 1
-        
         return results
     
     async def batch_set(self, prefix: str, data: Dict[str, Any], ttl: Optional[int] = None) -> None:
         """Пакетное сохранение значений в кэш."""
+        version = self._next_version()
+        full_keys = {key: self._get_key(prefix, key) for key in data}
+        
         # Сохраняем в Redis
         if self._redis_available:
             try:
-                pipe = self.redis_client.pipeline()
+                pipe = self.redis_client.pipeline(transaction=False)
                 for key, value in data.items():
-                    full_key = self._get_key(prefix, key)
-                    serialized_value = self._serialize(value)
+                    serialized_value = self._serialize(value, version)
                     if ttl:
-                        pipe.setex(full_key, ttl, serialized_value)
+                        pipe.setex(full_keys[key], ttl, serialized_value)
                     else:
-                        pipe.set(full_key, serialized_value)
+                        pipe.set(full_keys[key], serialized_value)
+                if full_keys:
+                    pipe.sadd(self._index_key(self.prefixes.get(prefix, prefix)), *full_keys.values())
                 await pipe.execute()
             except Exception as e:
-                logger.error(f"❌ Ошибка Redis при пакетном сохранении: {e}")
+                logger.error("❌ Ошибка Redis при пакетном сохранении: %s", e)
                 self.stats['redis_errors'] += 1
                 self._redis_available = False
         
         # Сохраняем в локальный кэш
+        local_ttl = self._local_ttl(ttl)
         for key, value in data.items():
-            full_key = self._get_key(prefix, key)
-            self.local_cache.set(full_key, value, ttl)
+            self._fill_local(full_keys[key], value, local_ttl, version)
+        if full_keys:
+            await self._publish_invalidation({'keys': list(full_keys.values()), 'version': version})
 
 # Глобальный экземпляр менеджера кэша
 _cache_manager: Optional[CacheManager] = None
@@ -448,19 +1206,48 @@ def get_cache_manager() -> CacheManager:
     if _cache_manager is None:
         # Пытаемся получить URL Redis из конфигурации
         redis_url = None
+        redis_config: Dict[str, Any] = {}
+        refresh_config: Dict[str, Any] = {}
         try:
             import config
-            redis_url = getattr(config, 'REDIS_URL', None)
+            redis_config = getattr(config, 'REDIS_CONFIG', {})
+            refresh_config = getattr(config, 'CACHE_REFRESH_CONFIG', {})
+            redis_url = getattr(config, 'REDIS_URL', None) or os.getenv('REDIS_URL')
+            if not redis_url and redis_config.get('enabled'):
+                password = redis_config.get('password')
+                auth = f":{quote(str(password), safe='')}@" if password else ""
+                redis_url = (f"redis://{auth}{redis_config.get('host', 'localhost')}:"
+                             f"{redis_config.get('port', 6379)}/{redis_config.get('db', 0)}")
         except ImportError:
             pass
         
-        _cache_manager = CacheManager(redis_url=redis_url)
+        _cache_manager = CacheManager(
+            redis_url=redis_url,
+            max_connections=redis_config.get('max_connections', 20),
+            connection_timeout=redis_config.get('connection_timeout', 5),
+            near_cache_ttl=redis_config.get('near_cache_ttl', 60),
+            invalidation_channel=redis_config.get('invalidation_channel', "gofrobot:cache:invalidate"),
+            scan_count=redis_config.get('scan_count', 500),
+            refresh_ahead_interval=refresh_config.get('refresh_ahead_interval', 10),
+            hot_key_threshold=refresh_config.get('hot_key_threshold', 5),
+            hot_key_window=refresh_config.get('hot_key_window', 300),
+        )
     return _cache_manager
 
 async def initialize_cache():
     """Инициализирует менеджер кэша."""
     cache_manager = get_cache_manager()
     await cache_manager.initialize()
+    await cache_manager.ensure_prefix_indexes()
+    
+    # Глобальный топ смотрят все - держим его тёплым всегда
+    for limit in (10, 50):
+        cache_manager.register_hot_key(
+            'stats', f"top:gofra:{limit}",
+            lambda limit=limit: _load_top_players(limit, "gofra"),
+            _refresh_setting('leaderboard_soft_ttl', 60),
+            _refresh_setting('leaderboard_hard_ttl', 900),
+        )
 
 async def close_cache():
     """Закрывает менеджер кэша."""
@@ -499,42 +1286,107 @@ async def clear_cache(prefix: Optional[str] = None) -> None:
     cache_manager = get_cache_manager()
     await cache_manager.clear(prefix)
 
-# Пример использования в db_manager.py
+# db_manager.get_patsan/save_patsan сами читают и пишут через кэш,
+# обёртки оставлены для совместимости
 async def get_patsan_cached(user_id: int) -> Optional[Dict[str, Any]]:
     """Получает данные пользователя из кэша или базы данных."""
-    # Сначала пробуем получить из кэша
-    cached_data = await cache_get('user', str(user_id))
-    if cached_data:
-        return cached_data
-    
-    # Если нет в кэше, получаем из базы данных
     from db_manager import get_patsan
-    db_data = await get_patsan(user_id)
-    
-    # Сохраняем в кэш на 5 минут
-    if db_data:
-        await cache_set('user', str(user_id), db_data, ttl=300)
-    
-    return db_data
+    return await get_patsan(user_id)
 
 async def save_patsan_cached(user_id: int, data: Dict[str, Any]) -> None:
     """Сохраняет данные пользователя в базу данных и кэш."""
     from db_manager import save_patsan
     await save_patsan(data)
-    
-    # Обновляем кэш
-    await cache_set('user', str(user_id), data, ttl=300)
 
-async def get_chat_stats_cached(chat_id: int) -> Optional[Dict[str, Any]]:
-    """Получает статистику чата из кэша или базы данных."""
-    cached_data = await cache_get('chat', str(chat_id))
-    if cached_data:
-        return cached_data
+async def warmup_from_database(users_limit: int = 500, chats_limit: int = 100,
+                               batch_size: int = 200) -> Dict[str, Any]:
+    """
+    Прогрев кэша после старта: недавно активные игроки и чаты.
     
-    from db_manager import ChatManager
-    db_data = await ChatManager.get_chat_stats(chat_id)
+    Игроки берутся по updated_at, чаты по last_activity; данные грузятся
+    пачками IN (...) и пишутся через batch_set. Статистика чатов кладётся
+    в формате stale-while-revalidate, как её читает get_chat_stats_cached.
+    """
+    from db_manager import (
+        get_recently_active_user_ids, get_recently_active_chat_ids,
+        get_multiple_users, get_multiple_chat_stats, USER_CACHE_TTL
+    )
+    from utils.keyed_executor import get_user_executor
+    cache_manager = get_cache_manager()
+    started = time.perf_counter()
+    
+    async def load_users(keys: List[str]) -> Dict[str, Any]:
+        users = await get_multiple_users([int(k) for k in keys])
+        return {str(user_id): data for user_id, data in users.items()}
     
-    if db_data:
-        await cache_set('chat', str(chat_id), db_data, ttl=600)  # 10 минут
+    async def load_chats(keys: List[str]) -> Dict[str, Any]:
+        chats = await get_multiple_chat_stats([int(k) for k in keys])
+        return {str(chat_id): data for chat_id, data in chats.items()}
     
-    return db_data
\ No newline at end of file
+    users = chats = 0
+    try:
+        user_ids = await get_recently_active_user_ids(users_limit)
+        users = await cache_manager.warmup_cache(
+            load_users, 'user', [str(u) for u in user_ids], ttl=USER_CACHE_TTL, batch_size=batch_size,
+            guard=lambda chunk: get_user_executor().lock(*(int(k) for k in chunk))
+        )
+        
+        chat_ids = await get_recently_active_chat_ids(chats_limit)
+        chats = await cache_manager.warmup_cache(
+            load_chats, 'chat', [str(c) for c in chat_ids],
+            ttl=_refresh_setting('chat_stats_hard_ttl', 900), batch_size=batch_size,
+            soft_ttl=_refresh_setting('chat_stats_soft_ttl', 60),
+        )
+    except Exception as e:
+        logger.error("❌ Прогрев кэша прерван: %s", e)
+    
+    elapsed = time.perf_counter() - started
+    logger.info("🔥 Прогрев кэша: %s игроков, %s чатов за %.2fс", users, chats, elapsed)
+    return {'users': users, 'chats': chats, 'seconds': elapsed}
+
+def _refresh_setting(name: str, default: int) -> int:
+    """Читает настройку SWR из CACHE_REFRESH_CONFIG."""
+    try:
+        import config
+        return getattr(config, 'CACHE_REFRESH_CONFIG', {}).get(name, default)
+    except ImportError:
+        return default
+
+async def _load_top_players(limit: int, sort_by: str) -> List[Dict[str, Any]]:
+    from db_manager import get_top_players
+    return await get_top_players(limit=limit, sort_by=sort_by)
+
+async def get_top_players_cached(limit: int = 10, sort_by: str = "gofra") -> List[Dict[str, Any]]:
+    """Глобальный топ со stale-while-revalidate (для экранов просмотра)."""
+    return await get_cache_manager().get_or_load(
+        'stats', f"top:{sort_by}:{limit}",
+        lambda: _load_top_players(limit, sort_by),
+        _refresh_setting('leaderboard_soft_ttl', 60),
+        _refresh_setting('leaderboard_hard_ttl', 900),
+    )
+
+async def get_chat_top_cached(chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    """Топ чата со stale-while-revalidate; топы активных чатов обновляются заранее."""
+    from db_manager import ChatManager
+    return await get_cache_manager().get_or_load(
+        'chat', f"top:{chat_id}:{limit}",
+        lambda: ChatManager.get_chat_top(chat_id, limit=limit),
+        _refresh_setting('chat_top_soft_ttl', 30),
+        _refresh_setting('chat_top_hard_ttl', 600),
+    )
+
+async def get_chat_stats_cached(chat_id: int) -> Optional[Dict[str, Any]]:
+    """Статистика чата со stale-while-revalidate."""
+    from db_manager import ChatManager
+    return await get_cache_manager().get_or_load(
+        'chat', str(chat_id),
+        lambda: ChatManager.get_chat_stats(chat_id),
+        _refresh_setting('chat_stats_soft_ttl', 60),
+        _refresh_setting('chat_stats_hard_ttl', 900),
+    )
+
+
+# Спаны вокруг обращений к кэшу; модульные обёртки выше вызывают эти же методы
+instrument_class(CacheManager, "cache", (
+    "get", "set", "delete", "exists", "get_or_load", "batch_get", "batch_set"
+))
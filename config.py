@@ -68,7 +68,90 @@ REDIS_CONFIG = {
     "password": None,
     "cache_ttl": 3600,  # 1 час по умолчанию
     "connection_timeout": 5,  # 5 секунд таймаут
-    "max_connections": 20  # Максимум 20 соединений
+    "max_connections": 20,  # Максимум 20 соединений
+    "near_cache_ttl": 60,  # Сколько секунд запись живёт в локальном L1 перед Redis
+    "invalidation_channel": "gofrobot:cache:invalidate",  # Канал pub/sub для инвалидации L1
+    "scan_count": 500  # Размер порции SCAN/SSCAN/UNLINK при обходе ключей
+}
+
+# Stale-while-revalidate: после мягкого TTL отдаём старое и обновляем в фоне,
+# после жёсткого TTL значение пропадает из кэша
+CACHE_REFRESH_CONFIG = {
+    "leaderboard_soft_ttl": 60,
+    "leaderboard_hard_ttl": 900,
+    "chat_top_soft_ttl": 30,
+    "chat_top_hard_ttl": 600,
+    "chat_stats_soft_ttl": 60,
+    "chat_stats_hard_ttl": 900,
+    "refresh_ahead_interval": 10,  # Как часто проверять горячие ключи (секунды)
+    "hot_key_threshold": 5,        # Обращений за окно, чтобы ключ стал горячим
+    "hot_key_window": 300          # Окно подсчёта обращений (секунды)
+}
+
+# Прогрев кэша при старте (в фоне, polling не ждёт)
+CACHE_WARMUP_CONFIG = {
+    "enabled": True,
+    "users_limit": 500,   # Сколько последних активных игроков загрузить
+    "chats_limit": 100,   # Сколько последних активных чатов загрузить
+    "batch_size": 200     # Ключей на один запрос IN (...) и один batch_set
+}
+
+# История радёмок: в горячей таблице только свежие бои, старые уходят
+# в помесячные архивные таблицы rademka_fights_archive_YYYYMM
+FIGHT_HISTORY_CONFIG = {
+    "hot_retention": 2 * 86400,  # Сколько секунд бой лежит в rademka_fights
+    "archive_interval": 3600,    # Как часто переносить старые бои (секунды)
+    "archive_batch_size": 1000   # Боёв за одну транзакцию переноса
+}
+
+# Хранилище состояний FSM (fsm_storage.py)
+FSM_STORAGE_CONFIG = {
+    "backend": "sqlite",   # sqlite | redis | memory
+    "state_ttl": 86400,    # Брошенное состояние (смена ника без ответа) живёт сутки
+    "cache_ttl": 600,      # Сколько держать в памяти состояние без обращений
+    "flush_interval": 2.0  # Задержка отложенной записи в базу (секунды)
+}
+
+# Статистика SQL-запросов (query_stats.py)
+QUERY_STATS_CONFIG = {
+    "enabled": True,
+    "slow_ms": 100,           # Запрос дольше - в лог вместе с EXPLAIN QUERY PLAN
+    "explain_interval": 300,  # План одного оператора - не чаще раза в N секунд
+    "samples": 256,           # Последних замеров на оператор для p99
+    "slow_log_size": 50       # Сколько медленных запросов помнить для админки
+}
+
+# Трассировка апдейтов (tracing.py)
+TRACING_CONFIG = {
+    "enabled": True,
+    "sample_rate": 1.0,          # Доля апдейтов, которые трассируются
+    "keep_traces": 200,          # Сколько последних трасс держать для /Gofrotraces
+    "exporter": "file",          # file | otlp | None
+    "file": "storage/logs/traces.jsonl",
+    "otlp_endpoint": "http://localhost:4318/v1/traces",
+    "export_min_ms": 100,        # Выгружать только трассы медленнее (мс)
+    "export_interval": 10        # Как часто выгружать (секунды)
+}
+
+# Журнал игровых действий (action_log.py)
+ACTION_LOG_CONFIG = {
+    "dir": "storage/action_log",
+    "segment_size": 16 * 1024 * 1024,  # Размер сегмента журнала (байт)
+    "flush_interval": 5,               # Как часто дописывать буфер (секунды)
+    "snapshot_every": 10000            # Записей между снимками проекций
+}
+
+# Подбор соперника для радёмки
+MATCHMAKING_CONFIG = {
+    "band_width": 250.0,     # Ширина полосы силы (гофра + кабель, мм): ~5% шанса победы
+    "samples_per_band": 4,   # Сколько случайных игроков пробовать в полосе
+    "fights_per_hour": 10    # Лимит боёв в час (как в can_fight_pvp)
+}
+
+# Кэш готовых текстов сообщений (профиль, топы, статистика чата)
+RENDER_CACHE_CONFIG = {
+    "max_size": 2000,  # Сколько текстов держать (LRU)
+    "ttl": 60          # Не дольше мягкого TTL данных, из которых собран текст
 }
 
 # Logging Configuration
@@ -77,7 +160,10 @@ LOGGING_CONFIG = {
     "file": "storage/logs/bot_{date}.log",
     "max_size": 10 * 1024 * 1024,  # 10MB
     "backup_count": 5,
-    "use_colorlog": True
+    "use_colorlog": True,
+    "json": False,  # Файл логов строками JSON вместо текста
+    # Одинаковые предупреждения/ошибки: не больше burst за window секунд
+    "sampling": {"level": "WARNING", "window": 60, "burst": 5}
 }
 
 # Rate Limiting
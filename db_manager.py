@@ -6,32 +6,52 @@ import logging
 import time
 import shutil
 import random
-from typing import Dict, Any, List, Optional, Tuple
+import unicodedata
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import sqlite3
 
 # Импортируем конфигурацию
 from config import (
     BALANCE, GOFRY_MM, ATM_MAX, ATM_BASE_TIME,
-    DB_CONFIG, ADMIN_CONFIG
+    DB_CONFIG, ADMIN_CONFIG, REDIS_CONFIG, FIGHT_HISTORY_CONFIG, QUERY_STATS_CONFIG
 )
+from cache_manager import get_cache_manager
+from action_log import (
+    get_action_log, ACTION_DAVKA, ACTION_ULETET, ACTION_FIGHT, ACTION_NICKNAME
+)
+from tracing import instrument_class, instrument_module
+from query_stats import InstrumentedConnection
 
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные для базы данных
 DB_PATH = "storage/bot_database.db"
 BACKUP_DIR = "storage/backups"
-DATABASE_VERSION = 5
 
 # Импортируем функции форматирования из utils.display
 from utils.display import format_length, Display
+# Уровни гофрошки строятся один раз из config.GOFRY_MM
+from utils.gofra_levels import GOFRA_LEVELS, get_gofra_info, get_gofra_infos
+from utils.render_cache import state_versions, get_render_cache
+from utils.game_formulas import DAVKA_GOFRA_MM_PER_GRAM, DAVKA_CABLE_MM_PER_KG, davka_gains, pvp_chance
+from utils.matchmaking import MatchmakingIndex, get_matchmaker
+from utils.keyed_executor import get_user_executor, serialized_by_user
 
 # Алиас для форматирования времени
 ft = Display.format_time
 
+# Время жизни записи игрока в кэше; записи обновляются write-through при сохранении
+USER_CACHE_TTL = REDIS_CONFIG.get("cache_ttl", 3600)
+
 # Единое соединение с базой данных (для Telegram бота этого более чем достаточно)
 _db_connection = None
 _db_lock = asyncio.Lock()
+# У соединения одна транзакция на всех: чужой commit зафиксирует, а rollback
+# откатит и незаконченные изменения другой корутины. Поэтому запись - от
+# первого изменения до commit/rollback - идёт только под этой блокировкой
+_write_lock = asyncio.Lock()
 
 async def get_connection() -> aiosqlite.Connection:
     """Получить соединение с базой данных."""
@@ -41,6 +61,9 @@ async def get_connection() -> aiosqlite.Connection:
         if _db_connection is None:
             _db_connection = await aiosqlite.connect(DB_PATH, timeout=60)
             _db_connection.row_factory = aiosqlite.Row
+            if QUERY_STATS_CONFIG.get("enabled", True):
+                # Все запросы - и db_manager, и обработчиков - идут через замер
+                _db_connection = InstrumentedConnection(_db_connection)
             
             # Оптимизация SQLite
             await _db_connection.execute("PRAGMA journal_mode=WAL")
@@ -67,6 +90,20 @@ async def close_pool():
             _db_connection = None
             logger.info("🔌 Соединение с базой данных закрыто")
 
+@asynccontextmanager
+async def write_transaction():
+    """Транзакция записи на общем соединении: commit на выходе, rollback при ошибке."""
+    conn = await get_connection()
+    try:
+        async with _write_lock:
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+    finally:
+        await release_connection(conn)
 
 
 async def ensure_storage_dirs():
@@ -76,192 +113,420 @@ async def ensure_storage_dirs():
     os.makedirs("storage/logs", exist_ok=True)
 
 async def init_db():
-    """Инициализирует базу данных с необходимыми таблицами."""
+    """Инициализирует базу данных: применяет недостающие миграции."""
     await ensure_storage_dirs()
     conn = await get_connection()
     try:
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            nickname TEXT DEFAULT 'Неизвестно',
-            gofra_mm REAL DEFAULT 10.0,
-            cable_mm REAL DEFAULT 10.0,
-            atm_count INTEGER DEFAULT 12,
-            zmiy_grams REAL DEFAULT 0.0,
-            total_zmiy_grams REAL DEFAULT 0.0,
-            cable_power INTEGER DEFAULT 2,
-            gofra INTEGER DEFAULT 1,
-            last_atm_regen INTEGER DEFAULT 0,
-            last_davka INTEGER DEFAULT 0,
-            last_rademka INTEGER DEFAULT 0,
-            created_at INTEGER DEFAULT (strftime('%s', 'now')),
-            updated_at INTEGER DEFAULT (strftime('%s', 'now'))
-        )
-        """)
-
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS rademka_fights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            winner_id INTEGER,
-            loser_id INTEGER,
-            created_at INTEGER DEFAULT (strftime('%s', 'now')),
-            FOREIGN KEY (winner_id) REFERENCES users(user_id),
-            FOREIGN KEY (loser_id) REFERENCES users(user_id)
-        )
-        """)
-
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS chat_stats (
-            chat_id INTEGER PRIMARY KEY,
-            chat_title TEXT,
-            chat_type TEXT,
-            total_players INTEGER DEFAULT 0,
-            active_players INTEGER DEFAULT 0,
-            total_zmiy_all REAL DEFAULT 0.0,
-            total_davki_all INTEGER DEFAULT 0,
-            last_activity INTEGER DEFAULT 0,
-            created_at INTEGER DEFAULT (strftime('%s', 'now'))
-        )
-        """)
-
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_chat_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            chat_id INTEGER,
-            total_zmiy_grams REAL DEFAULT 0.0,
-            last_activity INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (chat_id) REFERENCES chat_stats(chat_id),
-            UNIQUE(user_id, chat_id)
-        )
-        """)
-
-        await conn.execute("""
-        CREATE TABLE IF NOT EXISTS database_version (
-            version INTEGER PRIMARY KEY,
-            updated_at INTEGER DEFAULT (strftime('%s', 'now'))
-        )
-        """)
-
-        # Проверяем и обновляем версию базы данных
-        await check_and_update_db_version(conn)
-
-        await conn.commit()
+        # Шаги и порции backfill коммитятся сами - остальные пишущие ждут их целиком
+        async with _write_lock:
+            await run_migrations(conn)
     finally:
         await release_connection(conn)
 
-async def check_and_update_db_version(conn: aiosqlite.Connection):
-    """Проверяет версию базы данных и применяет необходимые миграции."""
-    # Проверяем текущую версию
-    cursor = await conn.execute("SELECT version FROM database_version ORDER BY version DESC LIMIT 1")
-    row = await cursor.fetchone()
+# ============ MIGRATIONS ============
+#
+# Реестр пронумерованных шагов. Номер применённого шага хранится в PRAGMA
+# user_version (заголовок файла БД), поэтому при актуальной схеме запуск стоит
+# одного чтения. Каждый шаг схемы выполняется в своей транзакции вместе с
+# записью версии. Долгие обновления данных (backfill) идут отдельными
+# транзакциями по MIGRATION_CHUNK_SIZE строк и должны быть идемпотентными:
+# после падения шаг повторяется и продолжает с необработанных строк.
+
+MIGRATION_CHUNK_SIZE = 1000
+
+# Окна «активных игроков» чата (секунды)
+ACTIVE_WINDOW_DAY = 86400
+ACTIVE_WINDOW_WEEK = 7 * 86400
+
+# версия -> (описание, шаг схемы, backfill или None)
+MIGRATIONS: Dict[int, Tuple[str, Callable, Optional[Callable]]] = {}
+
+def migration(version: int, description: str, backfill: Optional[Callable] = None):
+    """Регистрирует шаг миграции схемы под номером version."""
+    def decorator(func: Callable) -> Callable:
+        if version in MIGRATIONS:
+            raise ValueError(f"Миграция v{version} уже зарегистрирована")
+        MIGRATIONS[version] = (description, func, backfill)
+        return func
+    return decorator
+
+async def backfill_in_chunks(conn: aiosqlite.Connection, table: str, set_clause: str,
+                             where_clause: str, params: tuple = (),
+                             chunk_size: int = MIGRATION_CHUNK_SIZE) -> int:
+    """
+    Обновляет строки таблицы порциями, каждая порция - своя короткая транзакция.
+    
+    where_clause должен отбирать только ещё не обработанные строки,
+    иначе цикл не закончится.
+    """
+    total = 0
+    while True:
+        cursor = await conn.execute(f"""
+            UPDATE {table} SET {set_clause}
+            WHERE rowid IN (SELECT rowid FROM {table} WHERE {where_clause} LIMIT ?)
+        """, (*params, chunk_size))
+        await conn.commit()
+        total += cursor.rowcount
+        if cursor.rowcount < chunk_size:
+            return total
+        # Даём поработать остальным корутинам между порциями
+        await asyncio.sleep(0)
+
+async def _set_schema_version(conn: aiosqlite.Connection, version: int):
+    """Записывает версию схемы (внутри текущей транзакции)."""
+    await conn.execute(f"PRAGMA user_version = {int(version)}")
+    await conn.execute(
+        "INSERT OR REPLACE INTO database_version (version, updated_at) VALUES (?, ?)",
+        (version, int(time.time()))
+    )
+
+async def _detect_legacy_version(conn: aiosqlite.Connection) -> int:
+    """
+    Версия базы, созданной до перехода на user_version.
+    
+    Старый код вёл таблицу database_version и всегда писал туда 5;
+    пустая таблица при существующих users означала версию 1.
+    """
+    cursor = await conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('users', 'database_version')"
+    )
+    tables = {row[0] for row in await cursor.fetchall()}
+    if 'users' not in tables:
+        return 0
+    if 'database_version' in tables:
+        cursor = await conn.execute("SELECT MAX(version) FROM database_version")
+        row = await cursor.fetchone()
+        if row and row[0]:
+            return int(row[0])
+    return 1
+
+async def run_migrations(conn: aiosqlite.Connection):
+    """Применяет зарегистрированные миграции, которых ещё нет в базе."""
+    cursor = await conn.execute("PRAGMA user_version")
+    current_version = (await cursor.fetchone())[0]
+    if current_version == DATABASE_VERSION:
+        logger.info("✅ Схема БД актуальна (v%s), миграции пропущены", DATABASE_VERSION)
+        return
+
+    if current_version == 0:
+        current_version = await _detect_legacy_version(conn)
+        if current_version:
+            logger.info("ℹ️ Найдена база старого формата, версия %s", current_version)
+            await conn.execute("BEGIN IMMEDIATE")
+            # Старый init_db досоздавал таблицы на каждом запуске - делаем так же
+            await apply_migration_v1(conn)
+            await conn.execute(f"PRAGMA user_version = {current_version}")
+            await conn.commit()
 
-    if row is None:
-        # Если таблица пустая, устанавливаем текущую версию
-        current_version = 1
-    else:
-        current_version = row[0]
+    if current_version > DATABASE_VERSION:
+        logger.warning("⚠️ Версия БД %s новее кода (%s)", current_version, DATABASE_VERSION)
+        return
 
-    logger.info(f"Текущая версия БД: {current_version}, требуемая: {DATABASE_VERSION}")
+    logger.info("Текущая версия БД: %s, требуемая: %s", current_version, DATABASE_VERSION)
 
-    # Применяем миграции по порядку
-    if current_version < 1:
-        await apply_migration_v1(conn)
-        current_version = 1
+    for version in sorted(v for v in MIGRATIONS if v > current_version):
+        description, schema_step, backfill = MIGRATIONS[version]
+        started = time.perf_counter()
+        logger.info("🔧 Миграция v%s: %s", version, description)
 
-    if current_version < 2:
-        await apply_migration_v2(conn)
-        current_version = 2
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            await schema_step(conn)
+            if backfill is None:
+                await _set_schema_version(conn, version)
+            await conn.commit()
+        except Exception as e:
+            await conn.rollback()
+            logger.error("❌ Миграция v%s откатана: %s", version, e)
+            raise
 
-    if current_version < 3:
-        await apply_migration_v3(conn)
-        current_version = 3
+        if backfill is not None:
+            # Порции коммитятся сами; версия фиксируется только после всего backfill
+            await backfill(conn)
+            await conn.execute("BEGIN IMMEDIATE")
+            await _set_schema_version(conn, version)
+            await conn.commit()
 
-    if current_version < 4:
-        await apply_migration_v4(conn)
-        current_version = 4
+        logger.info("✅ Миграция v%s применена за %.2fс", version, time.perf_counter() - started)
 
-    # Обновляем версию в базе
-    await conn.execute("INSERT OR REPLACE INTO database_version (version) VALUES (?)", (DATABASE_VERSION,))
+    # После изменения схемы проверяем, что горячие запросы не ушли в полный скан
+    for name, detail in await check_hot_query_plans(conn):
+        logger.warning("⚠️ Запрос %s читает таблицу целиком: %s", name, detail)
 
+@migration(1, "базовые таблицы")
 async def apply_migration_v1(conn: aiosqlite.Connection):
-    """Миграция для версии 1 - добавление базовых таблиц."""
-    logger.info("Применение миграции v1...")
-    # Базовые таблицы уже созданы в init_db, поэтому здесь могут быть дополнительные настройки
-
+    """Миграция для версии 1 - создание базовых таблиц."""
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        nickname TEXT DEFAULT 'Неизвестно',
+        gofra_mm REAL DEFAULT 10.0,
+        cable_mm REAL DEFAULT 10.0,
+        atm_count INTEGER DEFAULT 12,
+        zmiy_grams REAL DEFAULT 0.0,
+        total_zmiy_grams REAL DEFAULT 0.0,
+        cable_power INTEGER DEFAULT 2,
+        gofra INTEGER DEFAULT 1,
+        last_atm_regen INTEGER DEFAULT 0,
+        last_davka INTEGER DEFAULT 0,
+        last_rademka INTEGER DEFAULT 0,
+        created_at INTEGER DEFAULT (strftime('%s', 'now')),
+        updated_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS rademka_fights (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        winner_id INTEGER,
+        loser_id INTEGER,
+        created_at INTEGER DEFAULT (strftime('%s', 'now')),
+        FOREIGN KEY (winner_id) REFERENCES users(user_id),
+        FOREIGN KEY (loser_id) REFERENCES users(user_id)
+    )
+    """)
+
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_stats (
+        chat_id INTEGER PRIMARY KEY,
+        chat_title TEXT,
+        chat_type TEXT,
+        total_players INTEGER DEFAULT 0,
+        active_players INTEGER DEFAULT 0,
+        total_zmiy_all REAL DEFAULT 0.0,
+        total_davki_all INTEGER DEFAULT 0,
+        last_activity INTEGER DEFAULT 0,
+        created_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_chat_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        chat_id INTEGER,
+        total_zmiy_grams REAL DEFAULT 0.0,
+        last_activity INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (chat_id) REFERENCES chat_stats(chat_id),
+        UNIQUE(user_id, chat_id)
+    )
+    """)
+
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS database_version (
+        version INTEGER PRIMARY KEY,
+        updated_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+
+@migration(2, "новые поля users")
 async def apply_migration_v2(conn: aiosqlite.Connection):
     """Миграция для версии 2 - добавление новых полей и оптимизаций."""
-    logger.info("Применение миграции v2...")
-
-    # Добавляем новые поля, если их нет
-    try:
-        # Проверяем, есть ли поле cable_power
-        cursor = await conn.execute("PRAGMA table_info(users)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
+    # Проверяем, есть ли поля: шаг может повторяться после сбоя
+    cursor = await conn.execute("PRAGMA table_info(users)")
+    columns = await cursor.fetchall()
+    column_names = [col[1] for col in columns]
 
-        if 'cable_power' not in column_names:
-            await conn.execute("ALTER TABLE users ADD COLUMN cable_power INTEGER DEFAULT 2")
+    if 'cable_power' not in column_names:
+        await conn.execute("ALTER TABLE users ADD COLUMN cable_power INTEGER DEFAULT 2")
 
-        if 'gofra' not in column_names:
-            await conn.execute("ALTER TABLE users ADD COLUMN gofra INTEGER DEFAULT 1")
+    if 'gofra' not in column_names:
+        await conn.execute("ALTER TABLE users ADD COLUMN gofra INTEGER DEFAULT 1")
 
-        if 'last_rademka' not in column_names:
-            await conn.execute("ALTER TABLE users ADD COLUMN last_rademka INTEGER DEFAULT 0")
+    if 'last_rademka' not in column_names:
+        await conn.execute("ALTER TABLE users ADD COLUMN last_rademka INTEGER DEFAULT 0")
 
-    except Exception as e:
-        logger.error(f"Ошибка при миграции v2: {e}")
-        raise
+async def backfill_migration_v3(conn: aiosqlite.Connection):
+    """Обновляем всех пользователей с 0 атмосферами до 12 порциями."""
+    update_count = await backfill_in_chunks(conn, "users", "atm_count = 12", "atm_count = 0")
+    logger.info("Обновлено %s пользователей с 0 атмосферами до 12", update_count)
 
+@migration(3, "исправление начальных атмосфер", backfill=backfill_migration_v3)
 async def apply_migration_v3(conn: aiosqlite.Connection):
     """Миграция для версии 3 - исправление начальных атмосфер."""
-    logger.info("Применение миграции v3...")
-
-    try:
-        # Обновляем всех пользователей с 0 атмосферами до 12
-        cursor = await conn.execute("UPDATE users SET atm_count = 12 WHERE atm_count = 0")
-        update_count = cursor.rowcount
-        logger.info(f"Обновлено {update_count} пользователей с 0 атмосферами до 12")
-
-        # Обновляем DEFAULT значение для будущих пользователей
-        # Note: В SQLite нельзя изменить DEFAULT значение существующего столбца через ALTER TABLE
-        # Поэтому мы просто документируем, что новые пользователи должны иметь 12 атмосфер
-
-    except Exception as e:
-        logger.error(f"Ошибка при миграции v3: {e}")
-        raise
+    # Схема не меняется: в SQLite нельзя изменить DEFAULT существующего столбца
+    # через ALTER TABLE, вся работа в backfill_migration_v3
 
+@migration(4, "индексы для производительности")
 async def apply_migration_v4(conn: aiosqlite.Connection):
     """Миграция для версии 4 - добавление индексов для производительности."""
-    logger.info("Применение миграции v4 (индексы)...")
+    # Индексы для таблицы users
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_atm_count ON users(atm_count)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_gofra_mm ON users(gofra_mm)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_cable_mm ON users(cable_mm)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_davka ON users(last_davka)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_rademka ON users(last_rademka)")
+    
+    # Индексы для таблицы user_chat_stats
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_chat_stats_chat_user ON user_chat_stats(chat_id, user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_chat_stats_total_zmiy ON user_chat_stats(total_zmiy_grams)")
+    
+    # Индексы для таблицы rademka_fights
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_winner ON rademka_fights(winner_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_loser ON rademka_fights(loser_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_created ON rademka_fights(created_at)")
+    
+    # Индексы для таблицы chat_stats
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_total_zmiy ON chat_stats(total_zmiy_all)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_total_davki ON chat_stats(total_davki_all)")
 
-    try:
-        # Индексы для таблицы users
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_atm_count ON users(atm_count)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_gofra_mm ON users(gofra_mm)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_cable_mm ON users(cable_mm)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_davka ON users(last_davka)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_rademka ON users(last_rademka)")
-        
-        # Индексы для таблицы user_chat_stats
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_chat_stats_chat_user ON user_chat_stats(chat_id, user_id)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_chat_stats_total_zmiy ON user_chat_stats(total_zmiy_grams)")
-        
-        # Индексы для таблицы rademka_fights
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_winner ON rademka_fights(winner_id)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_loser ON rademka_fights(loser_id)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_created ON rademka_fights(created_at)")
-        
-        # Индексы для таблицы chat_stats
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_total_zmiy ON chat_stats(total_zmiy_all)")
-        await conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_total_davki ON chat_stats(total_davki_all)")
-        
-        logger.info("✅ Индексы для производительности добавлены")
+@migration(5, "фиксация версии 5")
+async def apply_migration_v5(conn: aiosqlite.Connection):
+    """
+    Миграция для версии 5 - изменений схемы нет.
+    
+    Старый код записывал версию 5 без отдельного шага; шаг оставлен пустым,
+    чтобы нумерация реестра совпадала с уже существующими базами.
+    """
 
-    except Exception as e:
-        logger.error(f"Ошибка при миграции v4 (индексы): {e}")
-        raise
+@migration(6, "индексы под реальные запросы")
+async def apply_migration_v6(conn: aiosqlite.Connection):
+    """
+    Миграция для версии 6 - пересборка индексов по запросам из HOT_QUERIES.
+    
+    Индексы, которые не читает ни один запрос, только замедляли каждую запись:
+    atm_count, cable_mm, last_davka, last_rademka и суммы chat_stats меняются
+    при каждой давке. Пара (chat_id, user_id) уже покрыта UNIQUE(user_id, chat_id).
+    """
+    for index_name in (
+        "idx_users_atm_count", "idx_users_cable_mm",
+        "idx_users_last_davka", "idx_users_last_rademka",
+        "idx_user_chat_stats_chat_user", "idx_user_chat_stats_total_zmiy",
+        "idx_rademka_fights_winner", "idx_rademka_fights_loser", "idx_rademka_fights_created",
+        "idx_chat_stats_total_zmiy", "idx_chat_stats_total_davki",
+    ):
+        await conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+    # Бои игрока за период: отдельные диапазоны по победам и поражениям
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_winner_time ON rademka_fights(winner_id, created_at)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_rademka_fights_loser_time ON rademka_fights(loser_id, created_at)")
+    # Топ чата: уже упорядочен по змию и покрывает user_id для JOIN
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_chat_stats_chat_rank
+        ON user_chat_stats(chat_id, total_zmiy_grams DESC, user_id)
+    """)
+    # Проверка занятости ника
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_nickname ON users(nickname)")
+    # idx_users_gofra_mm остаётся: по нему идёт глобальный топ
+
+async def backfill_migration_v7(conn: aiosqlite.Connection):
+    """Заполняет агрегаты радёмок по уже накопленным боям."""
+    await rebuild_rademka_player_stats(conn)
+
+@migration(7, "агрегаты радёмок и money_taken", backfill=backfill_migration_v7)
+async def apply_migration_v7(conn: aiosqlite.Connection):
+    """
+    Миграция для версии 7 - пожизненная статистика радёмок отдельно от боёв.
+    
+    rademka_fights становится горячей таблицей за последние часы,
+    победы и поражения за всё время читаются из rademka_player_stats.
+    """
+    cursor = await conn.execute("PRAGMA table_info(rademka_fights)")
+    column_names = [col[1] for col in await cursor.fetchall()]
+    if 'money_taken' not in column_names:
+        await conn.execute("ALTER TABLE rademka_fights ADD COLUMN money_taken INTEGER DEFAULT 0")
+
+    await conn.execute("""
+    CREATE TABLE IF NOT EXISTS rademka_player_stats (
+        user_id INTEGER PRIMARY KEY,
+        wins INTEGER DEFAULT 0,
+        losses INTEGER DEFAULT 0,
+        money_won INTEGER DEFAULT 0,
+        money_lost INTEGER DEFAULT 0,
+        last_fight_at INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    """)
+    # Топ радёмщиков читает индекс по порядку и останавливается на LIMIT
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rademka_player_stats_wins
+        ON rademka_player_stats(wins DESC, user_id)
+    """)
+
+async def backfill_migration_v8(conn: aiosqlite.Connection):
+    """
+    Помечает существующих участников чатов и пересчитывает счётчики чатов.
+    
+    Сколько давок было у старых записей, неизвестно - ставим 1 (хотя бы одна).
+    """
+    await backfill_in_chunks(conn, "user_chat_stats", "davki = 1", "davki = 0")
+    now = int(time.time())
+    await conn.execute("""
+        UPDATE chat_stats SET
+            total_players = (SELECT COUNT(*) FROM user_chat_stats uc WHERE uc.chat_id = chat_stats.chat_id),
+            active_players = (SELECT COUNT(*) FROM user_chat_stats uc
+                              WHERE uc.chat_id = chat_stats.chat_id AND uc.last_activity >= ?),
+            active_players_7d = (SELECT COUNT(*) FROM user_chat_stats uc
+                                 WHERE uc.chat_id = chat_stats.chat_id AND uc.last_activity >= ?)
+    """, (now - ACTIVE_WINDOW_DAY, now - ACTIVE_WINDOW_WEEK))
+    await conn.commit()
+
+@migration(8, "счётчики участников чатов", backfill=backfill_migration_v8)
+async def apply_migration_v8(conn: aiosqlite.Connection):
+    """
+    Миграция для версии 8 - число давок игрока в чате и активные за неделю.
+    
+    davki = 1 после UPSERT означает, что игрок впервые давит в этом чате;
+    active_players теперь значит «активных за 24 часа», а не число давок.
+    """
+    cursor = await conn.execute("PRAGMA table_info(user_chat_stats)")
+    if 'davki' not in [col[1] for col in await cursor.fetchall()]:
+        await conn.execute("ALTER TABLE user_chat_stats ADD COLUMN davki INTEGER DEFAULT 0")
+
+    cursor = await conn.execute("PRAGMA table_info(chat_stats)")
+    if 'active_players_7d' not in [col[1] for col in await cursor.fetchall()]:
+        await conn.execute("ALTER TABLE chat_stats ADD COLUMN active_players_7d INTEGER DEFAULT 0")
+
+async def backfill_migration_v9(conn: aiosqlite.Connection):
+    """Заполняет nickname_key по существующим никам."""
+    skipped = await backfill_nickname_keys(conn)
+    if skipped:
+        logger.warning("⚠️ Ников-дубликатов без ключа: %s (ник остаётся, но не закреплён)", skipped)
+
+@migration(9, "уникальные ники без учёта регистра", backfill=backfill_migration_v9)
+async def apply_migration_v9(conn: aiosqlite.Connection):
+    """
+    Миграция для версии 9 - nickname_key и уникальный индекс по нему.
+    
+    Индекс частичный: у ника по умолчанию ключа нет, его носят многие.
+    Проверка занятости идёт по ключу, поэтому индекс по nickname больше не нужен.
+    """
+    cursor = await conn.execute("PRAGMA table_info(users)")
+    if 'nickname_key' not in [col[1] for col in await cursor.fetchall()]:
+        await conn.execute("ALTER TABLE users ADD COLUMN nickname_key TEXT")
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_nickname_key
+        ON users(nickname_key) WHERE nickname_key IS NOT NULL
+    """)
+    await conn.execute("DROP INDEX IF EXISTS idx_users_nickname")
+
+@migration(10, "таблица состояний FSM")
+async def apply_migration_v10(conn: aiosqlite.Connection):
+    """
+    Миграция для версии 10 - fsm_states для fsm_storage.SQLiteStorage.
+    
+    Ключ - StorageKey aiogram; пустые thread_id и business_connection_id
+    хранятся как 0 и ''. Индекс по updated_at - для удаления брошенных состояний.
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            bot_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            business_connection_id TEXT NOT NULL DEFAULT '',
+            destiny TEXT NOT NULL DEFAULT 'default',
+            state TEXT,
+            data TEXT,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+        ) WITHOUT ROWID
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)")
+
+# Версия схемы, которую ожидает код - последний зарегистрированный шаг
+DATABASE_VERSION = max(MIGRATIONS)
 
 async def repair_database():
     """Функция для ремонта и восстановления базы данных."""
@@ -274,7 +539,7 @@ async def repair_database():
     try:
         if os.path.exists(DB_PATH):
             shutil.copy2(DB_PATH, backup_path)
-            logger.info(f"✅ Создана резервная копия: {backup_path}")
+            logger.info("✅ Создана резервная копия: %s", backup_path)
         else:
             logger.warning("⚠️ База данных не существует, создаем новую")
 
@@ -291,7 +556,7 @@ async def repair_database():
         return True, "Ремонт базы данных завершен успешно"
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при ремонте базы данных: {e}")
+        logger.error("❌ Ошибка при ремонте базы данных: %s", e)
         return False, f"Ошибка при ремонте базы данных: {e}"
 
 async def check_database_integrity():
@@ -315,11 +580,11 @@ async def check_database_integrity():
         if result and result[0] == "ok":
             logger.info("✅ База данных в хорошем состоянии")
         else:
-            logger.warning(f"⚠️ Проблемы с целостностью базы данных: {result}")
+            logger.warning("⚠️ Проблемы с целостностью базы данных: %s", result)
             # Попробуем восстановить базу
             cursor.execute("PRAGMA quick_check")
             quick_result = cursor.fetchall()
-            logger.info(f"Быстрая проверка: {quick_result}")
+            logger.info("Быстрая проверка: %s", quick_result)
 
         # Проверяем наличие необходимых таблиц
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -329,13 +594,13 @@ async def check_database_integrity():
         missing_tables = [table for table in required_tables if table not in tables]
 
         if missing_tables:
-            logger.warning(f"⚠️ Отсутствуют таблицы: {missing_tables}")
+            logger.warning("⚠️ Отсутствуют таблицы: %s", missing_tables)
             # Эти таблицы будут созданы при инициализации
 
         conn.close()
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при проверке целостности базы данных: {e}")
+        logger.error("❌ Ошибка при проверке целостности базы данных: %s", e)
         raise
 
 
@@ -353,10 +618,18 @@ async def backup_all_data():
         backup_data = {
             'users': [],
             'rademka_fights': [],
+            'rademka_player_stats': [],
             'chat_stats': [],
             'user_chat_stats': [],
             'database_version': []
         }
+        # Помесячные архивы боёв
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+            (FIGHT_ARCHIVE_PREFIX + '%',)
+        )
+        for (archive_table,) in cursor.fetchall():
+            backup_data[archive_table] = []
 
         # Копируем данные из каждой таблицы
         for table in backup_data.keys():
@@ -377,7 +650,7 @@ async def backup_all_data():
         return backup_data
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при создании резервной копии данных: {e}")
+        logger.error("❌ Ошибка при создании резервной копии данных: %s", e)
         return {}
 
 async def restore_all_data(backup_data: dict):
@@ -385,8 +658,7 @@ async def restore_all_data(backup_data: dict):
     logger.info("🔄 Восстановление данных из резервной копии...")
 
     try:
-        conn = await get_connection()
-        try:
+        async with write_transaction() as conn:
             # Восстанавливаем пользователей
             if backup_data.get('users'):
                 for user in backup_data['users']:
@@ -414,24 +686,54 @@ async def restore_all_data(backup_data: dict):
                             user.get('updated_at', int(time.time()))
                         ))
                     except Exception as e:
-                        logger.warning(f"⚠️ Ошибка при восстановлении пользователя {user.get('user_id')}: {e}")
+                        logger.warning("⚠️ Ошибка при восстановлении пользователя %s: %s", user.get('user_id'), e)
 
-            # Восстанавливаем бои радёмок
-            if backup_data.get('rademka_fights'):
-                for fight in backup_data['rademka_fights']:
+            # Ключи ников считаются заново (в копиях до v9 их нет)
+            await backfill_nickname_keys(conn)
+
+            # Восстанавливаем бои радёмок: горячую таблицу и помесячные архивы
+            fight_tables = ['rademka_fights'] + sorted(
+                table for table in backup_data if table.startswith(FIGHT_ARCHIVE_PREFIX)
+            )
+            for table in fight_tables:
+                if table != 'rademka_fights':
+                    await _ensure_fight_archive(conn, table)
+                for fight in backup_data.get(table) or []:
                     try:
-                        await conn.execute("""
-                        INSERT INTO rademka_fights (
-                            id, winner_id, loser_id, created_at
-                        ) VALUES (?, ?, ?, ?)
+                        await conn.execute(f"""
+                        INSERT INTO {table} (
+                            id, winner_id, loser_id, money_taken, created_at
+                        ) VALUES (?, ?, ?, ?, ?)
                         """, (
                             fight.get('id'),
                             fight.get('winner_id'),
                             fight.get('loser_id'),
+                            fight.get('money_taken', 0),
                             fight.get('created_at', int(time.time()))
                         ))
                     except Exception as e:
-                        logger.warning(f"⚠️ Ошибка при восстановлении боя {fight.get('id')}: {e}")
+                        logger.warning("⚠️ Ошибка при восстановлении боя %s: %s", fight.get('id'), e)
+
+            # Агрегаты радёмок: из копии, а для старых копий - пересчётом по боям
+            if backup_data.get('rademka_player_stats'):
+                for stats in backup_data['rademka_player_stats']:
+                    try:
+                        await conn.execute("""
+                        INSERT OR REPLACE INTO rademka_player_stats (
+                            user_id, wins, losses, money_won, money_lost, last_fight_at
+                        ) VALUES (?, ?, ?, ?, ?, ?)
+                        """, (
+                            stats.get('user_id'),
+                            stats.get('wins', 0),
+                            stats.get('losses', 0),
+                            stats.get('money_won', 0),
+                            stats.get('money_lost', 0),
+                            stats.get('last_fight_at', 0)
+                        ))
+                    except Exception as e:
+                        logger.warning("⚠️ Ошибка при восстановлении статистики радёмок %s: %s", stats.get('user_id'), e)
+            else:
+                await rebuild_rademka_player_stats(conn)
 
             # Восстанавливаем статистику чатов
             if backup_data.get('chat_stats'):
@@ -440,22 +742,23 @@ async def restore_all_data(backup_data: dict):
                         await conn.execute("""
                         INSERT OR REPLACE INTO chat_stats (
                             chat_id, chat_title, chat_type, total_players,
-                            active_players, total_zmiy_all, total_davki_all,
+                            active_players, active_players_7d, total_zmiy_all, total_davki_all,
                             last_activity, created_at
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                         """, (
                             chat.get('chat_id'),
                             chat.get('chat_title', ''),
                             chat.get('chat_type', 'private'),
                             chat.get('total_players', 0),
                             chat.get('active_players', 0),
+                            chat.get('active_players_7d', 0),
                             chat.get('total_zmiy_all', 0.0),
                             chat.get('total_davki_all', 0),
                             chat.get('last_activity', 0),
                             chat.get('created_at', int(time.time()))
                         ))
                     except Exception as e:
-                        logger.warning(f"⚠️ Ошибка при восстановлении статистики чата {chat.get('chat_id')}: {e}")
+                        logger.warning("⚠️ Ошибка при восстановлении статистики чата %s: %s", chat.get('chat_id'), e)
 
             # Восстанавливаем статистику пользователей в чатах
             if backup_data.get('user_chat_stats'):
@@ -463,17 +766,18 @@ async def restore_all_data(backup_data: dict):
                     try:
                         await conn.execute("""
                         INSERT OR REPLACE INTO user_chat_stats (
-                            id, user_id, chat_id, total_zmiy_grams, last_activity
-                        ) VALUES (?, ?, ?, ?, ?)
+                            id, user_id, chat_id, total_zmiy_grams, last_activity, davki
+                        ) VALUES (?, ?, ?, ?, ?, ?)
                         """, (
                             user_chat.get('id'),
                             user_chat.get('user_id'),
                             user_chat.get('chat_id'),
                             user_chat.get('total_zmiy_grams', 0.0),
-                            user_chat.get('last_activity', 0)
+                            user_chat.get('last_activity', 0),
+                            user_chat.get('davki') or 1
                         ))
                     except Exception as e:
-                        logger.warning(f"⚠️ Ошибка при восстановлении статистики пользователя в чате {user_chat.get('id')}: {e}")
+                        logger.warning("⚠️ Ошибка при восстановлении статистики пользователя в чате %s: %s", user_chat.get('id'), e)
 
             # Восстанавливаем версию базы данных
             if backup_data.get('database_version'):
@@ -488,16 +792,17 @@ async def restore_all_data(backup_data: dict):
                             version.get('updated_at', int(time.time()))
                         ))
                     except Exception as e:
-                        logger.warning(f"⚠️ Ошибка при восстановлении версии базы данных: {e}")
+                        logger.warning("⚠️ Ошибка при восстановлении версии базы данных: %s", e)
 
-            await conn.commit()
-            logger.info("✅ Данные восстановлены из резервной копии")
-
-        finally:
-            await release_connection(conn)
+        # Всё, что лежало в кэше, теперь не соответствует базе
+        await get_cache_manager().clear('user')
+        await get_cache_manager().clear('chat')
+        get_render_cache().clear()
+        get_matchmaker().clear()
+        logger.info("✅ Данные восстановлены из резервной копии")
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при восстановлении данных: {e}")
+        logger.error("❌ Ошибка при восстановлении данных: %s", e)
         raise
 
 async def optimize_database():
@@ -513,11 +818,13 @@ async def optimize_database():
             await conn.execute("PRAGMA temp_store=MEMORY")
             await conn.execute("PRAGMA cache_size=-20000")  # 20MB cache
 
-            # Перестраиваем индексы
-            await conn.execute("PRAGMA optimize")
+            # VACUUM не работает внутри открытой транзакции - ждём пишущих
+            async with _write_lock:
+                # Перестраиваем индексы
+                await conn.execute("PRAGMA optimize")
 
-            # Вакуумируем базу данных
-            await conn.execute("VACUUM")
+                # Вакуумируем базу данных
+                await conn.execute("VACUUM")
 
             logger.info("✅ База данных оптимизирована")
 
@@ -525,7 +832,7 @@ async def optimize_database():
             await release_connection(conn)
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при оптимизации базы данных: {e}")
+        logger.error("❌ Ошибка при оптимизации базы данных: %s", e)
         raise
 
 async def repair_save_directory():
@@ -549,7 +856,7 @@ async def repair_save_directory():
         return True, "Ремонт директории с сейвами завершен успешно"
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при ремонте директории с сейвами: {e}")
+        logger.error("❌ Ошибка при ремонте директории с сейвами: %s", e)
         return False, f"Ошибка при ремонте директории с сейвами: {e}"
 
 
@@ -577,7 +884,7 @@ async def repair_config_files():
         logger.info("✅ Файлы конфигурации проверены и восстановлены")
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при восстановлении файлов конфигурации: {e}")
+        logger.error("❌ Ошибка при восстановлении файлов конфигурации: %s", e)
         raise
 
 async def repair_log_files():
@@ -598,7 +905,7 @@ async def repair_log_files():
                 # Архивируем текущий лог
                 archive_name = f"storage/logs/bot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
                 shutil.move(current_log, archive_name)
-                logger.info(f"🗄️ Архивирован большой лог-файл: {archive_name}")
+                logger.info("🗄️ Архивирован большой лог-файл: %s", archive_name)
 
         # Создаем новый лог-файл если нужно
         if not os.path.exists(current_log):
@@ -608,7 +915,7 @@ async def repair_log_files():
         logger.info("✅ Файлы логов проверены и восстановлены")
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при восстановлении файлов логов: {e}")
+        logger.error("❌ Ошибка при восстановлении файлов логов: %s", e)
         raise
 
 async def full_system_repair():
@@ -627,13 +934,13 @@ async def full_system_repair():
         # 2. Ремонт директории с сейвами
         dir_success, dir_message = await repair_save_directory()
         if not dir_success:
-            logger.warning(f"⚠️ Ремонт директории с сейвами завершен с предупреждениями: {dir_message}")
+            logger.warning("⚠️ Ремонт директории с сейвами завершен с предупреждениями: %s", dir_message)
 
         logger.info("✅ Полная проверка системы завершена успешно!")
         return True, "Проверка системы завершена успешно. База данных НЕ была изменена."
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при проверке системы: {e}")
+        logger.error("❌ Ошибка при проверке системы: %s", e)
         return False, f"Ошибка при проверке системы: {e}"
 
 
@@ -652,7 +959,7 @@ async def rebuild_database_structure():
     try:
         # Получаем текущие данные перед перестроением
         old_data = await backup_all_data()
-        logger.info(f"💾 Сохранено {len(old_data.get('users', []))} пользователей")
+        logger.info("💾 Сохранено %s пользователей", len(old_data.get('users', [])))
 
         # Удаляем старую базу данных
         if os.path.exists(DB_PATH):
@@ -668,12 +975,168 @@ async def rebuild_database_structure():
         logger.info("✅ Структура базы данных пересоздана")
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при пересоздании структуры базы данных: {e}")
+        logger.error("❌ Ошибка при пересоздании структуры базы данных: %s", e)
         raise
 
+# ============ NICKNAMES ============
+
+DEFAULT_NICKNAME = 'Неизвестно'
+
+def normalize_nickname(nickname: Optional[str]) -> Optional[str]:
+    """
+    Ключ уникальности ника: NFKC, без регистра, ё = е, одиночные пробелы.
+    
+    Для пустого ника и ника по умолчанию возвращает None - такие не закрепляются.
+    """
+    if not nickname:
+        return None
+    key = " ".join(unicodedata.normalize("NFKC", nickname).casefold().replace("ё", "е").split())
+    if not key or key == DEFAULT_NICKNAME.casefold():
+        return None
+    return key
+
+async def backfill_nickname_keys(conn: aiosqlite.Connection,
+                                 chunk_size: int = MIGRATION_CHUNK_SIZE) -> int:
+    """
+    Проставляет nickname_key игрокам без ключа, порциями по user_id.
+    
+    Ник, ключ которого уже закреплён за другим игроком, остаётся без ключа
+    (UPDATE OR IGNORE). Возвращает число таких дубликатов.
+    """
+    skipped = 0
+    last_user_id = None
+    while True:
+        cursor = await conn.execute("""
+            SELECT user_id, nickname FROM users
+            WHERE nickname_key IS NULL AND user_id > COALESCE(?, -9223372036854775808)
+            ORDER BY user_id LIMIT ?
+        """, (last_user_id, chunk_size))
+        rows = await cursor.fetchall()
+        if not rows:
+            return skipped
+        last_user_id = rows[-1][0]
+        updates = [
+            (key, row[0]) for row in rows
+            if (key := normalize_nickname(row[1])) is not None
+        ]
+        if updates:
+            cursor = await conn.execute("SELECT total_changes()")
+            before = (await cursor.fetchone())[0]
+            await conn.executemany("UPDATE OR IGNORE users SET nickname_key = ? WHERE user_id = ?", updates)
+            cursor = await conn.execute("SELECT total_changes()")
+            skipped += len(updates) - ((await cursor.fetchone())[0] - before)
+        await conn.commit()
+        _nickname_registry.clear()
+        await asyncio.sleep(0)
+
+class NicknameRegistry:
+    """
+    Занятые ники в памяти: ключ -> user_id.
+    
+    Загружается из базы при первой проверке и дальше обновляется при смене ника,
+    так что ответ «занят» во время ввода ника не ходит в базу. Окончательное
+    слово за уникальным индексом: реестр может не знать о нике, занятом
+    другим процессом, и тогда UPDATE упадёт на индексе.
+    """
+
+    def __init__(self):
+        self._owners: Optional[Dict[str, int]] = None
+        self._keys: Dict[int, str] = {}
+        self._lock = asyncio.Lock()
+
+    async def _ensure_loaded(self) -> Dict[str, int]:
+        if self._owners is not None:
+            return self._owners
+        async with self._lock:
+            if self._owners is None:
+                conn = await get_connection()
+                try:
+                    cursor = await conn.execute(
+                        "SELECT nickname_key, user_id FROM users WHERE nickname_key IS NOT NULL"
+                    )
+                    owners = {row[0]: row[1] for row in await cursor.fetchall()}
+                finally:
+                    await release_connection(conn)
+                self._keys = {user_id: key for key, user_id in owners.items()}
+                self._owners = owners
+        return self._owners
+
+    async def is_taken(self, key: str, user_id: Optional[int] = None) -> bool:
+        """Занят ли ключ кем-то, кроме user_id."""
+        owner = (await self._ensure_loaded()).get(key)
+        return owner is not None and owner != user_id
+
+    def claim(self, key: str, user_id: int):
+        """Записывает новый ник игрока и освобождает прежний."""
+        if self._owners is None:
+            return
+        old_key = self._keys.get(user_id)
+        if old_key is not None and self._owners.get(old_key) == user_id:
+            del self._owners[old_key]
+        self._owners[key] = user_id
+        self._keys[user_id] = key
+
+    def clear(self):
+        """Сбрасывает реестр; следующая проверка загрузит его заново."""
+        self._owners = None
+        self._keys = {}
+
+_nickname_registry = NicknameRegistry()
+
+async def is_nickname_taken(nickname: str, user_id: Optional[int] = None) -> bool:
+    """
+    Быстрая проверка для ввода ника: занят ли он другим игроком.
+    
+    Ник без ключа (пустой или ник по умолчанию) не занят, а недопустим -
+    это проверяется отдельно через normalize_nickname.
+    """
+    key = normalize_nickname(nickname)
+    return key is not None and await _nickname_registry.is_taken(key, user_id)
+
 # Остальные существующие функции из оригинального файла
+async def cache_patsan(patsan_data: Dict[str, Any]) -> None:
+    """Кладёт копию данных игрока в кэш (write-through)."""
+    await get_cache_manager().set('user', str(patsan_data['user_id']), dict(patsan_data), ttl=USER_CACHE_TTL)
+    _update_matchmaker(patsan_data)
+
+def _update_matchmaker(patsan_data: Dict[str, Any]) -> None:
+    """Переносит игрока в нужную полосу силы, если индекс подбора загружен или грузится."""
+    get_matchmaker().player_saved(
+        patsan_data['user_id'], patsan_data.get('gofra_mm', 10.0), patsan_data.get('cable_mm', 10.0)
+    )
+
+def bump_user_version(user_id: int) -> None:
+    """Отмечает изменение игрока для кэша готовых текстов."""
+    state_versions.bump('user', user_id)
+    # Глобальные топы собираются из всех игроков
+    state_versions.bump('users')
+
+async def invalidate_cached_patsan(user_id: int) -> None:
+    """Убирает игрока из кэша после изменения строки в обход save_patsan."""
+    await get_cache_manager().delete('user', str(user_id))
+    bump_user_version(user_id)
+    # В обход save_patsan меняется ник, а он есть в топах чатов и радёмок
+    state_versions.bump('names')
+
 async def get_patsan(user_id: int) -> Dict[str, Any]:
-    """Получает данные пользователя из базы данных."""
+    """Получает данные пользователя (сначала кэш, затем база данных)."""
+    cached = await get_cache_manager().get('user', str(user_id))
+    if cached:
+        # Копия: вызывающий код меняет словарь перед save_patsan
+        return dict(cached)
+    
+    # Промах заполняется в очереди игрока: строка, прочитанная до commit
+    # чужой записи, иначе затёрла бы в кэше свежие данные на USER_CACHE_TTL
+    async with get_user_executor().lock(user_id):
+        cached = await get_cache_manager().get('user', str(user_id))
+        if cached:
+            return dict(cached)
+        patsan = await _load_patsan(user_id)
+        await cache_patsan(patsan)
+    return patsan
+
+async def _load_patsan(user_id: int) -> Dict[str, Any]:
+    """Читает пользователя из базы данных, создавая его при первом обращении."""
     conn = await get_connection()
     try:
         cursor = await conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
@@ -682,10 +1145,10 @@ async def get_patsan(user_id: int) -> Dict[str, Any]:
             return dict(row)
         else:
             # Создаем нового пользователя, если его нет в базе
-            await conn.execute("""
-                INSERT OR IGNORE INTO users (user_id) VALUES (?)
-            """, (user_id,))
-            await conn.commit()
+            async with write_transaction():
+                await conn.execute("""
+                    INSERT OR IGNORE INTO users (user_id) VALUES (?)
+                """, (user_id,))
             # Повторно получаем данные созданного пользователя
             cursor = await conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
             row = await cursor.fetchone()
@@ -711,56 +1174,92 @@ async def get_patsan(user_id: int) -> Dict[str, Any]:
     finally:
         await release_connection(conn)
 
+# Сохранение игрока не трогает nickname и nickname_key: ник меняет только
+# change_nickname. INSERT OR REPLACE здесь нельзя - при конфликте уникального
+# nickname_key он удалил бы строку другого игрока (и сбрасывал created_at)
+SQL_SAVE_PATSAN = """
+    INSERT INTO users (
+        user_id, nickname, gofra_mm, cable_mm, atm_count,
+        zmiy_grams, total_zmiy_grams, cable_power, gofra,
+        last_atm_regen, last_davka, last_rademka, updated_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        gofra_mm = excluded.gofra_mm,
+        cable_mm = excluded.cable_mm,
+        atm_count = excluded.atm_count,
+        zmiy_grams = excluded.zmiy_grams,
+        total_zmiy_grams = excluded.total_zmiy_grams,
+        cable_power = excluded.cable_power,
+        gofra = excluded.gofra,
+        last_atm_regen = excluded.last_atm_regen,
+        last_davka = excluded.last_davka,
+        last_rademka = excluded.last_rademka,
+        updated_at = excluded.updated_at
+"""
+
+def _patsan_row(patsan_data: Dict[str, Any]) -> tuple:
+    return (
+        patsan_data['user_id'],
+        patsan_data.get('nickname', DEFAULT_NICKNAME),
+        patsan_data.get('gofra_mm', 10.0),
+        patsan_data.get('cable_mm', 10.0),
+        patsan_data.get('atm_count', 0),
+        patsan_data.get('zmiy_grams', 0.0),
+        patsan_data.get('total_zmiy_grams', 0.0),
+        patsan_data.get('cable_power', 2),
+        patsan_data.get('gofra', 1),
+        patsan_data.get('last_atm_regen', 0),
+        patsan_data.get('last_davka', 0),
+        patsan_data.get('last_rademka', 0),
+        int(time.time())
+    )
+
 async def save_patsan(patsan_data: Dict[str, Any]):
     """Сохраняет данные пользователя в базу данных."""
-    conn = await get_connection()
-    try:
-        await conn.execute("""
-            INSERT OR REPLACE INTO users (
-                user_id, nickname, gofra_mm, cable_mm, atm_count,
-                zmiy_grams, total_zmiy_grams, cable_power, gofra,
-                last_atm_regen, last_davka, last_rademka, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            patsan_data['user_id'],
-            patsan_data.get('nickname', 'Неизвестно'),
-            patsan_data.get('gofra_mm', 10.0),
-            patsan_data.get('cable_mm', 10.0),
-            patsan_data.get('atm_count', 0),
-            patsan_data.get('zmiy_grams', 0.0),
-            patsan_data.get('total_zmiy_grams', 0.0),
-            patsan_data.get('cable_power', 2),
-            patsan_data.get('gofra', 1),
-            patsan_data.get('last_atm_regen', 0),
-            patsan_data.get('last_davka', 0),
-            patsan_data.get('last_rademka', 0),
-            int(time.time())
-        ))
-        await conn.commit()
-    finally:
-        await release_connection(conn)
+    async with write_transaction() as conn:
+        await conn.execute(SQL_SAVE_PATSAN, _patsan_row(patsan_data))
+    
+    bump_user_version(patsan_data['user_id'])
+    await cache_patsan(patsan_data)
 
+@serialized_by_user
 async def change_nickname(user_id: int, new_nickname: str) -> Tuple[bool, str]:
-    """Изменяет никнейм пользователя."""
-    conn = None
+    """
+    Изменяет никнейм пользователя.
+    
+    Занятость проверяется по реестру в памяти, а окончательно - уникальным
+    индексом: проверка и запись - один UPDATE, две одновременные заявки
+    на один ник не пройдут обе.
+    """
+    key = normalize_nickname(new_nickname)
+    if key is None:
+        return False, "Этот никнейм недоступен"
+    if await _nickname_registry.is_taken(key, user_id):
+        return False, "Этот никнейм уже используется"
+
+    # Строка игрока должна существовать, иначе UPDATE ничего не изменит
+    await get_patsan(user_id)
     try:
-        conn = await get_connection()
-        # Проверяем, не используется ли этот никнейм уже
-        cursor = await conn.execute("SELECT user_id FROM users WHERE nickname = ? AND user_id != ?", (new_nickname, user_id))
-        existing = await cursor.fetchone()
-        if existing:
-            return False, "Этот никнейм уже используется"
-
-        await conn.execute("UPDATE users SET nickname = ?, updated_at = ? WHERE user_id = ?",
-                         (new_nickname, int(time.time()), user_id))
-        await conn.commit()
-        return True, "Никнейм успешно изменен"
+        async with write_transaction() as conn:
+            await conn.execute(
+                "UPDATE users SET nickname = ?, nickname_key = ?, updated_at = ? WHERE user_id = ?",
+                (new_nickname, key, int(time.time()), user_id)
+            )
+    except sqlite3.IntegrityError:
+        return False, "Этот никнейм уже используется"
     except Exception as e:
-        logger.error(f"Ошибка при изменении никнейма: {e}")
+        logger.error("Ошибка при изменении никнейма: %s", e)
         return False, f"Ошибка при изменении никнейма: {e}"
-    finally:
-        if conn is not None:
-            await release_connection(conn)
+
+    _nickname_registry.claim(key, user_id)
+    await invalidate_cached_patsan(user_id)
+    get_action_log().append(ACTION_NICKNAME, user_id)
+    return True, "Никнейм успешно изменен"
+
+SQL_TOP_PLAYERS = (
+    "SELECT user_id, nickname, gofra_mm, cable_mm, zmiy_grams, total_zmiy_grams, atm_count "
+    "FROM users ORDER BY {sort_by} DESC LIMIT ?"
+)
 
 async def get_top_players(limit: int = 10, sort_by: str = "gofra") -> List[Dict[str, Any]]:
     """Получает топ игроков по указанному критерию с оптимизированным запросом."""
@@ -771,8 +1270,7 @@ async def get_top_players(limit: int = 10, sort_by: str = "gofra") -> List[Dict[
         if sort_by not in valid_sort_fields:
             sort_by = "gofra_mm"
         
-        query = f"SELECT user_id, nickname, gofra_mm, cable_mm, zmiy_grams, total_zmiy_grams, atm_count FROM users ORDER BY {sort_by} DESC LIMIT ?"
-        cursor = await conn.execute(query, (limit,))
+        cursor = await conn.execute(SQL_TOP_PLAYERS.format(sort_by=sort_by), (limit,))
         
         # Получаем имена колонок ПРЯМО ИЗ КУРСОРА
         column_names = [desc[0] for desc in cursor.description]
@@ -792,41 +1290,20 @@ async def bulk_update_users(users_data: List[Dict[str, Any]]):
     if not users_data:
         return
     
-    conn = await get_connection()
     try:
-        # Используем транзакцию для пакетного обновления
-        await conn.execute("BEGIN")
-        
-        for user_data in users_data:
-            await conn.execute("""
-                INSERT OR REPLACE INTO users (
-                    user_id, nickname, gofra_mm, cable_mm, atm_count,
-                    zmiy_grams, total_zmiy_grams, cable_power, gofra,
-                    last_atm_regen, last_davka, last_rademka, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_data['user_id'],
-                user_data.get('nickname', 'Неизвестно'),
-                user_data.get('gofra_mm', 10.0),
-                user_data.get('cable_mm', 10.0),
-                user_data.get('atm_count', 0),
-                user_data.get('zmiy_grams', 0.0),
-                user_data.get('total_zmiy_grams', 0.0),
-                user_data.get('cable_power', 2),
-                user_data.get('gofra', 1),
-                user_data.get('last_atm_regen', 0),
-                user_data.get('last_davka', 0),
-                user_data.get('last_rademka', 0),
-                int(time.time())
-            ))
-        
-        await conn.commit()
+        # Все строки - одна транзакция
+        async with write_transaction() as conn:
+            await conn.executemany(SQL_SAVE_PATSAN, [_patsan_row(user_data) for user_data in users_data])
     except Exception as e:
-        await conn.rollback()
-        logger.error(f"Ошибка при пакетном обновлении пользователей: {e}")
+        logger.error("Ошибка при пакетном обновлении пользователей: %s", e)
         raise
-    finally:
-        await release_connection(conn)
+    
+    for user_data in users_data:
+        bump_user_version(user_data['user_id'])
+        _update_matchmaker(user_data)
+    await get_cache_manager().batch_set(
+        'user', {str(u['user_id']): dict(u) for u in users_data}, ttl=USER_CACHE_TTL
+    )
 
 async def get_multiple_users(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
     """Пакетная загрузка пользователей для улучшения производительности."""
@@ -844,86 +1321,82 @@ async def get_multiple_users(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
         cursor = await conn.execute(query, user_ids)
         rows = await cursor.fetchall()
         
-        # Получаем имена колонок
-        cursor = await conn.execute("PRAGMA table_info(users)")
-        columns = await cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        
         # Преобразуем строки в словари и группируем по user_id
         result = {}
         for row in rows:
-            user_data = dict(zip(column_names, row))
+            user_data = dict(row)
             result[user_data['user_id']] = user_data
         
         return result
     finally:
         await release_connection(conn)
 
-async def save_rademka_fight(winner_id: int, loser_id: int, money_taken: int = 0):
-    """Сохраняет результат боя радёмки."""
+async def get_recently_active_user_ids(limit: int = 500) -> List[int]:
+    """Возвращает id игроков, чьи данные менялись последними (для прогрева кэша)."""
     conn = await get_connection()
     try:
-        await conn.execute("""
-            INSERT INTO rademka_fights (winner_id, loser_id, created_at)
-            VALUES (?, ?, ?)
-        """, (winner_id, loser_id, int(time.time())))
-        await conn.commit()
+        cursor = await conn.execute(
+            "SELECT user_id FROM users ORDER BY updated_at DESC LIMIT ?", (limit,)
+        )
+        return [row[0] for row in await cursor.fetchall()]
     finally:
         await release_connection(conn)
 
-def get_gofra_info(gofra_mm: float) -> Dict[str, Any]:
-    """Возвращает информацию о гофрошке на основе её длины."""
-    gofra_levels = [
-        {"threshold": 10.0, "name": "Новичок", "emoji": "🐣", "atm_speed": 1.0, "min_grams": 50, "max_grams": 100},
-        {"threshold": 50.0, "name": "Ученик", "emoji": "👶", "atm_speed": 1.1, "min_grams": 100, "max_grams": 200},
-        {"threshold": 150.0, "name": "Подмастерье", "emoji": "👷", "atm_speed": 1.2, "min_grams": 200, "max_grams": 300},
-        {"threshold": 300.0, "name": "Мастер", "emoji": "👨‍🔧", "atm_speed": 1.3, "min_grams": 300, "max_grams": 400},
-        {"threshold": 600.0, "name": "Эксперт", "emoji": "👨‍💼", "atm_speed": 1.4, "min_grams": 400, "max_grams": 500},
-        {"threshold": 1200.0, "name": "Гуру", "emoji": "🧙", "atm_speed": 1.5, "min_grams": 500, "max_grams": 600},
-        {"threshold": 2500.0, "name": "Легенда", "emoji": "🏆", "atm_speed": 1.6, "min_grams": 600, "max_grams": 700},
-        {"threshold": 5000.0, "name": "Бог гофрошки", "emoji": "👑", "atm_speed": 1.7, "min_grams": 700, "max_grams": 800},
-        {"threshold": 10000.0, "name": "Гофроцентрал", "emoji": "🏗️", "atm_speed": 1.8, "min_grams": 800, "max_grams": 900},
-        {"threshold": 20000.0, "name": "Коричневый бог", "emoji": "💩", "atm_speed": 2.0, "min_grams": 900, "max_grams": 1100}
-    ]
-
-    # Находим текущий уровень гофрошки
-    current_level = None
-    next_level = None
-
-    for i, level in enumerate(gofra_levels):
-        if gofra_mm >= level["threshold"]:
-            current_level = level
-            if i + 1 < len(gofra_levels):
-                next_level = gofra_levels[i + 1]
-            else:
-                next_level = None
-        else:
-            break
-
-    if not current_level:
-        current_level = gofra_levels[0]
-        next_level = gofra_levels[1] if len(gofra_levels) > 1 else None
+async def get_recently_active_chat_ids(limit: int = 100) -> List[int]:
+    """Возвращает id чатов с самой свежей активностью (для прогрева кэша)."""
+    conn = await get_connection()
+    try:
+        cursor = await conn.execute(
+            "SELECT chat_id FROM chat_stats WHERE last_activity > 0 ORDER BY last_activity DESC LIMIT ?",
+            (limit,)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+    finally:
+        await release_connection(conn)
 
-    # Вычисляем прогресс до следующего уровня
-    if next_level:
-        current_threshold = current_level["threshold"]
-        next_threshold = next_level["threshold"]
-        progress = (gofra_mm - current_threshold) / (next_threshold - current_threshold)
-    else:
-        progress = 1.0
-        next_level = None
+async def get_multiple_chat_stats(chat_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Пакетная загрузка статистики чатов одним запросом."""
+    if not chat_ids:
+        return {}
+    
+    conn = await get_connection()
+    try:
+        placeholders = ','.join(['?'] * len(chat_ids))
+        cursor = await conn.execute(
+            f"SELECT * FROM chat_stats WHERE chat_id IN ({placeholders})", chat_ids
+        )
+        return {row['chat_id']: _overlay_chat_stats(dict(row)) for row in await cursor.fetchall()}
+    finally:
+        await release_connection(conn)
 
-    return {
-        "name": current_level["name"],
-        "emoji": current_level["emoji"],
-        "atm_speed": current_level["atm_speed"],
-        "min_grams": current_level["min_grams"],
-        "max_grams": current_level["max_grams"],
-        "length_display": f"{gofra_mm/10:.1f} см",
-        "width_display": f"{gofra_mm:.1f} см",
-        "progress": progress,
-        "next_threshold": next_level["threshold"] if next_level else None
-    }
+async def save_rademka_fight(winner_id: int, loser_id: int, money_taken: int = 0):
+    """Сохраняет результат боя радёмки и обновляет агрегаты обоих игроков."""
+    now = int(time.time())
+    # Бой и оба агрегата - одна транзакция
+    async with write_transaction() as conn:
+        await conn.execute("""
+            INSERT INTO rademka_fights (winner_id, loser_id, money_taken, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (winner_id, loser_id, money_taken, now))
+        await conn.execute("""
+            INSERT INTO rademka_player_stats (user_id, wins, money_won, last_fight_at)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                wins = wins + 1,
+                money_won = money_won + excluded.money_won,
+                last_fight_at = excluded.last_fight_at
+        """, (winner_id, money_taken, now))
+        await conn.execute("""
+            INSERT INTO rademka_player_stats (user_id, losses, money_lost, last_fight_at)
+            VALUES (?, 1, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                losses = losses + 1,
+                money_lost = money_lost + excluded.money_lost,
+                last_fight_at = excluded.last_fight_at
+        """, (loser_id, money_taken, now))
+    state_versions.bump('fights')
+    get_action_log().append(ACTION_FIGHT, winner_id, loser_id, money_taken, now)
+    get_matchmaker().fight_saved(winner_id, loser_id, now)
 
 # format_length импортируется из utils.display (строка 66)
 
@@ -950,63 +1423,95 @@ async def calculate_atm_regen_time(patsan: Dict[str, Any]) -> Dict[str, Any]:
         'time_to_one_atm': actual_time_per_atm
     }
 
-async def davka_zmiy(user_id: int, chat_id: Optional[int] = None) -> Tuple[bool, Optional[Dict[str, Any]], Dict[str, Any]]:
-    """Обрабатывает давку змия пользователем."""
-    try:
-        patsan = await get_patsan(user_id)
-        gofra_info = get_gofra_info(patsan.get('gofra_mm', 10.0))
-
-        # Проверяем, есть ли атмосферы для давки
-        if patsan.get('atm_count', 0) < 12:
-            return False, None, {"error": "Нужно 12 атмосфер для давки змия!"}
-
-        # Вычисляем вес змия
-        zmiy_grams = random.randint(gofra_info['min_grams'], gofra_info['max_grams'])
-
-        # Обновляем данные пользователя
-        old_gofra_mm = patsan.get('gofra_mm', 10.0)
-        old_cable_mm = patsan.get('cable_mm', 10.0)
-
-        # Получаем опыт за змия (0.025 мм за 1 грамм - для достижения 70-100 мм за месяц)
-        exp_gained_mm = zmiy_grams * 0.025
-
-        new_gofra_mm = old_gofra_mm + exp_gained_mm
-        new_cable_mm = old_cable_mm + (zmiy_grams / 1000) * 150.0  # 150.0 мм за 1 кг - для достижения 300-500 мм за месяц
-
-        # Специальное сообщение для килограммовых змеев
-        special_message = None
-        if zmiy_grams > 1000:
-            special_message = "КИЛОГРАММ ГОВНА ЗА ДВАДЦАТЬ ПЯТЬ СЕКУНД"
-
-        # Сбрасываем атмосферы
-        patsan['atm_count'] = 0
-        patsan['zmiy_grams'] = zmiy_grams
-        patsan['total_zmiy_grams'] = patsan.get('total_zmiy_grams', 0) + zmiy_grams
-        patsan['gofra_mm'] = new_gofra_mm
-        patsan['cable_mm'] = new_cable_mm
-        patsan['cable_power'] = int(new_cable_mm / 5)
-        patsan['gofra'] = int(new_gofra_mm / 10)
-        patsan['last_davka'] = int(time.time())
+# Вес змия по уровню гофрошки: CASE по порогам из GOFRA_LEVELS (от старшего
+# к младшему), :r - случайное число из [0, 1); как random.randint(min, max)
+_DAVKA_GRAMS_SQL = "CASE {} ELSE {} END".format(
+    " ".join(
+        f"WHEN gofra_mm >= {level.threshold!r} "
+        f"THEN {level.min_grams} + CAST(:r * {level.max_grams - level.min_grams + 1} AS INTEGER)"
+        for level in reversed(GOFRA_LEVELS[1:])
+    ),
+    f"{GOFRA_LEVELS[0].min_grams} + CAST(:r * {GOFRA_LEVELS[0].max_grams - GOFRA_LEVELS[0].min_grams + 1} AS INTEGER)"
+)
 
-        await save_patsan(patsan)
+# Проверка атмосфер, вес змия и прирост - один UPDATE; в SET все выражения
+# видят старые значения строки. Прирост - по формулам utils.game_formulas
+SQL_DAVKA = f"""
+    UPDATE users SET
+        atm_count = 0,
+        zmiy_grams = d.grams,
+        total_zmiy_grams = total_zmiy_grams + d.grams,
+        gofra_mm = gofra_mm + d.grams * {DAVKA_GOFRA_MM_PER_GRAM!r},
+        cable_mm = cable_mm + (d.grams / 1000.0) * {DAVKA_CABLE_MM_PER_KG!r},
+        cable_power = CAST((cable_mm + (d.grams / 1000.0) * {DAVKA_CABLE_MM_PER_KG!r}) / 5 AS INTEGER),
+        gofra = CAST((gofra_mm + d.grams * {DAVKA_GOFRA_MM_PER_GRAM!r}) / 10 AS INTEGER),
+        last_davka = :now,
+        updated_at = :now
+    FROM (SELECT {_DAVKA_GRAMS_SQL} AS grams FROM users WHERE user_id = :user_id) AS d
+    WHERE users.user_id = :user_id AND users.atm_count >= {ATM_MAX}
+    RETURNING *
+"""
+
+async def _apply_davka(user_id: int, chat_id: Optional[int], now: int) -> Tuple[Optional[Any], int]:
+    """Давка одной транзакцией; (строка игрока или None, давок игрока в чате)."""
+    params = {'user_id': user_id, 'now': now, 'r': random.random()}
+    async with write_transaction() as conn:
+        cursor = await conn.execute(SQL_DAVKA, params)
+        row = await cursor.fetchone()
+        if row is None:
+            # UPDATE ничего не изменил - откатывать нечего
+            return None, 0
+        davki = 0
+        if chat_id:
+            davki = await _upsert_user_chat_stats(conn, user_id, chat_id, row['zmiy_grams'], now)
+        return row, davki
 
-        # Обновляем статистику чата если нужно
+@serialized_by_user
+async def davka_zmiy(user_id: int, chat_id: Optional[int] = None) -> Tuple[bool, Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Обрабатывает давку змия пользователем.
+    
+    Одна транзакция: UPDATE ... RETURNING игрока и UPSERT его строки в чате.
+    Две одновременные давки не пройдут обе - вторая не найдёт 12 атмосфер.
+    """
+    now = int(time.time())
+    try:
         if chat_id:
-            await ChatManager.update_user_chat_stats(user_id, chat_id, zmiy_grams)
+            await _activity_windows.ensure_loaded(chat_id)
+        row, davki = await _apply_davka(user_id, chat_id, now)
+        if row is None:
+            # Нет атмосфер или игрока ещё нет в базе: читаем (и создаём) из базы, не из кэша
+            patsan = await _load_patsan(user_id)
+            await cache_patsan(patsan)
+            if patsan.get('atm_count', 0) < ATM_MAX:
+                return False, None, {"error": "Нужно 12 атмосфер для давки змия!"}
+            row, davki = await _apply_davka(user_id, chat_id, now)
+            if row is None:
+                return False, None, {"error": "Нужно 12 атмосфер для давки змия!"}
+
+        patsan = dict(row)
+        bump_user_version(user_id)
+        await cache_patsan(patsan)
+        zmiy_grams = int(patsan['zmiy_grams'])
+        get_action_log().append(ACTION_DAVKA, user_id, chat_id or 0, zmiy_grams, now)
+        if chat_id:
+            _record_chat_davka(chat_id, user_id, zmiy_grams, davki, now)
 
+        exp_gained_mm, cable_gained_mm = davka_gains(zmiy_grams)
         return True, patsan, {
             'zmiy_grams': zmiy_grams,
-            'old_gofra_mm': old_gofra_mm,
-            'new_gofra_mm': new_gofra_mm,
-            'old_cable_mm': old_cable_mm,
-            'new_cable_mm': new_cable_mm,
+            'old_gofra_mm': patsan['gofra_mm'] - exp_gained_mm,
+            'new_gofra_mm': patsan['gofra_mm'],
+            'old_cable_mm': patsan['cable_mm'] - cable_gained_mm,
+            'new_cable_mm': patsan['cable_mm'],
             'exp_gained_mm': exp_gained_mm
         }
 
     except Exception as e:
-        logger.error(f"Ошибка при давке змия: {e}")
+        logger.error("Ошибка при давке змия: %s", e)
         return False, None, {"error": f"Ошибка при давке змия: {e}"}
 
+@serialized_by_user
 async def uletet_zmiy(user_id: int) -> Tuple[bool, Optional[Dict[str, Any]], Dict[str, Any]]:
     """Обрабатывает отправку змия в коричневую страну."""
     try:
@@ -1022,15 +1527,34 @@ async def uletet_zmiy(user_id: int) -> Tuple[bool, Optional[Dict[str, Any]], Dic
         # patsan['atm_count'] = 12  # Восстанавливаем атмосферы
 
         await save_patsan(patsan)
+        get_action_log().append(ACTION_ULETET, user_id, 0, zmiy_grams)
 
         return True, patsan, {
             'zmiy_grams': zmiy_grams
         }
 
     except Exception as e:
-        logger.error(f"Ошибка при отправке змия: {e}")
+        logger.error("Ошибка при отправке змия: %s", e)
         return False, None, {"error": f"Ошибка при отправке змия: {e}"}
 
+# Бои игрока считаются двумя диапазонами по индексам (winner_id, created_at)
+# и (loser_id, created_at); с OR в одном WHERE SQLite может уйти в скан
+SQL_FIGHTS_SINCE = """
+    SELECT (SELECT COUNT(*) FROM rademka_fights WHERE winner_id = ? AND created_at > ?)
+         + (SELECT COUNT(*) FROM rademka_fights WHERE loser_id = ? AND created_at > ?)
+"""
+SQL_FIGHT_TOTALS = "SELECT wins, losses FROM rademka_player_stats WHERE user_id = ?"
+SQL_USERS_COUNT = "SELECT COUNT(*) FROM users"
+SQL_RADEMKA_PLAYERS_COUNT = "SELECT COUNT(*) FROM rademka_player_stats"
+SQL_RADEMKA_TOP = """
+    SELECT u.user_id, u.nickname, u.gofra_mm, u.cable_mm, rs.wins, rs.losses
+    FROM rademka_player_stats rs
+    JOIN users u ON u.user_id = rs.user_id
+    WHERE rs.wins > 0
+    ORDER BY rs.wins DESC, rs.user_id
+    LIMIT ?
+"""
+
 async def can_fight_pvp(user_id: int) -> Tuple[bool, str]:
     """Проверяет, может ли пользователь участвовать в PvP."""
     patsan = await get_patsan(user_id)
@@ -1043,10 +1567,8 @@ async def can_fight_pvp(user_id: int) -> Tuple[bool, str]:
         # Проверяем количество боёв за последний час
         conn = await get_connection()
         try:
-            cursor = await conn.execute("""
-                SELECT COUNT(*) FROM rademka_fights
-                WHERE (winner_id = ? OR loser_id = ?) AND created_at > ?
-            """, (user_id, user_id, current_time - 3600))
+            since = current_time - 3600
+            cursor = await conn.execute(SQL_FIGHTS_SINCE, (user_id, since, user_id, since))
             fight_count = await cursor.fetchone()
 
             if fight_count and fight_count[0] >= 10:
@@ -1058,28 +1580,102 @@ async def can_fight_pvp(user_id: int) -> Tuple[bool, str]:
 
     return True, "Можно драться"
 
-async def calculate_pvp_chance(attacker: Dict[str, Any], defender: Dict[str, Any]) -> float:
-    """Вычисляет шанс победы в PvP бою."""
-    # Базовый шанс
-    base_chance = 50.0
+async def get_rademka_stats(user_id: int) -> Dict[str, int]:
+    """Возвращает победы, поражения и число боёв игрока за последний час."""
+    conn = await get_connection()
+    try:
+        cursor = await conn.execute(SQL_FIGHT_TOTALS, (user_id,))
+        row = await cursor.fetchone()
+        wins, losses = (row[0], row[1]) if row else (0, 0)
+        since = int(time.time()) - 3600
+        cursor = await conn.execute(SQL_FIGHTS_SINCE, (user_id, since, user_id, since))
+        hour_fights = (await cursor.fetchone())[0]
+        return {
+            'total': wins + losses,
+            'wins': wins,
+            'losses': losses,
+            'hour_fights': hour_fights
+        }
+    finally:
+        await release_connection(conn)
+
+async def get_rademka_top(limit: int = 10) -> List[Dict[str, Any]]:
+    """Топ радёмщиков по победам за всё время."""
+    conn = await get_connection()
+    try:
+        cursor = await conn.execute(SQL_RADEMKA_TOP, (limit,))
+        return [dict(row) for row in await cursor.fetchall()]
+    finally:
+        await release_connection(conn)
 
-    # Влияние гофрошки
-    attacker_gofra = attacker.get('gofra_mm', 10.0)
-    defender_gofra = defender.get('gofra_mm', 10.0)
-    gofra_diff = attacker_gofra - defender_gofra
-    gofra_bonus = (gofra_diff / 100) * 2  # 2% за каждые 10 мм разницы
+async def get_rademka_players_count() -> int:
+    """Сколько игроков хотя бы раз участвовали в радёмке."""
+    conn = await get_connection()
+    try:
+        cursor = await conn.execute(SQL_RADEMKA_PLAYERS_COUNT)
+        return (await cursor.fetchone())[0]
+    finally:
+        await release_connection(conn)
 
-    # Влияние кабеля
-    attacker_cable = attacker.get('cable_mm', 10.0)
-    defender_cable = defender.get('cable_mm', 10.0)
-    cable_diff = attacker_cable - defender_cable
-    cable_bonus = (cable_diff / 10) * 0.2  # 0.2% за каждый 1 мм разницы
+async def get_fight_history_stats() -> Dict[str, int]:
+    """Размер горячей таблицы боёв и общее число боёв за всё время."""
+    conn = await get_connection()
+    try:
+        cursor = await conn.execute("SELECT COUNT(*) FROM rademka_fights")
+        hot_fights = (await cursor.fetchone())[0]
+        # Каждый бой - ровно одна победа
+        cursor = await conn.execute("SELECT COALESCE(SUM(wins), 0) FROM rademka_player_stats")
+        total_fights = (await cursor.fetchone())[0]
+        return {'hot_fights': hot_fights, 'total_fights': total_fights}
+    finally:
+        await release_connection(conn)
 
-    # Общий шанс
-    total_chance = base_chance + gofra_bonus + cable_bonus
+_matchmaker_lock = asyncio.Lock()
+
+async def _ensure_matchmaker() -> MatchmakingIndex:
+    """Загружает индекс подбора один раз; дальше он обновляется при сохранениях."""
+    index = get_matchmaker()
+    if index.loaded:
+        return index
+    async with _matchmaker_lock:
+        if index.loaded:
+            return index
+        since = int(time.time()) - 3600
+        # Сохранения и бои, пока идут запросы, копятся в индексе и применяются после снимка
+        index.begin_load()
+        conn = await get_connection()
+        try:
+            cursor = await conn.execute("SELECT user_id, gofra_mm, cable_mm FROM users")
+            players = await cursor.fetchall()
+            cursor = await conn.execute(
+                "SELECT winner_id, loser_id, created_at FROM rademka_fights WHERE created_at > ? ORDER BY id",
+                (since,)
+            )
+            fights = await cursor.fetchall()
+        except Exception:
+            index.abort_load()
+            raise
+        finally:
+            await release_connection(conn)
+        index.finish_load(players, [tuple(fight) for fight in fights])
+        logger.info("🎯 Индекс подбора соперников: %s", index.get_stats())
+    return index
 
-    # Ограничиваем шанс от 10% до 90%
-    return max(10.0, min(90.0, total_chance))
+async def find_rademka_opponent(user_id: int) -> Optional[Dict[str, Any]]:
+    """Случайный соперник, близкий по силе и не выбравший лимит боёв; None - некого."""
+    patsan = await get_patsan(user_id)
+    index = await _ensure_matchmaker()
+    opponent_id = index.find_opponent(user_id, patsan.get('gofra_mm', 10.0), patsan.get('cable_mm', 10.0))
+    if opponent_id is None:
+        return None
+    return await get_patsan(opponent_id)
+
+async def calculate_pvp_chance(attacker: Dict[str, Any], defender: Dict[str, Any]) -> float:
+    """Вычисляет шанс победы в PvP бою (формула - utils.game_formulas.pvp_chance)."""
+    return pvp_chance(
+        attacker.get('gofra_mm', 10.0), attacker.get('cable_mm', 10.0),
+        defender.get('gofra_mm', 10.0), defender.get('cable_mm', 10.0)
+    )
 
 async def calculate_davka_cooldown(patsan: Dict[str, Any]) -> Dict[str, Any]:
     """Вычисляет время до следующей давки змия."""
@@ -1112,107 +1708,197 @@ async def calculate_davka_cooldown(patsan: Dict[str, Any]) -> Dict[str, Any]:
             'formatted_time': ft(remaining_time)
         }
 
+SQL_CHAT_TOP = """
+    SELECT u.user_id, u.nickname, u.gofra_mm, u.cable_mm, uc.total_zmiy_grams,
+           RANK() OVER (ORDER BY uc.total_zmiy_grams DESC) as rank
+    FROM user_chat_stats uc
+    JOIN users u ON uc.user_id = u.user_id
+    WHERE uc.chat_id = ?
+    ORDER BY uc.total_zmiy_grams DESC
+    LIMIT ?
+"""
+
+# Накопленные в памяти приращения счётчиков чатов: chat_id -> приращения.
+# Сбрасываются в chat_stats раз в DB_CONFIG['batch_save_interval'] секунд
+# и при остановке бота; при падении процесса теряется не больше одного интервала.
+_chat_deltas: Dict[int, Dict[str, Any]] = {}
+_chat_flush_task = None
+
+def _chat_delta(chat_id: int) -> Dict[str, Any]:
+    delta = _chat_deltas.get(chat_id)
+    if delta is None:
+        delta = _chat_deltas[chat_id] = {
+            'total_zmiy_all': 0.0, 'total_davki_all': 0, 'total_players': 0, 'last_activity': 0
+        }
+    return delta
+
+class ChatActivityWindows:
+    """
+    Скользящие окна активных игроков по чатам: chat_id -> {user_id: последняя давка}.
+    
+    Окно чата подгружается из user_chat_stats при первом обращении, дальше
+    обновляется давками; записи старше недели выкидываются в prune().
+    Счёт точный и стоит O(участников чата за неделю) памяти.
+    """
+
+    def __init__(self):
+        self._windows: Dict[int, Dict[int, int]] = {}
+
+    def is_loaded(self, chat_id: int) -> bool:
+        return chat_id in self._windows
+
+    async def ensure_loaded(self, chat_id: int):
+        if chat_id in self._windows:
+            return
+        since = int(time.time()) - ACTIVE_WINDOW_WEEK
+        conn = await get_connection()
+        try:
+            cursor = await conn.execute(
+                "SELECT user_id, last_activity FROM user_chat_stats WHERE chat_id = ? AND last_activity >= ?",
+                (chat_id, since)
+            )
+            rows = await cursor.fetchall()
+        finally:
+            await release_connection(conn)
+        # Пока шёл запрос, окно могли заполнить давки - берём более свежие отметки
+        window = self._windows.setdefault(chat_id, {})
+        for user_id, last_activity in rows:
+            if window.get(user_id, 0) < last_activity:
+                window[user_id] = last_activity
+
+    def touch(self, chat_id: int, user_id: int, timestamp: int):
+        window = self._windows.get(chat_id)
+        if window is not None:
+            window[user_id] = timestamp
+
+    def counts(self, chat_id: int, now: Optional[int] = None) -> Tuple[int, int]:
+        """(активных за 24 часа, активных за 7 дней)."""
+        now = now or int(time.time())
+        day_since = now - ACTIVE_WINDOW_DAY
+        week_since = now - ACTIVE_WINDOW_WEEK
+        day = week = 0
+        for last_activity in self._windows.get(chat_id, {}).values():
+            if last_activity >= week_since:
+                week += 1
+                if last_activity >= day_since:
+                    day += 1
+        return day, week
+
+    def loaded_chats(self) -> List[int]:
+        return list(self._windows)
+
+    def prune(self, now: Optional[int] = None):
+        """Убирает игроков, не давивших неделю, и опустевшие чаты."""
+        week_since = (now or int(time.time())) - ACTIVE_WINDOW_WEEK
+        for chat_id in list(self._windows):
+            window = self._windows[chat_id]
+            stale = [user_id for user_id, ts in window.items() if ts < week_since]
+            for user_id in stale:
+                del window[user_id]
+            if not window:
+                del self._windows[chat_id]
+
+_activity_windows = ChatActivityWindows()
+
+async def _upsert_user_chat_stats(conn: aiosqlite.Connection, user_id: int, chat_id: int,
+                                  zmiy_grams: float, now: int) -> int:
+    """UPSERT строки игрока в чате без commit; возвращает число его давок в чате."""
+    cursor = await conn.execute("""
+        INSERT INTO user_chat_stats (user_id, chat_id, total_zmiy_grams, last_activity, davki)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT(user_id, chat_id) DO UPDATE SET
+            total_zmiy_grams = total_zmiy_grams + excluded.total_zmiy_grams,
+            last_activity = excluded.last_activity,
+            davki = davki + 1
+        RETURNING davki
+    """, (user_id, chat_id, zmiy_grams, now))
+    return (await cursor.fetchone())[0]
+
+def _record_chat_davka(chat_id: int, user_id: int, zmiy_grams: float, davki: int, now: int):
+    """Общие счётчики чата - в память до следующего ChatManager.flush()."""
+    delta = _chat_delta(chat_id)
+    delta['total_zmiy_all'] += zmiy_grams
+    delta['total_davki_all'] += 1
+    if davki == 1:
+        # Первая давка игрока в этом чате
+        delta['total_players'] += 1
+    state_versions.bump('chat', chat_id)
+    _activity_windows.touch(chat_id, user_id, now)
+
+def _overlay_chat_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавляет к строке chat_stats ещё не записанные приращения и живые окна активности."""
+    chat_id = stats.get('chat_id')
+    delta = _chat_deltas.get(chat_id)
+    if delta:
+        stats['total_zmiy_all'] = (stats.get('total_zmiy_all') or 0) + delta['total_zmiy_all']
+        stats['total_davki_all'] = (stats.get('total_davki_all') or 0) + delta['total_davki_all']
+        stats['total_players'] = (stats.get('total_players') or 0) + delta['total_players']
+        stats['last_activity'] = max(stats.get('last_activity') or 0, delta['last_activity'])
+    if _activity_windows.is_loaded(chat_id):
+        stats['active_players'], stats['active_players_7d'] = _activity_windows.counts(chat_id)
+    return stats
+
 class ChatManager:
-    """Менеджер для работы со статистикой чатов."""
+    """
+    Менеджер для работы со статистикой чатов.
+    
+    Строка игрока в чате обновляется одним UPSERT на давку, а общие счётчики
+    чата копятся в памяти и записываются пачкой в flush().
+    """
 
     @staticmethod
     async def register_chat(chat_id: int, chat_title: str, chat_type: str):
         """Регистрирует чат в системе."""
-        conn = await get_connection()
-        try:
+        async with write_transaction() as conn:
             await conn.execute("""
                 INSERT OR IGNORE INTO chat_stats (
                     chat_id, chat_title, chat_type
                 ) VALUES (?, ?, ?)
             """, (chat_id, chat_title, chat_type))
-            await conn.commit()
-        finally:
-            await release_connection(conn)
 
     @staticmethod
     async def update_chat_activity(chat_id: int):
         """Обновляет время последней активности в чате."""
-        conn = await get_connection()
-        try:
-            await conn.execute("""
-                UPDATE chat_stats
-                SET last_activity = ?, active_players = active_players + 1
-                WHERE chat_id = ?
-            """, (int(time.time()), chat_id))
-            await conn.commit()
-        finally:
-            await conn.close()
+        _chat_delta(chat_id)['last_activity'] = int(time.time())
 
     @staticmethod
     async def get_chat_stats(chat_id: int) -> Dict[str, Any]:
-        """Получает статистику чата."""
+        """Получает статистику чата (с ещё не записанными приращениями)."""
         conn = await get_connection()
         try:
             cursor = await conn.execute("""
                 SELECT * FROM chat_stats WHERE chat_id = ?
             """, (chat_id,))
             row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            else:
-                return {
-                    'chat_id': chat_id,
-                    'chat_title': '',
-                    'chat_type': 'private',
-                    'total_players': 0,
-                    'active_players': 0,
-                    'total_zmiy_all': 0.0,
-                    'total_davki_all': 0,
-                    'last_activity': 0,
-                    'created_at': int(time.time())
-                }
         finally:
-            await conn.close()
+            await release_connection(conn)
+
+        if row:
+            stats = dict(row)
+        else:
+            stats = {
+                'chat_id': chat_id,
+                'chat_title': '',
+                'chat_type': 'private',
+                'total_players': 0,
+                'active_players': 0,
+                'active_players_7d': 0,
+                'total_zmiy_all': 0.0,
+                'total_davki_all': 0,
+                'last_activity': 0,
+                'created_at': int(time.time())
+            }
+        await _activity_windows.ensure_loaded(chat_id)
+        return _overlay_chat_stats(stats)
 
     @staticmethod
     async def update_user_chat_stats(user_id: int, chat_id: int, zmiy_grams: float):
         """Обновляет статистику пользователя в чате."""
-        conn = await get_connection()
-        try:
-            # Обновляем или создаем запись для пользователя в чате
-            await conn.execute("""
-                INSERT OR IGNORE INTO user_chat_stats (
-                    user_id, chat_id, total_zmiy_grams, last_activity
-                ) VALUES (?, ?, ?, ?)
-            """, (user_id, chat_id, 0.0, int(time.time())))
-
-            await conn.execute("""
-                UPDATE user_chat_stats
-                SET total_zmiy_grams = total_zmiy_grams + ?,
-                    last_activity = ?
-                WHERE user_id = ? AND chat_id = ?
-            """, (zmiy_grams, int(time.time()), user_id, chat_id))
-
-            # Обновляем общую статистику чата
-            await conn.execute("""
-                UPDATE chat_stats
-                SET total_zmiy_all = total_zmiy_all + ?,
-                    total_davki_all = total_davki_all + 1
-                WHERE chat_id = ?
-            """, (zmiy_grams, chat_id))
-
-            # Проверяем, есть ли пользователь в общем списке чата
-            cursor = await conn.execute("""
-                SELECT user_id FROM user_chat_stats WHERE chat_id = ? AND user_id = ?
-            """, (chat_id, user_id))
-            exists = await cursor.fetchone()
-
-            if not exists:
-                # Увеличиваем количество игроков в чате
-                await conn.execute("""
-                    UPDATE chat_stats
-                    SET total_players = total_players + 1
-                    WHERE chat_id = ?
-                """, (chat_id,))
-
-            await conn.commit()
-        finally:
-            await conn.close()
+        now = int(time.time())
+        await _activity_windows.ensure_loaded(chat_id)
+        async with write_transaction() as conn:
+            davki = await _upsert_user_chat_stats(conn, user_id, chat_id, zmiy_grams, now)
+        _record_chat_davka(chat_id, user_id, zmiy_grams, davki, now)
 
     @staticmethod
     async def get_user_total_in_chat(chat_id: int, user_id: int) -> float:
@@ -1226,26 +1912,306 @@ class ChatManager:
             row = await cursor.fetchone()
             return row[0] if row else 0.0
         finally:
-            await conn.close()
+            await release_connection(conn)
 
     @staticmethod
     async def get_chat_top(chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """Получает топ игроков в чате."""
         conn = await get_connection()
         try:
-            cursor = await conn.execute("""
-                SELECT u.user_id, u.nickname, u.gofra_mm, u.cable_mm, uc.total_zmiy_grams,
-                       RANK() OVER (ORDER BY uc.total_zmiy_grams DESC) as rank
-                FROM user_chat_stats uc
-                JOIN users u ON uc.user_id = u.user_id
-                WHERE uc.chat_id = ?
-                ORDER BY uc.total_zmiy_grams DESC
-                LIMIT ?
-            """, (chat_id, limit))
+            cursor = await conn.execute(SQL_CHAT_TOP, (chat_id, limit))
             rows = await cursor.fetchall()
             return [dict(row) for row in rows]
         finally:
-            await conn.close()
+            await release_connection(conn)
+
+    @staticmethod
+    async def flush() -> int:
+        """
+        Записывает накопленные приращения счётчиков чатов одной транзакцией.
+        
+        Заодно сохраняет текущие окна активности всех загруженных чатов,
+        чтобы active_players в базе убывал и у затихших чатов.
+        """
+        global _chat_deltas
+        now = int(time.time())
+        _activity_windows.prune(now)
+        active_rows = [
+            (*_activity_windows.counts(chat_id, now), chat_id)
+            for chat_id in _activity_windows.loaded_chats()
+        ]
+        if not _chat_deltas and not active_rows:
+            return 0
+        # Новые давки во время записи копятся уже в свежем словаре
+        pending, _chat_deltas = _chat_deltas, {}
+        try:
+            async with write_transaction() as conn:
+                await conn.executemany("""
+                    UPDATE chat_stats
+                    SET total_zmiy_all = total_zmiy_all + ?,
+                        total_davki_all = total_davki_all + ?,
+                        total_players = total_players + ?,
+                        last_activity = MAX(last_activity, ?)
+                    WHERE chat_id = ?
+                """, [
+                    (d['total_zmiy_all'], d['total_davki_all'], d['total_players'], d['last_activity'], chat_id)
+                    for chat_id, d in pending.items()
+                ])
+                await conn.executemany(
+                    "UPDATE chat_stats SET active_players = ?, active_players_7d = ? WHERE chat_id = ?",
+                    active_rows
+                )
+        except Exception:
+            # Возвращаем приращения, чтобы записать их в следующий раз
+            for chat_id, d in pending.items():
+                delta = _chat_delta(chat_id)
+                delta['total_zmiy_all'] += d['total_zmiy_all']
+                delta['total_davki_all'] += d['total_davki_all']
+                delta['total_players'] += d['total_players']
+                delta['last_activity'] = max(delta['last_activity'], d['last_activity'])
+            raise
+        return len(pending)
+
+async def chat_stats_flush_loop(interval_seconds: float):
+    """Фоновая запись счётчиков чатов."""
+    while True:
+        try:
+            await asyncio.sleep(interval_seconds)
+            await ChatManager.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("❌ Ошибка записи статистики чатов: %s", e)
+
+async def start_chat_stats_flusher(interval_seconds: Optional[float] = None):
+    """Запускает фоновую запись счётчиков чатов."""
+    global _chat_flush_task
+    if interval_seconds is None:
+        interval_seconds = DB_CONFIG.get("batch_save_interval", 5)
+    if _chat_flush_task is None or _chat_flush_task.done():
+        _chat_flush_task = asyncio.create_task(chat_stats_flush_loop(interval_seconds))
+        logger.info("✅ Пакетная запись статистики чатов запущена (интервал: %sс)", interval_seconds)
+
+async def stop_chat_stats_flusher():
+    """Останавливает фоновую запись и сбрасывает остаток в базу."""
+    global _chat_flush_task
+    if _chat_flush_task is not None and not _chat_flush_task.done():
+        _chat_flush_task.cancel()
+        try:
+            await _chat_flush_task
+        except asyncio.CancelledError:
+            pass
+    _chat_flush_task = None
+    try:
+        await ChatManager.flush()
+    except Exception as e:
+        logger.error("❌ Не удалось записать статистику чатов при остановке: %s", e)
+
+
+# ============ QUERY PLANS ============
+#
+# Запросы, которые выполняются на каждое действие игрока. Для каждого
+# check_hot_query_plans() делает EXPLAIN QUERY PLAN и сообщает о полном
+# скане таблицы или временной сортировке. Прогрев кэша (ORDER BY updated_at /
+# last_activity) сюда сознательно не входит: он идёт раз на запуск, а индекс
+# по часто меняющемуся updated_at дорожал бы на каждой записи.
+
+HOT_QUERIES: Dict[str, Tuple[str, tuple]] = {
+    "get_patsan": ("SELECT * FROM users WHERE user_id = ?", (1,)),
+    "nickname_taken": ("SELECT user_id FROM users WHERE nickname_key = ?", ("nick",)),
+    "top_players_gofra": (SQL_TOP_PLAYERS.format(sort_by="gofra_mm"), (10,)),
+    "fights_last_hour": (SQL_FIGHTS_SINCE, (1, 0, 1, 0)),
+    "fight_totals": (SQL_FIGHT_TOTALS, (1,)),
+    "rademka_top": (SQL_RADEMKA_TOP, (10,)),
+    "chat_stats": ("SELECT * FROM chat_stats WHERE chat_id = ?", (1,)),
+    "chat_top": (SQL_CHAT_TOP, (1, 10)),
+    "user_total_in_chat": (
+        "SELECT total_zmiy_grams FROM user_chat_stats WHERE chat_id = ? AND user_id = ?", (1, 1)
+    ),
+    # Запросы страниц обработчиков: админка "Игроки" и цели радёмки в чате
+    "admin_players_total": (SQL_USERS_COUNT, ()),
+    "admin_rademka_players": (SQL_RADEMKA_PLAYERS_COUNT, ()),
+    "chat_rademka_opponents": (SQL_CHAT_TOP, (1, 20)),
+}
+
+async def check_hot_query_plans(conn: Optional[aiosqlite.Connection] = None) -> List[Tuple[str, str]]:
+    """
+    Прогоняет EXPLAIN QUERY PLAN для HOT_QUERIES.
+    
+    Возвращает список (имя запроса, строка плана) для полных сканов таблиц
+    и сортировок во временном B-дереве; пустой список - все запросы идут по индексам.
+    """
+    if conn is None:
+        conn = await get_connection()
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        cursor = await conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        for row in await cursor.fetchall():
+            detail = row[3]
+            full_scan = (
+                detail.startswith("SCAN ")
+                and "USING" not in detail
+                and "CONSTANT ROW" not in detail
+                and "(subquery" not in detail
+            )
+            if full_scan or "USE TEMP B-TREE" in detail:
+                problems.append((name, detail))
+    return problems
+
+
+# ============ FIGHT HISTORY ============
+#
+# rademka_fights хранит только бои за последние hot_retention секунд:
+# горячие запросы смотрят на последний час, победы и поражения за всё время
+# лежат в rademka_player_stats. Более старые бои переносятся в таблицы
+# rademka_fights_archive_YYYYMM (месяц по UTC) и больше не читаются ботом.
+
+FIGHT_ARCHIVE_PREFIX = "rademka_fights_archive_"
+
+_archive_task = None
+
+def fight_archive_table(created_at: int) -> str:
+    """Имя архивной таблицы для боя с данным временем."""
+    return FIGHT_ARCHIVE_PREFIX + datetime.utcfromtimestamp(created_at).strftime('%Y%m')
+
+async def _ensure_fight_archive(conn: aiosqlite.Connection, table: str):
+    """Создаёт архивную таблицу боёв, если её ещё нет."""
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        winner_id INTEGER,
+        loser_id INTEGER,
+        money_taken INTEGER DEFAULT 0,
+        created_at INTEGER
+    )
+    """)
+
+async def _fight_tables(conn: aiosqlite.Connection) -> List[str]:
+    """Горячая таблица боёв и все архивные."""
+    cursor = await conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ORDER BY name",
+        (FIGHT_ARCHIVE_PREFIX + '%',)
+    )
+    return ['rademka_fights'] + [row[0] for row in await cursor.fetchall()]
+
+async def rebuild_rademka_player_stats(conn: aiosqlite.Connection):
+    """
+    Пересчитывает rademka_player_stats по горячей таблице и архивам.
+    
+    Коммитит сам; вызывается из миграции и restore_all_data, уже под _write_lock.
+    """
+    parts = []
+    for table in await _fight_tables(conn):
+        parts.append(f"""
+            SELECT winner_id AS user_id, 1 AS wins, 0 AS losses,
+                   COALESCE(money_taken, 0) AS money_won, 0 AS money_lost, created_at
+            FROM {table}
+            UNION ALL
+            SELECT loser_id, 0, 1, 0, COALESCE(money_taken, 0), created_at
+            FROM {table}
+        """)
+    try:
+        await conn.execute("DELETE FROM rademka_player_stats")
+        await conn.execute(f"""
+            INSERT INTO rademka_player_stats (user_id, wins, losses, money_won, money_lost, last_fight_at)
+            SELECT user_id, SUM(wins), SUM(losses), SUM(money_won), SUM(money_lost), MAX(created_at)
+            FROM ({" UNION ALL ".join(parts)})
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        """)
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+
+async def archive_old_fights(retention_seconds: Optional[int] = None,
+                             batch_size: Optional[int] = None) -> int:
+    """
+    Переносит бои старше retention_seconds в помесячные архивные таблицы.
+    
+    Каждая порция - своя транзакция: перенос и удаление из горячей таблицы
+    либо происходят вместе, либо не происходят. Возвращает число перенесённых боёв.
+    """
+    if retention_seconds is None:
+        retention_seconds = FIGHT_HISTORY_CONFIG.get("hot_retention", 2 * 86400)
+    if batch_size is None:
+        batch_size = FIGHT_HISTORY_CONFIG.get("archive_batch_size", 1000)
+    cutoff = int(time.time()) - retention_seconds
+
+    moved = 0
+    conn = await get_connection()
+    try:
+        while True:
+            # Бои пишутся по возрастанию времени, поэтому старые лежат
+            # в начале таблицы и обход по id останавливается после порции
+            cursor = await conn.execute("""
+                SELECT id, winner_id, loser_id, money_taken, created_at
+                FROM rademka_fights WHERE created_at < ?
+                ORDER BY id LIMIT ?
+            """, (cutoff, batch_size))
+            rows = await cursor.fetchall()
+            if not rows:
+                break
+
+            by_table: Dict[str, list] = {}
+            for row in rows:
+                by_table.setdefault(fight_archive_table(row[4] or 0), []).append(tuple(row))
+
+            async with write_transaction():
+                for table, fights in by_table.items():
+                    await _ensure_fight_archive(conn, table)
+                    await conn.executemany(f"""
+                        INSERT OR REPLACE INTO {table} (id, winner_id, loser_id, money_taken, created_at)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, fights)
+                placeholders = ','.join(['?'] * len(rows))
+                await conn.execute(
+                    f"DELETE FROM rademka_fights WHERE id IN ({placeholders})",
+                    [row[0] for row in rows]
+                )
+
+            moved += len(rows)
+            if len(rows) < batch_size:
+                break
+            await asyncio.sleep(0)
+    finally:
+        await release_connection(conn)
+
+    if moved:
+        logger.info("📦 В архив перенесено боёв: %s", moved)
+    return moved
+
+async def fight_archive_loop(interval_seconds: int):
+    """Фоновый перенос старых боёв в архив."""
+    while True:
+        try:
+            await archive_old_fights()
+            await asyncio.sleep(interval_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("❌ Ошибка переноса боёв в архив: %s", e)
+            await asyncio.sleep(60)
+
+async def start_fight_archiver(interval_seconds: Optional[int] = None):
+    """Запускает фоновый перенос боёв в архив."""
+    global _archive_task
+    if interval_seconds is None:
+        interval_seconds = FIGHT_HISTORY_CONFIG.get("archive_interval", 3600)
+    if _archive_task is None or _archive_task.done():
+        _archive_task = asyncio.create_task(fight_archive_loop(interval_seconds))
+        logger.info("✅ Архивация боёв запущена (интервал: %sс)", interval_seconds)
+
+async def stop_fight_archiver():
+    """Останавливает фоновый перенос боёв в архив."""
+    global _archive_task
+    if _archive_task is not None and not _archive_task.done():
+        _archive_task.cancel()
+        try:
+            await _archive_task
+        except asyncio.CancelledError:
+            pass
+    _archive_task = None
 
 
 # ============ AUTO BACKUP SYSTEM ============
@@ -1262,7 +2228,7 @@ async def create_backup() -> str:
     try:
         if os.path.exists(DB_PATH):
             shutil.copy2(DB_PATH, backup_path)
-            logger.info(f"💾 Создан бэкап: {backup_filename}")
+            logger.info("💾 Создан бэкап: %s", backup_filename)
             
             # Удаляем старые бэкапы
             await cleanup_old_backups(max_keep=5)
@@ -1272,7 +2238,7 @@ async def create_backup() -> str:
             logger.warning("⚠️ База данных не существует для бэкапа")
             return ""
     except Exception as e:
-        logger.error(f"❌ Ошибка создания бэкапа: {e}")
+        logger.error("❌ Ошибка создания бэкапа: %s", e)
         return ""
 
 async def cleanup_old_backups(max_keep: int = 5):
@@ -1290,11 +2256,11 @@ async def cleanup_old_backups(max_keep: int = 5):
             old_path = os.path.join(BACKUP_DIR, old)
             try:
                 os.remove(old_path)
-                logger.info(f"🗑️ Удалён старый бэкап: {old}")
+                logger.info("🗑️ Удалён старый бэкап: %s", old)
             except Exception as e:
-                logger.warning(f"⚠️ Не удалось удалить {old}: {e}")
+                logger.warning("⚠️ Не удалось удалить %s: %s", old, e)
     except Exception as e:
-        logger.error(f"❌ Ошибка очистки бэкапов: {e}")
+        logger.error("❌ Ошибка очистки бэкапов: %s", e)
 
 async def auto_backup_loop():
     """Фоновый цикл автобэкапа."""
@@ -1310,7 +2276,7 @@ async def auto_backup_loop():
             logger.info("🛑 Остановлен фоновый автобэкап")
             raise
         except Exception as e:
-            logger.error(f"❌ Ошибка в цикле автобэкапа: {e}")
+            logger.error("❌ Ошибка в цикле автобэкапа: %s", e)
             await asyncio.sleep(60)  # Ждём минуту перед повторной попыткой
 
 async def start_auto_backup(interval_seconds: int = 3600):
@@ -1321,7 +2287,7 @@ async def start_auto_backup(interval_seconds: int = 3600):
     
     if _backup_task is None or _backup_task.done():
         _backup_task = asyncio.create_task(auto_backup_loop())
-        logger.info(f"✅ Автобэкап запущен (интервал: {interval_seconds}с)")
+        logger.info("✅ Автобэкап запущен (интервал: %sс)", interval_seconds)
     else:
         logger.info("ℹ️ Автобэкап уже запущен")
 
@@ -1363,11 +2329,11 @@ async def upload_backup_to_telegram(bot, admin_id: int) -> bool:
                 protect_content=True
             )
         
-        logger.info(f"✅ Бэкап отправлен в Telegram: {latest_backup}")
+        logger.info("✅ Бэкап отправлен в Telegram: %s", latest_backup)
         return True
         
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки бэкапа в Telegram: {e}")
+        logger.error("❌ Ошибка отправки бэкапа в Telegram: %s", e)
         return False
 
 async def get_backup_info() -> dict:
@@ -1398,5 +2364,11 @@ async def get_backup_info() -> dict:
             "total_size_mb": round(total_size / (1024*1024), 2)
         }
     except Exception as e:
-        logger.error(f"❌ Ошибка получения инфо о бэкапах: {e}")
+        logger.error("❌ Ошибка получения инфо о бэкапах: %s", e)
         return {"count": 0, "backups": [], "total_size": 0, "error": str(e)}
+
+
+# Спаны вокруг публичных корутин модуля и ChatManager: в трассе апдейта видно,
+# какой вызов базы сколько занял. Соединение берётся в каждом вызове - его не меряем
+instrument_module(globals(), "db", exclude=("get_connection", "release_connection"))
+instrument_class(ChatManager, "db.ChatManager")
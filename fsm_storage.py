@@ -0,0 +1,262 @@
+"""
+Хранилища состояний FSM для aiogram.
+
+SQLiteStorage держит состояния в таблице fsm_states общей базы бота
+с кэшем в памяти и отложенной записью (write-back): чтение и запись
+состояния в обработчике не трогают диск, изменения пишутся пачкой раз
+в flush_interval секунд. Брошенные состояния (игрок начал смену ника
+и ушёл) удаляются через state_ttl.
+
+Бэкенд выбирается в FSM_STORAGE_CONFIG: "sqlite", "redis" (RedisStorage
+aiogram поверх REDIS_CONFIG) или "memory".
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STORAGE_CONFIG, REDIS_CONFIG
+from db_manager import get_connection, release_connection, write_transaction
+
+logger = logging.getLogger(__name__)
+
+# (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny);
+# None в thread_id и business_connection_id хранится как 0 и '' - иначе
+# первичный ключ не сравнит NULL с NULL
+RowKey = Tuple[int, int, int, int, str, str]
+
+SQL_FSM_GET = """
+    SELECT state, data, updated_at FROM fsm_states
+    WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ?
+      AND business_connection_id = ? AND destiny = ?
+"""
+SQL_FSM_UPSERT = """
+    INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, business_connection_id,
+                            destiny, state, data, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(bot_id, chat_id, user_id, thread_id, business_connection_id, destiny) DO UPDATE SET
+        state = excluded.state,
+        data = excluded.data,
+        updated_at = excluded.updated_at
+"""
+SQL_FSM_DELETE = """
+    DELETE FROM fsm_states
+    WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ?
+      AND business_connection_id = ? AND destiny = ?
+"""
+
+
+def _row_key(key: StorageKey) -> RowKey:
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0,
+            key.business_connection_id or "", key.destiny)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class _Entry:
+    """Состояние ключа в памяти: dirty - ещё не записано в базу."""
+
+    __slots__ = ("state", "data", "updated_at", "dirty")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float, dirty: bool = False):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+        self.dirty = dirty
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM в таблице fsm_states с кэшем в памяти и отложенной записью.
+
+    Промах кэша - один SELECT по первичному ключу; запись только меняет
+    запись в памяти и помечает её грязной. flush() пишет грязные записи
+    одной транзакцией (пустые - удаляет), выкидывает из памяти чистые
+    записи, к которым не обращались cache_ttl секунд, и удаляет из базы
+    состояния старше state_ttl. При падении теряется не больше одного
+    интервала записи - для меню и ввода ника это приемлемо.
+    """
+
+    def __init__(self, state_ttl: Optional[int] = 86400, cache_ttl: int = 600, flush_interval: float = 2.0):
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self._entries: Dict[RowKey, _Entry] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return bool(self.state_ttl) and entry.updated_at < now - self.state_ttl
+
+    async def _entry(self, key: StorageKey, create: bool = False) -> _Entry:
+        row_key = _row_key(key)
+        entry = self._entries.get(row_key)
+        now = time.time()
+        if entry is None:
+            conn = await get_connection()
+            try:
+                cursor = await conn.execute(SQL_FSM_GET, row_key)
+                row = await cursor.fetchone()
+            finally:
+                await release_connection(conn)
+            # Пока шёл запрос, ключ могли записать - запись в памяти новее
+            entry = self._entries.get(row_key)
+            if entry is None:
+                if row is None:
+                    entry = _Entry(None, {}, now)
+                    # Промах без состояния в памяти не держим: иначе каждый, кто
+                    # хоть раз написал боту, оседал бы в _entries до первой записи
+                    if not create:
+                        return entry
+                else:
+                    entry = _Entry(row[0], json.loads(row[1]) if row[1] else {}, row[2])
+                self._entries[row_key] = entry
+        if self._expired(entry, now) and (entry.state is not None or entry.data):
+            # Брошенное состояние: игрок вернулся через сутки - начинаем с чистого листа
+            entry.state, entry.data, entry.dirty = None, {}, True
+        return entry
+
+    def _touch(self, entry: _Entry):
+        entry.updated_at = time.time()
+        entry.dirty = True
+        if self._closed:
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Пока идёт запись, задача ещё жива и _touch новую не создаёт -
+        # поэтому крутимся, пока не останется грязных записей
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("❌ Ошибка записи состояний FSM: %s", e)
+            if not any(entry.dirty for entry in self._entries.values()):
+                return
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key, create=True)
+        entry.state = _state_name(state)
+        self._touch(entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key, create=True)
+        entry.data = data.copy()
+        self._touch(entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key)).data.copy()
+
+    async def flush(self) -> int:
+        """Записывает грязные состояния; возвращает, сколько записано."""
+        async with self._flush_lock:
+            now = time.time()
+            upserts: List[tuple] = []
+            deletes: List[RowKey] = []
+            written: List[_Entry] = []
+            for row_key, entry in self._entries.items():
+                if not entry.dirty:
+                    continue
+                written.append(entry)
+                if entry.state is None and not entry.data:
+                    deletes.append(row_key)
+                else:
+                    upserts.append(row_key + (entry.state, json.dumps(entry.data, ensure_ascii=False),
+                                              int(entry.updated_at)))
+                entry.dirty = False
+
+            try:
+                async with write_transaction() as conn:
+                    if upserts:
+                        await conn.executemany(SQL_FSM_UPSERT, upserts)
+                    if deletes:
+                        await conn.executemany(SQL_FSM_DELETE, deletes)
+                    if self.state_ttl:
+                        await conn.execute("DELETE FROM fsm_states WHERE updated_at < ?",
+                                           (int(now - self.state_ttl),))
+            except Exception:
+                for entry in written:
+                    entry.dirty = True
+                raise
+
+            # Чистые и давно не тронутые записи больше не держим в памяти
+            idle_since = now - self.cache_ttl
+            for row_key in [k for k, e in self._entries.items() if not e.dirty and e.updated_at < idle_since]:
+                del self._entries[row_key]
+            return len(written)
+
+    async def close(self) -> None:
+        """
+        Дописывает состояния в базу. Повторный вызов ничего не делает:
+        graceful_shutdown закрывает хранилище до close_pool, а Dispatcher
+        вызывает close ещё раз при остановке - базу это снова не откроет.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+async def _redis_storage() -> Optional[BaseStorage]:
+    """RedisStorage aiogram с параметрами из REDIS_CONFIG; None, если Redis недоступен."""
+    try:
+        import redis.asyncio as redis
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError:
+        logger.warning("⚠️ Пакет redis не установлен")
+        return None
+    client = redis.Redis(
+        host=REDIS_CONFIG.get("host", "localhost"),
+        port=REDIS_CONFIG.get("port", 6379),
+        db=REDIS_CONFIG.get("db", 0),
+        password=REDIS_CONFIG.get("password"),
+        socket_connect_timeout=REDIS_CONFIG.get("connection_timeout", 5),
+    )
+    try:
+        await client.ping()
+    except Exception as e:
+        logger.warning("⚠️ Redis для FSM недоступен: %s", e)
+        await client.aclose()
+        return None
+    ttl = FSM_STORAGE_CONFIG.get("state_ttl")
+    return RedisStorage(redis=client, state_ttl=ttl, data_ttl=ttl)
+
+
+async def create_fsm_storage() -> BaseStorage:
+    """Хранилище FSM по FSM_STORAGE_CONFIG; Redis без связи заменяется на SQLite."""
+    backend = FSM_STORAGE_CONFIG.get("backend", "sqlite")
+    if backend == "memory":
+        logger.info("🗂️ FSM в памяти (состояния не переживут перезапуск)")
+        return MemoryStorage()
+    if backend == "redis":
+        storage = await _redis_storage()
+        if storage is not None:
+            logger.info("🗂️ FSM в Redis")
+            return storage
+        logger.warning("⚠️ FSM переключён на SQLite")
+    logger.info("🗂️ FSM в SQLite (fsm_states)")
+    return SQLiteStorage(
+        state_ttl=FSM_STORAGE_CONFIG.get("state_ttl", 86400),
+        cache_ttl=FSM_STORAGE_CONFIG.get("cache_ttl", 600),
+        flush_interval=FSM_STORAGE_CONFIG.get("flush_interval", 2.0),
+    )
@@ -1,14 +1,39 @@
+import importlib
+import logging
 from aiogram import Router
 from .commands import router as commands_router
 from .callbacks import router as callbacks_router
-from .timing_commands import router as timing_router
-from .admin_handlers import router as admin_router
+from .shared import NotModifiedMiddleware
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+# "message is not modified" обрабатывается один раз для всех callback-обработчиков,
+# включая второстепенные роутеры
+router.callback_query.outer_middleware(NotModifiedMiddleware())
+
 router.include_router(commands_router)
 router.include_router(callbacks_router)
-router.include_router(timing_router)
-router.include_router(admin_router)
 
-__all__ = ['router']
+# Редко используемые подсистемы: импортируются отдельным шагом запуска (до polling,
+# время видно в отчёте StartupTimer), порядок подключения тот же, что и раньше
+# (после основных роутеров)
+SECONDARY_ROUTERS = (
+    "handlers.timing_commands",
+    "handlers.admin_handlers",
+)
+_secondary_loaded = False
+
+def include_secondary_routers() -> None:
+    """Импортирует и подключает второстепенные роутеры (повторный вызов ничего не делает)."""
+    global _secondary_loaded
+    if _secondary_loaded:
+        return
+    _secondary_loaded = True
+    for module_path in SECONDARY_ROUTERS:
+        module = importlib.import_module(module_path)
+        router.include_router(module.router)
+    logger.info("✅ Подключены второстепенные роутеры: %s", ', '.join(SECONDARY_ROUTERS))
+
+__all__ = ['router', 'include_secondary_routers']
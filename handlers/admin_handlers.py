@@ -13,10 +13,20 @@ from aiogram.types import Message, CallbackQuery
 from keyboards import admin_keyboard, admin_system_keyboard
 from db_manager import (
     get_backup_info, create_backup, 
-    get_connection, close_pool,
-    ADMIN_CONFIG
+    get_connection, release_connection, close_pool,
+    get_rademka_players_count, get_fight_history_stats,
+    ADMIN_CONFIG, SQL_USERS_COUNT
 )
 from config import DB_CONFIG, TIMING_CONFIG
+from utils.keyed_executor import get_user_executor
+from tracing import get_tracer
+from query_stats import get_query_stats
+
+# Сколько спанов показывать в одной трассе /Gofrotraces
+TRACE_SPANS_SHOWN = 12
+# Сколько операторов на странице SQL-запросов и длина их текста
+QUERY_TOP_SHOWN = 8
+QUERY_TEXT_SHOWN = 90
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +52,41 @@ async def cmd_admin(message: Message):
         reply_markup=admin_keyboard()
     )
 
+def format_trace(trace) -> str:
+    """Трасса деревом спанов с отступами по вложенности"""
+    depth = {}
+    lines = [f"🐢 {trace.root.name} - {trace.duration_ms:.0f} мс ({len(trace.spans)} спанов)"]
+    for span in trace.spans[1:TRACE_SPANS_SHOWN + 1]:
+        depth[span.span_id] = depth.get(span.parent_id, 0) + 1
+        error = " ❌" if span.error else ""
+        lines.append(f"{'  ' * depth[span.span_id]}{span.name} {span.duration_ms:.1f} мс{error}")
+    if len(trace.spans) > TRACE_SPANS_SHOWN + 1:
+        lines.append(f"  ... ещё {len(trace.spans) - TRACE_SPANS_SHOWN - 1}")
+    lines.append(f"  trace_id: {trace.trace_id}")
+    return "\n".join(lines)
+
+@router.message(Command("Gofrotraces"))
+async def cmd_traces(message: Message, command: CommandObject):
+    """Самые медленные из последних трасс: /Gofrotraces [сколько]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ Доступ запрещён")
+        return
+
+    limit = int(command.args) if command.args and command.args.isdigit() else 3
+    tracer = get_tracer()
+    # Больше пяти трасс не влезает в одно сообщение
+    traces = tracer.slowest(min(limit, 5))
+    if not traces:
+        await message.answer("🔍 Трасс пока нет")
+        return
+
+    stats = tracer.get_stats()
+    header = (
+        f"🔍 САМЫЕ МЕДЛЕННЫЕ ТРАССЫ (из {stats['recent']} последних)\n"
+        f"p50: {stats['p50_ms']} мс, макс: {stats['max_ms']} мс, не выгружено: {stats['dropped']}\n\n"
+    )
+    await message.answer(header + "\n\n".join(format_trace(trace) for trace in traces))
+
 @router.callback_query(F.data.startswith("admin_"))
 async def callback_admin(callback: CallbackQuery):
     """Обработка кнопок админ-панели"""
@@ -70,6 +115,7 @@ async def callback_admin(callback: CallbackQuery):
         
         elif action == "admin_stats":
             backup_info = await get_backup_info()
+            queues = get_user_executor().get_stats()
             message_text = (
                 "📊 **СТАТИСТИКА СИСТЕМЫ**\n\n"
                 f"📁 Бэкапов: {backup_info.get('count', 0)}\n"
@@ -80,7 +126,11 @@ async def callback_admin(callback: CallbackQuery):
                 f"- Интервал сохранения: {DB_CONFIG.get('batch_save_interval', 5)}с\n\n"
                 f"⏰ Тайминг:\n"
                 f"- Давка: {TIMING_CONFIG.get('base_davka_cooldown', 7200)}с\n"
-                f"- ATM: {TIMING_CONFIG.get('atm_regen_time', 600)}с"
+                f"- ATM: {TIMING_CONFIG.get('atm_regen_time', 600)}с\n\n"
+                f"🚦 Очереди игроков:\n"
+                f"- Активных: {queues['active_keys']} (ждут: {queues['queued']}, макс. глубина: {queues['max_depth']})\n"
+                f"- Выполнено: {queues['completed']}, с ожиданием: {queues['contended']}\n"
+                f"- Среднее ожидание: {queues['avg_wait_ms']} мс"
             )
             await callback.message.edit_text(message_text, reply_markup=admin_keyboard())
         
@@ -95,13 +145,11 @@ async def callback_admin(callback: CallbackQuery):
             # Статистика игроков
             conn = await get_connection()
             try:
-                cursor = await conn.execute("SELECT COUNT(*) FROM users")
+                cursor = await conn.execute(SQL_USERS_COUNT)
                 result = await cursor.fetchone()
                 total_users = result[0] if result else 0
                 
-                cursor = await conn.execute("SELECT COUNT(DISTINCT user_id) FROM rademka_fights")
-                result = await cursor.fetchone()
-                rademka_players = result[0] if result else 0
+                rademka_players = await get_rademka_players_count()
                 
                 message_text = (
                     "👥 **СТАТИСТИКА ИГРОКОВ**\n\n"
@@ -111,7 +159,7 @@ async def callback_admin(callback: CallbackQuery):
                 )
                 await callback.message.edit_text(message_text, reply_markup=admin_keyboard())
             finally:
-                await conn.close()
+                await release_connection(conn)
         
         elif action == "admin_logs":
             log_dir = "storage/logs"
@@ -134,6 +182,31 @@ async def callback_admin(callback: CallbackQuery):
                     reply_markup=admin_keyboard()
                 )
         
+        elif action == "admin_queries":
+            query_stats = get_query_stats()
+            summary = query_stats.get_stats()
+            message_text = (
+                "🐌 **SQL-ЗАПРОСЫ**\n\n"
+                f"Операторов: {summary['statements']}, запросов: {summary['queries']}, "
+                f"всего: {summary['total_ms']} мс, медленных: {summary['slow']}\n\n"
+                "По суммарному времени:\n"
+            )
+            for row in query_stats.top(QUERY_TOP_SHOWN):
+                statement = row['statement']
+                if len(statement) > QUERY_TEXT_SHOWN:
+                    statement = statement[:QUERY_TEXT_SHOWN] + "..."
+                message_text += (
+                    f"\n⏱️ {row['total_ms']:.0f} мс - {row['count']} раз, "
+                    f"ср. {row['avg_ms']:.2f}, p99 {row['p99_ms']:.2f}, макс. {row['max_ms']:.1f}\n"
+                    f"{statement}\n"
+                )
+            if query_stats.slow_log:
+                last = query_stats.slow_log[-1]
+                message_text += f"\nПоследний медленный: {last['ms']:.0f} мс\n{last['statement'][:QUERY_TEXT_SHOWN]}"
+                if last['plan']:
+                    message_text += "\nПлан: " + "; ".join(last['plan'])[:500]
+            await callback.message.edit_text(message_text, reply_markup=admin_keyboard())
+
         elif action == "admin_settings":
             await callback.message.edit_text(
                 "⚙️ **НАСТРОЙКИ**\n\n"
@@ -147,8 +220,8 @@ async def callback_admin(callback: CallbackQuery):
                 cursor = await conn.execute("SELECT COUNT(*) FROM users")
                 users_count = (await cursor.fetchone())[0]
                 
-                cursor = await conn.execute("SELECT COUNT(*) FROM rademka_fights")
-                fights_count = (await cursor.fetchone())[0]
+                fight_history = await get_fight_history_stats()
+                fights_count = fight_history['total_fights']
                 
                 cursor = await conn.execute("SELECT COUNT(*) FROM chat_stats")
                 chats_count = (await cursor.fetchone())[0]
@@ -162,12 +235,12 @@ async def callback_admin(callback: CallbackQuery):
                     f"💾 Размер: {db_size:.2f} МБ\n\n"
                     f"📊 Таблицы:\n"
                     f"- Пользователи: {users_count}\n"
-                    f"- Бои радёмки: {fights_count}\n"
+                    f"- Бои радёмки: {fights_count} (в горячей таблице: {fight_history['hot_fights']})\n"
                     f"- Чаты: {chats_count}"
                 )
                 await callback.message.edit_text(message_text, reply_markup=admin_keyboard())
             finally:
-                await conn.close()
+                await release_connection(conn)
         
         elif action == "admin_redis":
             await callback.message.edit_text(
@@ -210,7 +283,7 @@ async def callback_admin(callback: CallbackQuery):
         await callback.answer()
         
     except Exception as e:
-        logger.error(f"Error in admin callback: {e}")
+        logger.error("Error in admin callback: %s", e)
         await callback.message.edit_text(
             f"❌ Ошибка: {e}",
             reply_markup=admin_keyboard()
@@ -7,11 +7,12 @@ from db_manager import (
     calculate_atm_regen_time, calculate_davka_cooldown
 )
 from utils.display import format_length
+from utils.gofra_levels import next_levels
 from keyboards import (
     main_keyboard, gofra_info_kb, cable_info_kb, atm_status_kb,
     back_to_profile_keyboard
 )
-from .shared import ignore_not_modified_error, ft, pb
+from .shared import ft, pb
 from .chat_handlers import show_user_chat_stats_message, show_user_gofra, show_user_cable, show_user_atm, show_user_profile, show_user_atm_regen
 
 router = Router()
@@ -56,7 +57,7 @@ async def handle_davka_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in davka callback: {e}")
+        logger.error("Error in davka callback: %s", e)
         await callback.answer("❌ Ошибка при давке змия", show_alert=True)
 
 @router.callback_query(F.data == "uletet")
@@ -83,7 +84,7 @@ async def handle_uletet_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in uletet callback: {e}")
+        logger.error("Error in uletet callback: %s", e)
         await callback.answer("❌ Ошибка при отправке змия", show_alert=True)
 
 @router.callback_query(F.data == "gofra_info")
@@ -112,7 +113,7 @@ async def handle_cable_info_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in cable info callback: {e}")
+        logger.error("Error in cable info callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации о кабеле", show_alert=True)
 
 @router.callback_query(F.data == "atm_status")
@@ -142,7 +143,7 @@ async def handle_atm_status_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in atm status callback: {e}")
+        logger.error("Error in atm status callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации об атмосферах", show_alert=True)
 
 @router.callback_query(F.data == "profile")
@@ -181,7 +182,7 @@ async def handle_profile_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in profile callback: {e}")
+        logger.error("Error in profile callback: %s", e)
         await callback.answer("❌ Ошибка загрузки профиля", show_alert=True)
 
 # ==================== GOFRA DETAIL CALLBACKS ====================
@@ -221,7 +222,7 @@ async def handle_gofra_progress_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in gofra progress callback: {e}")
+        logger.error("Error in gofra progress callback: %s", e)
         await callback.answer("❌ Ошибка загрузки прогресса гофрошки", show_alert=True)
 
 @router.callback_query(F.data == "gofra_speed")
@@ -250,7 +251,7 @@ async def handle_gofra_speed_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in gofra speed callback: {e}")
+        logger.error("Error in gofra speed callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации о скорости", show_alert=True)
 
 @router.callback_query(F.data == "gofra_next")
@@ -291,7 +292,7 @@ async def handle_gofra_next_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in gofra next callback: {e}")
+        logger.error("Error in gofra next callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации о следующей гофрошке", show_alert=True)
 
 # ==================== CABLE DETAIL CALLBACKS ====================
@@ -321,7 +322,7 @@ async def handle_cable_power_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in cable power callback: {e}")
+        logger.error("Error in cable power callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации о силе кабеля", show_alert=True)
 
 @router.callback_query(F.data == "cable_pvp_info")
@@ -350,7 +351,7 @@ async def handle_cable_pvp_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in cable pvp callback: {e}")
+        logger.error("Error in cable pvp callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации о PvP", show_alert=True)
 
 @router.callback_query(F.data == "cable_upgrade_info")
@@ -382,7 +383,7 @@ async def handle_cable_upgrade_callback(callback: types.CallbackQuery):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in cable upgrade callback: {e}")
+        logger.error("Error in cable upgrade callback: %s", e)
         await callback.answer("❌ Ошибка загрузки информации о прокачке", show_alert=True)
 
 # ==================== CHAT COMMAND HANDLERS ====================
@@ -394,7 +395,6 @@ async def my_chat_stats_command(message: types.Message):
 # ========== ATM HANDLERS ==========
 
 @router.callback_query(F.data == "atm_regen_time")
-@ignore_not_modified_error
 async def atm_regen_time_info(callback: types.CallbackQuery):
     try:
         await callback.answer()
@@ -432,7 +432,6 @@ async def atm_regen_time_info(callback: types.CallbackQuery):
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {str(e)[:100]}", show_alert=True)
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "atm_max_info")
 async def atm_max_info(callback: types.CallbackQuery):
     try:
@@ -470,7 +469,6 @@ async def atm_max_info(callback: types.CallbackQuery):
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {str(e)[:100]}", show_alert=True)
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "atm_boosters")
 async def atm_boosters_info(callback: types.CallbackQuery):
     try:
@@ -495,15 +493,10 @@ async def atm_boosters_info(callback: types.CallbackQuery):
             f"Следующие уровни гофрошки:\n"
         )
 
-        thresholds = [10.0, 50.0, 150.0, 300.0, 600.0, 1200.0, 2500.0, 5000.0, 10000.0, 20000.0]
         current_gofra = patsan.get('gofra_mm', 10.0)
 
-        for i, threshold in enumerate(thresholds):
-            if current_gofra < threshold:
-                next_info = get_gofra_info(threshold)
-                text += f"• {next_info['emoji']} {next_info['name']}: x{next_info['atm_speed']:.2f}\n"
-                if i >= 2:
-                    break
+        for next_info in next_levels(current_gofra, 3):
+            text += f"• {next_info.emoji} {next_info.name}: x{next_info.atm_speed:.2f}\n"
 
         await callback.message.edit_text(
             text,
@@ -12,11 +12,13 @@ import logging
 from db_manager import (
     get_patsan, davka_zmiy, get_gofra_info,
     format_length, ChatManager, calculate_atm_regen_time,
-    can_fight_pvp, get_connection, calculate_davka_cooldown
+    can_fight_pvp, calculate_davka_cooldown, change_nickname
 )
 from keyboards import (
     chat_menu_keyboard as get_chat_menu_keyboard,
 )
+from cache_manager import get_chat_stats_cached, get_chat_top_cached
+from utils.render_cache import state_versions, get_render_cache
 from .shared import ft, validate_nickname
 
 logger = logging.getLogger(__name__)
@@ -42,12 +44,50 @@ class NicknameChange(StatesGroup):
 
 # ==================== CHAT UTILITY FUNCTIONS ====================
 
+async def render_chat_top(chat_id: int) -> str:
+    """Text of the chat top; rebuilt only after a davka in this chat or a nickname change"""
+    version = (state_versions.get('chat', chat_id), state_versions.get('names'))
+    render_cache = get_render_cache()
+    text = render_cache.get('chat_top', chat_id, version)
+    if text is not None:
+        return text
+
+    top_players = await get_chat_top_cached(chat_id, limit=10)
+    if not top_players:
+        # Empty top is not cached: the first davka must show up right away
+        return ""
+
+    medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+
+    text = f"🏆 ТОП ЧАТА:\n\n"
+
+    for i, player in enumerate(top_players):
+        medal = medals[i] if i < len(medals) else f"{i+1}."
+        nickname = player.get('nickname', f'Игрок_{player.get("user_id")}')
+        if len(nickname) > 20:
+            nickname = nickname[:17] + "..."
+
+        total_kg = player['total_zmiy_grams'] / 1000
+
+        text += f"{medal} {nickname}\n"
+        text += f"   🐍 {total_kg:.1f} кг змия | #{player['rank']}\n\n"
+
+    stats = await get_chat_stats_cached(chat_id)
+    text += f"📈 Статистика чата:\n"
+    text += f"• Участников: {stats['total_players']}\n"
+    text += f"• Всего змия: {stats['total_zmiy_all']/1000:.1f} кг\n"
+    text += f"• Всего давок: {stats['total_davki_all']}\n"
+    text += f"• Активных: {stats['active_players']}"
+
+    return render_cache.put('chat_top', chat_id, version, text)
+
+
 async def show_chat_top_message(chat_id, message_obj):
     """Show chat top leaderboard (used by both message and callback handlers)"""
     try:
-        top_players = await ChatManager.get_chat_top(chat_id, limit=10)
+        text = await render_chat_top(chat_id)
 
-        if not top_players:
+        if not text:
             await message_obj.answer(
                 "📊 ТОП ЧАТА ПУСТ!\n\n"
                 "Пока никто не давил змия в этом чате.\n"
@@ -56,39 +96,17 @@ async def show_chat_top_message(chat_id, message_obj):
             )
             return
 
-        medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
-
-        text = f"🏆 ТОП ЧАТА:\n\n"
-
-        for i, player in enumerate(top_players):
-            medal = medals[i] if i < len(medals) else f"{i+1}."
-            nickname = player.get('nickname', f'Игрок_{player.get("user_id")}')
-            if len(nickname) > 20:
-                nickname = nickname[:17] + "..."
-
-            total_kg = player['total_zmiy_grams'] / 1000
-
-            text += f"{medal} {nickname}\n"
-            text += f"   🐍 {total_kg:.1f} кг змия | #{player['rank']}\n\n"
-
-        stats = await ChatManager.get_chat_stats(chat_id)
-        text += f"📈 Статистика чата:\n"
-        text += f"• Участников: {stats['total_players']}\n"
-        text += f"• Всего змия: {stats['total_zmiy_all']/1000:.1f} кг\n"
-        text += f"• Всего давок: {stats['total_davki_all']}\n"
-        text += f"• Активных: {stats['active_players']}"
-
         await message_obj.answer(text, reply_markup=get_chat_menu_keyboard())
 
     except Exception as e:
-        logger.error(f"Error getting chat top: {e}")
+        logger.error("Error getting chat top: %s", e)
         await message_obj.answer("❌ Ошибка загрузки топа чата.", reply_markup=get_chat_menu_keyboard())
 
 
 async def show_chat_stats_message(chat_id, message_obj):
     """Show chat statistics (used by both message and callback handlers)"""
     try:
-        stats = await ChatManager.get_chat_stats(chat_id)
+        stats = await get_chat_stats_cached(chat_id)
 
         if stats['last_activity'] > 0:
             last_active = time.strftime('%d.%m.%Y %H:%M', time.localtime(stats['last_activity']))
@@ -97,7 +115,7 @@ async def show_chat_stats_message(chat_id, message_obj):
 
         text = f"📊 СТАТИСТИКА ЧАТА\n\n"
         text += f"👥 Участников: {stats['total_players']}\n"
-        text += f"🔥 Активных: {stats['active_players']}\n\n"
+        text += f"🔥 Активных за сутки: {stats['active_players']} (за неделю: {stats.get('active_players_7d', 0)})\n\n"
 
         text += f"🐍 Змий добыто:\n"
         text += f"• Всего: {stats['total_zmiy_all']/1000:.1f} кг\n"
@@ -112,7 +130,7 @@ async def show_chat_stats_message(chat_id, message_obj):
         await message_obj.answer(text, reply_markup=get_chat_menu_keyboard())
 
     except Exception as e:
-        logger.error(f"Error getting chat stats: {e}")
+        logger.error("Error getting chat stats: %s", e)
         await message_obj.answer("❌ Ошибка загрузки статистики.", reply_markup=get_chat_menu_keyboard())
 
 
@@ -165,7 +183,7 @@ async def process_chat_davka_message(user_id, chat_id, message_obj):
         await message_obj.answer(text, reply_markup=get_chat_menu_keyboard())
 
     except Exception as e:
-        logger.error(f"Error in group davka: {e}")
+        logger.error("Error in group davka: %s", e)
         await message_obj.answer("❌ Ошибка при давке змия.", reply_markup=get_chat_menu_keyboard())
 
 
@@ -219,7 +237,7 @@ async def show_user_chat_stats_message(user_id, chat_id, message_obj):
         await message_obj.answer(text, reply_markup=get_chat_menu_keyboard())
 
     except Exception as e:
-        logger.error(f"Error getting user chat stats: {e}")
+        logger.error("Error getting user chat stats: %s", e)
         await message_obj.answer("❌ Ошибка загрузки статистики.", reply_markup=get_chat_menu_keyboard())
 
 
@@ -257,7 +275,7 @@ async def show_user_gofra(callback: types.CallbackQuery, user_id: int, reply_mar
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in show_user_gofra: {e}")
+        logger.error("Error in show_user_gofra: %s", e)
         await callback.answer("❌ Ошибка загрузки информации", show_alert=True)
 
 
@@ -283,7 +301,7 @@ async def show_user_cable(callback: types.CallbackQuery, user_id: int, reply_mar
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in show_user_cable: {e}")
+        logger.error("Error in show_user_cable: %s", e)
         await callback.answer("❌ Ошибка загрузки информации", show_alert=True)
 
 
@@ -315,22 +333,38 @@ async def show_user_atm(callback: types.CallbackQuery, user_id: int, reply_marku
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in show_user_atm: {e}")
+        logger.error("Error in show_user_atm: %s", e)
         await callback.answer("❌ Ошибка загрузки информации", show_alert=True)
 
 
+def _render_profile_parts(p: dict) -> tuple:
+    """Static parts of the profile text: before and after the davka timer"""
+    gofra_info = get_gofra_info(p.get('gofra_mm', 10.0))
+
+    head = f"📊 ТВОЙ ПРОФИЛЬ\n\n"
+    head += f"🏗️ Гофра: {gofra_info.get('width_display', gofra_info['length_display'])}\n"
+    head += f"🔌 Кабель: {format_length(p.get('cable_mm', 10.0))}\n"
+    head += f"🌀 Атмосферы: {p.get('atm_count', 0)}/12\n"
+    head += f"🐍 Змий: {p.get('zmiy_grams', 0.0):.0f}г\n\n"
+
+    tail = f"📈 Прогресс:\n"
+    tail += f"{gofra_info['emoji']} {gofra_info['name']}\n"
+    tail += f"⚡ Скорость атмосфер: x{gofra_info['atm_speed']:.2f}\n"
+    tail += f"⚖️ Вес змия: {gofra_info['min_grams']}-{gofra_info['max_grams']}г"
+    return head, tail
+
+
 async def show_user_profile(callback: types.CallbackQuery, user_id: int, reply_markup=None, show_timer=True):
     """Show user profile - unified function for both chat and personal context"""
     try:
         p = await get_patsan(user_id)
-        gofra_info = get_gofra_info(p.get('gofra_mm', 10.0))
-
-        text = f"📊 ТВОЙ ПРОФИЛЬ\n\n"
-        text += f"🏗️ Гофра: {gofra_info.get('width_display', gofra_info['length_display'])}\n"
-        text += f"🔌 Кабель: {format_length(p.get('cable_mm', 10.0))}\n"
-        text += f"🌀 Атмосферы: {p.get('atm_count', 0)}/12\n"
-        text += f"🐍 Змий: {p.get('zmiy_grams', 0.0):.0f}г\n\n"
+        # Timer depends on the current time, so only the parts around it are cached
+        head, tail = get_render_cache().get_or_render(
+            'profile', user_id, state_versions.get('user', user_id),
+            lambda: _render_profile_parts(p)
+        )
 
+        text = head
         if show_timer:
             cooldown_info = await calculate_davka_cooldown(p)
             if cooldown_info.get('can_davka'):
@@ -339,11 +373,7 @@ async def show_user_profile(callback: types.CallbackQuery, user_id: int, reply_m
             else:
                 text += f"⏰ СЛЕДУЮЩАЯ ДАВКА ЧЕРЕЗ:\n"
                 text += f"{ft(cooldown_info['time_until_next'])}\n\n"
-
-        text += f"📈 Прогресс:\n"
-        text += f"{gofra_info['emoji']} {gofra_info['name']}\n"
-        text += f"⚡ Скорость атмосфер: x{gofra_info['atm_speed']:.2f}\n"
-        text += f"⚖️ Вес змия: {gofra_info['min_grams']}-{gofra_info['max_grams']}г"
+        text += tail
 
         keyboard = reply_markup or get_chat_menu_keyboard()
         try:
@@ -354,7 +384,7 @@ async def show_user_profile(callback: types.CallbackQuery, user_id: int, reply_m
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in show_user_profile: {e}")
+        logger.error("Error in show_user_profile: %s", e)
         await callback.answer("❌ Ошибка загрузки профиля", show_alert=True)
 
 
@@ -393,7 +423,7 @@ async def show_user_atm_regen(callback: types.CallbackQuery, user_id: int, reply
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in show_user_atm_regen: {e}")
+        logger.error("Error in show_user_atm_regen: %s", e)
         await callback.answer("❌ Ошибка загрузки таймера", show_alert=True)
 
 
@@ -456,34 +486,12 @@ async def process_chat_davka_callback(callback: types.CallbackQuery, user_id: in
 async def show_chat_top_callback(callback: types.CallbackQuery, chat_id: int):
     """Show chat top callback"""
     try:
-        top_players = await ChatManager.get_chat_top(chat_id, limit=10)
+        text = await render_chat_top(chat_id)
 
-        if not top_players:
+        if not text:
             await callback.answer("📊 Топ чата пуст! Будь первым!", show_alert=True)
             return
 
-        medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
-
-        text = f"🏆 ТОП ЧАТА:\n\n"
-
-        for i, player in enumerate(top_players):
-            medal = medals[i] if i < len(medals) else f"{i+1}."
-            nickname = player.get('nickname', f'Игрок_{player.get("user_id")}')
-            if len(nickname) > 20:
-                nickname = nickname[:17] + "..."
-
-            total_kg = player['total_zmiy_grams'] / 1000
-
-            text += f"{medal} {nickname}\n"
-            text += f"   🐍 {total_kg:.1f} кг змия | #{player['rank']}\n\n"
-
-        stats = await ChatManager.get_chat_stats(chat_id)
-        text += f"📈 Статистика чата:\n"
-        text += f"• Участников: {stats['total_players']}\n"
-        text += f"• Всего змия: {stats['total_zmiy_all']/1000:.1f} кг\n"
-        text += f"• Всего давок: {stats['total_davki_all']}\n"
-        text += f"• Активных: {stats['active_players']}"
-
         try:
             await callback.message.edit_text(text, reply_markup=get_chat_menu_keyboard())
         except TelegramBadRequest:
@@ -492,14 +500,14 @@ async def show_chat_top_callback(callback: types.CallbackQuery, chat_id: int):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in chat callback top: {e}")
+        logger.error("Error in chat callback top: %s", e)
         await callback.answer("❌ Ошибка загрузки топа", show_alert=True)
 
 
 async def show_chat_stats_callback(callback: types.CallbackQuery, chat_id: int):
     """Show chat stats callback"""
     try:
-        stats = await ChatManager.get_chat_stats(chat_id)
+        stats = await get_chat_stats_cached(chat_id)
 
         if stats['last_activity'] > 0:
             last_active = time.strftime('%d.%m.%Y %H:%M', time.localtime(stats['last_activity']))
@@ -508,7 +516,7 @@ async def show_chat_stats_callback(callback: types.CallbackQuery, chat_id: int):
 
         text = f"📊 СТАТИСТИКА ЧАТА\n\n"
         text += f"👥 Участников: {stats['total_players']}\n"
-        text += f"🔥 Активных: {stats['active_players']}\n\n"
+        text += f"🔥 Активных за сутки: {stats['active_players']} (за неделю: {stats.get('active_players_7d', 0)})\n\n"
 
         text += f"🐍 Змий добыто:\n"
         text += f"• Всего: {stats['total_zmiy_all']/1000:.1f} кг\n"
@@ -528,7 +536,7 @@ async def show_chat_stats_callback(callback: types.CallbackQuery, chat_id: int):
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in chat callback stats: {e}", exc_info=True)
+        logger.error("Error in chat callback stats: %s", e, exc_info=True)
         await callback.answer("❌ Ошибка загрузки статистики", show_alert=True)
 
 
@@ -591,7 +599,7 @@ async def show_user_chat_stats_callback(callback: types.CallbackQuery, user_id:
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in chat callback me: {e}")
+        logger.error("Error in chat callback me: %s", e)
         await callback.answer("❌ Ошибка загрузки статистики", show_alert=True)
 
 
@@ -610,9 +618,9 @@ async def show_rademka_callback(callback: types.CallbackQuery, user_id: int, cha
         text += f"За победу: +0.2 мм к кабелю, +5-12 мм к гофрошке\n\n"
 
         try:
-            chat_stats = await ChatManager.get_chat_stats(chat_id)
+            chat_stats = await get_chat_stats_cached(chat_id)
             if chat_stats['total_players'] > 1:
-                top_players = await ChatManager.get_chat_top(chat_id, limit=20)
+                top_players = await get_chat_top_cached(chat_id, limit=20)
                 opponents = [pl for pl in top_players if pl['user_id'] != user_id]
 
                 if opponents:
@@ -628,7 +636,7 @@ async def show_rademka_callback(callback: types.CallbackQuery, user_id: int, cha
             else:
                 text += "😕 В чате пока только ты один!\nПриведи друзей для радёмок!"
         except Exception as e:
-            logger.error(f"Error getting chat players in callback: {e}")
+            logger.error("Error getting chat players in callback: %s", e)
             text += "\nОшибка загрузки списка игроков"
 
         text += f"\n\nТвои статы:\n"
@@ -643,7 +651,7 @@ async def show_rademka_callback(callback: types.CallbackQuery, user_id: int, cha
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"Error in chat callback rademka: {e}")
+        logger.error("Error in chat callback rademka: %s", e)
         await callback.answer("❌ Ошибка загрузки информации", show_alert=True)
 
 
@@ -700,24 +708,11 @@ async def do_change_nickname(user_id: int, new_nickname: str) -> tuple[bool, str
         if not is_valid:
             return False, error_msg
 
-        # Check if nickname is already taken
-        cn = await get_connection()
-        cur = await cn.execute('SELECT user_id FROM users WHERE nickname=? AND user_id!=?', (new_nickname, user_id))
-        existing = await cur.fetchone()
-
-        if existing:
-            await cn.close()
-            return False, "Ник уже занят"
-
-        # Update nickname
-        await cn.execute('UPDATE users SET nickname=? WHERE user_id=?', (new_nickname, user_id))
-        await cn.commit()
-        await cn.close()
-
-        return True, "OK"
+        # Claim-or-fail against the unique nickname_key index
+        return await change_nickname(user_id, new_nickname)
 
     except Exception as e:
-        logger.error(f"Error changing nickname: {e}")
+        logger.error("Error changing nickname: %s", e)
         return False, "Ошибка базы данных"
 
 
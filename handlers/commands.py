@@ -1,24 +1,27 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.exceptions import TelegramBadRequest
 import time
 import random
 import logging
 from db_manager import (
-    get_patsan, get_gofra_info, 
+    get_patsan, get_gofra_info, get_gofra_infos,
     format_length, ChatManager, calculate_atm_regen_time,
     calculate_pvp_chance, can_fight_pvp, save_patsan, save_rademka_fight,
-    get_top_players, get_connection
+    get_rademka_stats, get_rademka_top, is_nickname_taken, normalize_nickname, find_rademka_opponent
 )
 from keyboards import (
     main_keyboard, profile_extended_kb, rademka_keyboard, 
     top_sort_keyboard, nickname_keyboard, gofra_info_kb, 
     cable_info_kb, atm_status_kb, back_kb, 
-    rademka_fight_keyboard, chat_menu_keyboard as get_chat_menu_keyboard
+    rademka_fight_keyboard, chat_fight_keyboard, chat_menu_keyboard as get_chat_menu_keyboard
 )
-from .shared import ignore_not_modified_error, validate_nickname
+from cache_manager import get_top_players_cached, get_chat_stats_cached, get_chat_top_cached
+from utils.render_cache import state_versions, get_render_cache
+from utils.game_formulas import PVP_ATTACK_REWARD, PVP_DEFENCE_REWARD, pvp_gofra_gain
+from utils.keyed_executor import get_user_executor
+from .shared import validate_nickname
 
 # Импортируем общие функции и константы из chat_handlers
 from .chat_handlers import (
@@ -229,14 +232,12 @@ async def cmd_nickname_handler(m: types.Message, state: FSMContext):
     await m.answer(f"🏷️ НИКНЕЙМ И РЕПУТАЦИЯ\n\n🔤 Твой ник: {p.get('nickname','Неизвестно')}\n🏗️ Гофра: {format_length(p.get('gofra_mm', 10.0))}\n🔌 Кабель: {format_length(p.get('cable_mm', 10.0))}\n\nВыбери действие:", reply_markup=nickname_keyboard())
 
 @router.callback_query(F.data == "nickname_menu")
-@ignore_not_modified_error
 async def nickname_menu(c: types.CallbackQuery):
     """Handle nickname menu callback"""
     await c.answer()
     p = await get_patsan(c.from_user.id)
     await c.message.edit_text(f"🏷️ НИКНЕЙМ И РЕПУТАЦИЯ\n\n🔤 Твой ник: {p.get('nickname','Неизвестно')}\n🏗️ Гофра: {format_length(p.get('gofra_mm', 10.0))}\n🔌 Кабель: {format_length(p.get('cable_mm', 10.0))}\n\nВыбери действие:", reply_markup=nickname_keyboard())
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "my_reputation")
 async def my_reputation(c: types.CallbackQuery):
     """Show user reputation"""
@@ -245,30 +246,34 @@ async def my_reputation(c: types.CallbackQuery):
     await c.message.edit_text(f"⭐ МОЯ РЕПУТАЦИЯ\n\n{gofra_info['emoji']} Звание: {gofra_info['name']}\n🏗️ Гофрошка: {format_length(p.get('gofra_mm', 10.0))}\n🔌 Кабель: {format_length(p.get('cable_mm', 10.0))}\n🐍 Змий: {p.get('zmiy_grams',0):.0f}г\n\nКак повысить?\n• Дави змия при полных атмосферах\n• Отправляй змия в коричневую страну\n• Участвуй в радёмках\n\nЧем больше гофрошка, тем больше уважения!", reply_markup=nickname_keyboard())
     await c.answer()
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "top_reputation")
 async def top_reputation(c: types.CallbackQuery):
     """Show top reputation"""
-    tp = await get_top_players(limit=10, sort_by="gofra")
-    if not tp: 
-        await c.message.edit_text("🥇 ТОП ГОФРЫ\n\nПока никого нет в топе!\nБудь первым!\n\nСлава ждёт!", reply_markup=nickname_keyboard())
-    else:
-        mds, txt = ["🥇","🥈","🥉","4️⃣","5️⃣","6️⃣","7️⃣","8️⃣","9️⃣","🔟"], "🥇 ТОП ГОФРЫ\n\n"
-        for i, p in enumerate(tp):
+    mds = ["🥇","🥈","🥉","4️⃣","5️⃣","6️⃣","7️⃣","8️⃣","9️⃣","🔟"]
+    version = state_versions.get('users')
+    cached = get_render_cache().get('top', 'gofra', version)
+    if cached is None:
+        tp = await get_top_players_cached(limit=10, sort_by="gofra")
+        txt = "🥇 ТОП ГОФРЫ\n\n"
+        infos = get_gofra_infos(p.get('gofra_mm', 10.0) for p in tp)
+        for i, (p, gi) in enumerate(zip(tp, infos)):
             md = mds[i] if i<len(mds) else f"{i+1}."
             nn = p.get("nickname", f"Пацан_{p.get('user_id','?')}")[:12]+("..." if len(p.get('nickname',''))>15 else "")
-            gi = get_gofra_info(p.get('gofra_mm', 10.0))
             txt += f"{md} {nn} - {gi['emoji']} {gi['name']} ({gi['length_display']})\n"
+        # The list is shared by everyone, the position line is added per user
+        cached = get_render_cache().put('top', 'gofra', version, (txt, [p.get('user_id') for p in tp]))
+    txt, user_ids = cached
+    if not user_ids: 
+        await c.message.edit_text("🥇 ТОП ГОФРЫ\n\nПока никого нет в топе!\nБудь первым!\n\nСлава ждёт!", reply_markup=nickname_keyboard())
+    else:
         uid = c.from_user.id
-        for i, p in enumerate(tp):
-            if p.get('user_id')==uid: 
-                txt+=f"\n🎯 Твоя позиция: {mds[i] if i<len(mds) else str(i+1)}"
-                break
-        txt+=f"\n👥 Всего пацанов: {len(tp)}"
+        if uid in user_ids:
+            i = user_ids.index(uid)
+            txt+=f"\n🎯 Твоя позиция: {mds[i] if i<len(mds) else str(i+1)}"
+        txt+=f"\n👥 Всего пацанов: {len(user_ids)}"
         await c.message.edit_text(txt, reply_markup=nickname_keyboard())
     await c.answer()
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "change_nickname")
 async def callback_change_nickname(c: types.CallbackQuery, state: FSMContext):
     """Handle nickname change request"""
@@ -302,6 +307,16 @@ async def process_nickname_input(message: types.Message, state: FSMContext):
         await message.answer(f"❌ {error_msg}\n\nПопробуй другой ник:", reply_markup=back_kb("nickname_menu"))
         return
 
+    # The default nickname has no uniqueness key and can never be claimed
+    if normalize_nickname(nn) is None:
+        await message.answer("❌ Этот никнейм недоступен\n\nПопробуй другой ник:", reply_markup=back_kb("nickname_menu"))
+        return
+
+    # Instant answer from the in-memory registry, no DB round-trip
+    if await is_nickname_taken(nn, message.from_user.id):
+        await message.answer("❌ Ник уже занят\n\nПопробуй другой ник:", reply_markup=back_kb("nickname_menu"))
+        return
+
     ok, msg = await do_change_nickname(message.from_user.id, nn)
     if ok:
         await message.answer(f"✅ Ник изменён!\nТеперь ты: {nn}", reply_markup=main_keyboard())
@@ -337,7 +352,6 @@ async def cmd_rademka(m: types.Message):
     txt = f"👊 ПРОТАЩИТЬ КАК РАДЁМКУ!\n\nИДИ СЮДА РАДЁМКУ БАЛЯ!\n\n{fight_status}\n\nВыбери пацана и протащи его по гофроцентралу!\nЗа успешную радёмку получишь:\n• +{CABLE_GAIN_PVP_WIN:.1f} мм к кабелю\n• +{GOFRA_BASE_GAIN:.0f}-{GOFRA_MAX_GAIN:.0f} мм к гофрошке\n• Шанс унизить публично\n\nРиски:\n• Можешь опозориться перед всеми\n• Потеряешь уважение\n\nТвои статы:\n{gofra_info['emoji']} {gofra_info['name']}\n🏗️ {format_length(p.get('gofra_mm', 10.0))}\n🔌 {format_length(p.get('cable_mm', 10.0))}"
     await m.answer(txt, reply_markup=rademka_keyboard())
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "rademka")
 async def callback_rademka(c: types.CallbackQuery):
     """Handle rademka callback"""
@@ -350,7 +364,6 @@ async def callback_rademka(c: types.CallbackQuery):
     await c.message.edit_text(f"👊 ПРОТАЩИТЬ КАК РАДЁМКУ!\n\n{fight_status}\n\nВыбери пацана!\nЗа успех: +0.2 мм к кабелю, +5-12 мм к гофрошке, публичное унижение\n\nРиски: публичный позор\n\nТвои статы:\n{gofra_info['emoji']} {gofra_info['name']}\n🏗️ {format_length(p.get('gofra_mm', 10.0))} | 🔌 {format_length(p.get('cable_mm', 10.0))}", reply_markup=rademka_keyboard())
     await c.answer()
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "rademka_random")
 async def rademka_random(c: types.CallbackQuery):
     """Handle random rademka selection"""
@@ -359,12 +372,10 @@ async def rademka_random(c: types.CallbackQuery):
         await c.answer(f"❌ {fight_msg}", show_alert=True)
         return
     
-    tp = await get_top_players(limit=50, sort_by="gofra")
-    tg = [p for p in tp if p.get("user_id")!=c.from_user.id]
-    if not tg: 
+    t = await find_rademka_opponent(c.from_user.id)
+    if not t: 
         return await c.message.edit_text("😕 НЕКОГО ПРОТАЩИВАТЬ!\n\nПриведи друзей!", reply_markup=back_kb("rademka"))
     
-    t = random.choice(tg)
     pid, tn = t.get("user_id"), t.get("nickname","Неизвестно")
     tgofra_info = get_gofra_info(t.get("gofra_mm", 10.0))
     tcable = format_length(t.get("cable_mm", 10.0))
@@ -378,85 +389,74 @@ async def rademka_random(c: types.CallbackQuery):
     await c.message.edit_text(f"🎯 НАШЁЛ ЦЕЛЬ!\n\nИДИ СЮДА РАДЁМКУ БАЛЯ!\n\n👤 Цель: {tn}\n{tgofra_info['emoji']} {tgofra_info['name']}\n🏗️ {tgofra_info['length_display']} | 🔌 {tcable}\n\n👤 Ты: {mgofra_info['emoji']} {mgofra_info['name']}\n🏗️ {mgofra_info['length_display']} | 🔌 {mcable}\n🎯 Шанс: {chance}%\n\nНаграда: +0.2 мм к кабелю, +5-12 мм к гофрошке\nРиск: позор\n\nПротащить?", reply_markup=rademka_fight_keyboard(pid))
     await c.answer()
 
-@ignore_not_modified_error
 @router.callback_query(F.data.startswith("rademka_confirm_"))
 async def rademka_confirm(c: types.CallbackQuery):
     """Handle rademka confirmation"""
     uid = c.from_user.id
     tid = int(c.data.replace("rademka_confirm_", ""))
     
-    can_fight, fight_msg = await can_fight_pvp(uid)
-    if not can_fight:
-        await c.answer(f"❌ {fight_msg}", show_alert=True)
-        return
-    
-    a = await get_patsan(uid)
-    t = await get_patsan(tid)
+    # Лимит боёв, чтение, изменение и сохранение обоих игроков - в их очередях:
+    # двойной клик ждёт первый бой и уже видит его в лимите
+    async with get_user_executor().lock(uid, tid):
+        can_fight, fight_msg = await can_fight_pvp(uid)
+        if not can_fight:
+            await c.answer(f"❌ {fight_msg}", show_alert=True)
+            return
+
+        a = await get_patsan(uid)
+        t = await get_patsan(tid)
     
-    if not a or not t: 
-        return await c.answer("Ошибка: пацан не найден!", show_alert=True)
+        if not a or not t: 
+            return await c.answer("Ошибка: пацан не найден!", show_alert=True)
     
-    chance = await calculate_pvp_chance(a, t)
-    suc = random.random() < (chance/100)
+        chance = await calculate_pvp_chance(a, t)
+        suc = random.random() < (chance/100)
     
-    if suc:
-        cable_gain_mm = 0.2
-        a["cable_mm"] = a.get("cable_mm", 10.0) + cable_gain_mm
+        if suc:
+            cable_gain_mm = PVP_ATTACK_REWARD["cable_mm"]
+            a["cable_mm"] = a.get("cable_mm", 10.0) + cable_gain_mm
         
-        level_diff = t.get("gofra_mm", 10.0) - a.get("gofra_mm", 10.0)
-        if level_diff > 0:
-            gofra_gain_mm = 12.0 + min(level_diff / 100, 8.0)
-        else:
-            gofra_gain_mm = max(5.0, 12.0 + level_diff / 200)
+            gofra_gain_mm = pvp_gofra_gain(a.get("gofra_mm", 10.0), t.get("gofra_mm", 10.0))
+            a["gofra_mm"] = a.get("gofra_mm", 10.0) + gofra_gain_mm
         
-        gofra_gain_mm = round(gofra_gain_mm, 2)
-        a["gofra_mm"] = a.get("gofra_mm", 10.0) + gofra_gain_mm
+            a["cable_power"] = int(a["cable_mm"] / 5)
+            a["gofra"] = int(a["gofra_mm"] / 10)
         
-        a["cable_power"] = int(a["cable_mm"] / 5)
-        a["gofra"] = int(a["gofra_mm"] / 10)
+            a["last_rademka"] = int(time.time())
         
+            txt = f"✅ УСПЕХ!\n\nИДИ СЮДА РАДЁМКУ БАЛЯ! ТЫ ПРОТАЩИЛ!\n\n"
+            txt += f"Ты унизил {t.get('nickname','Неизвестно')}!\n"
+            txt += f"🔌 Кабель: +{cable_gain_mm:.1f} мм (теперь {format_length(a['cable_mm'])})\n"
+            txt += f"🏗️ Гофрошка: +{gofra_gain_mm:.1f} мм (теперь {format_length(a['gofra_mm'])})\n"
+            txt += f"🎯 Шанс был: {chance}%\n"
+            txt += "Он теперь боится!"
+        else:
+            t["last_rademka"] = int(time.time())
+            txt = f"❌ ПРОВАЛ!\n\nСам оказался радёмкой...\n\n"
+            txt += f"{t.get('nickname','Неизвестно')} круче!\n"
+            txt += f"🎯 Шанс был: {chance}%\n"
+            txt += "Теперь смеются..."
+    
+        # Обновляем время последней радёмки у ОБОИХ игроков
         a["last_rademka"] = int(time.time())
-        
-        txt = f"✅ УСПЕХ!\n\nИДИ СЮДА РАДЁМКУ БАЛЯ! ТЫ ПРОТАЩИЛ!\n\n"
-        txt += f"Ты унизил {t.get('nickname','Неизвестно')}!\n"
-        txt += f"🔌 Кабель: +{cable_gain_mm:.1f} мм (теперь {format_length(a['cable_mm'])})\n"
-        txt += f"🏗️ Гофрошка: +{gofra_gain_mm:.1f} мм (теперь {format_length(a['gofra_mm'])})\n"
-        txt += f"🎯 Шанс был: {chance}%\n"
-        txt += "Он теперь боится!"
-    else:
         t["last_rademka"] = int(time.time())
-        txt = f"❌ ПРОВАЛ!\n\nСам оказался радёмкой...\n\n"
-        txt += f"{t.get('nickname','Неизвестно')} круче!\n"
-        txt += f"🎯 Шанс был: {chance}%\n"
-        txt += "Теперь смеются..."
-    
-    # Обновляем время последней радёмки у ОБОИХ игроков
-    a["last_rademka"] = int(time.time())
-    t["last_rademka"] = int(time.time())
     
-    await save_patsan(a)
-    await save_patsan(t)
-    await save_rademka_fight(winner_id=uid if suc else tid, loser_id=tid if suc else uid)
+        await save_patsan(a)
+        await save_patsan(t)
+        await save_rademka_fight(winner_id=uid if suc else tid, loser_id=tid if suc else uid)
     
     await c.message.edit_text(txt, reply_markup=back_kb("rademka"))
     await c.answer()
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "rademka_stats")
 async def rademka_stats(c: types.CallbackQuery):
     """Show rademka statistics"""
     try:
-        cn = await get_connection()
-        cur = await cn.execute('SELECT COUNT(*) as tf, SUM(CASE WHEN winner_id=? THEN 1 ELSE 0 END) as w, SUM(CASE WHEN loser_id=? THEN 1 ELSE 0 END) as l FROM rademka_fights WHERE winner_id=? OR loser_id=?', (c.from_user.id,)*4)
-        s = await cur.fetchone()
-        if s and s[0] and s[0] > 0:
-            t, w, l = s[0], s[1] or 0, s[2] or 0
+        s = await get_rademka_stats(c.from_user.id)
+        if s['total'] > 0:
+            t, w, l = s['total'], s['wins'], s['losses']
             wr = (w / t * 100) if t > 0 else 0
-            
-            cur2 = await cn.execute('SELECT COUNT(*) as hour_fights FROM rademka_fights WHERE (winner_id=? OR loser_id=?) AND created_at > ?',
-                                   (c.from_user.id, c.from_user.id, int(time.time()) - 3600))
-            hour_row = await cur2.fetchone()
-            hour_fights = hour_row[0] if hour_row else 0
+            hour_fights = s['hour_fights']
             
             txt = f"📊 СТАТИСТИКА РАДЁМОК\n\n"
             txt += f"🎲 Всего: {t}\n"
@@ -467,43 +467,48 @@ async def rademka_stats(c: types.CallbackQuery):
             txt += f"Лимит: 10 боёв в час"
         else: 
             txt = f"📊 СТАТИСТИКА РАДёмОК\n\nНет радёмок!\nВыбери цель!\n\nПока мирный пацан..."
-        await cn.close()
     except Exception as e:
-        logger.error(f"Ошибка статистики: {e}")
+        logger.error("Ошибка статистики: %s", e)
         txt = f"📊 СТАТИСТИКА РАДёмОК\n\nБаза готовится...\n\nСистема учится считать!"
     await c.message.edit_text(txt, reply_markup=back_kb("rademka"))
     await c.answer()
 
-@ignore_not_modified_error
 @router.callback_query(F.data == "rademka_top")
 async def rademka_top(c: types.CallbackQuery):
     """Show rademka leaderboard"""
     try:
-        cn = await get_connection()
-        cur = await cn.execute('SELECT u.nickname, u.user_id, u.gofra_mm, u.cable_mm, COUNT(CASE WHEN rf.winner_id=u.user_id THEN 1 END) as w, COUNT(CASE WHEN rf.loser_id=u.user_id THEN 1 END) as l FROM users u LEFT JOIN rademka_fights rf ON u.user_id=rf.winner_id OR u.user_id=rf.loser_id GROUP BY u.user_id, u.nickname, u.gofra_mm, u.cable_mm HAVING w>0 ORDER BY w DESC LIMIT 10')
-        tp = await cur.fetchall()
-        if tp:
-            mds, txt = ["🥇","🥈","🥉","4️⃣","5️⃣","6️⃣","7️⃣","8️⃣","9️⃣","🔟"], "🥇 ТОП РАДёМЩИКОВ\n\n"
-            for i, p in enumerate(tp):
-                if i>=len(mds): 
-                    break
-                md, nn, w, l, gofra_mm, cable_mm = mds[i], p.get("nickname","Неизвестно"), p.get("w",0) or 0, p.get("l",0) or 0, p.get("gofra_mm",10.0), p.get("cable_mm",10.0)
-                gofra_info = get_gofra_info(gofra_mm)
-                if len(nn)>15:
-                    nn=nn[:12]+"..."
-                win_rate = 0 if w+l==0 else (w/(w+l)*100)
-                txt+=f"{md} {nn} {gofra_info['emoji']}\n   🏗️ {format_length(gofra_mm)} | 🔌 {format_length(cable_mm)} | ✅ {w} ({win_rate:.0f}%)\n\n"
-            txt+="Топ по победам"
-        else: 
-            txt = f"🥇 ТОП РАДёмЩИКОВ\n\nПока никого!\nБудь первым!\n\nСлава ждёт!"
-        await cn.close()
+        txt = get_render_cache().get('rademka_top', 0, _rademka_top_version())
+        if txt is None:
+            txt = await _render_rademka_top()
     except Exception as e:
-        logger.error(f"Ошибка топа: {e}")
+        logger.error("Ошибка топа: %s", e)
         txt = f"🥇 ТОП РАДёмЩИКОВ\n\nРейтинг формируется...\n\nМеста скоро будут!"
     await c.message.edit_text(txt, reply_markup=back_kb("rademka"))
     await c.answer()
 
-@ignore_not_modified_error
+def _rademka_top_version() -> tuple:
+    # Fights change wins, user saves change gofra/cable, names change nicknames
+    return (state_versions.get('fights'), state_versions.get('users'), state_versions.get('names'))
+
+async def _render_rademka_top() -> str:
+    version = _rademka_top_version()
+    tp = await get_rademka_top(10)
+    if tp:
+        mds, txt = ["🥇","🥈","🥉","4️⃣","5️⃣","6️⃣","7️⃣","8️⃣","9️⃣","🔟"], "🥇 ТОП РАДёМЩИКОВ\n\n"
+        infos = get_gofra_infos(p.get("gofra_mm",10.0) for p in tp)
+        for i, (p, gofra_info) in enumerate(zip(tp, infos)):
+            if i>=len(mds): 
+                break
+            md, nn, w, l, gofra_mm, cable_mm = mds[i], p.get("nickname","Неизвестно"), p.get("wins",0) or 0, p.get("losses",0) or 0, p.get("gofra_mm",10.0), p.get("cable_mm",10.0)
+            if len(nn)>15:
+                nn=nn[:12]+"..."
+            win_rate = 0 if w+l==0 else (w/(w+l)*100)
+            txt+=f"{md} {nn} {gofra_info['emoji']}\n   🏗️ {format_length(gofra_mm)} | 🔌 {format_length(cable_mm)} | ✅ {w} ({win_rate:.0f}%)\n\n"
+        txt+="Топ по победам"
+    else: 
+        txt = f"🥇 ТОП РАДёмЩИКОВ\n\nПока никого!\nБудь первым!\n\nСлава ждёт!"
+    return get_render_cache().put('rademka_top', 0, version, txt)
+
 @router.callback_query(F.data == "back_main")
 async def back_to_main(c: types.CallbackQuery):
     """Return to main menu"""
@@ -512,7 +517,7 @@ async def back_to_main(c: types.CallbackQuery):
         gofra_info = get_gofra_info(p.get('gofra_mm', 10.0))
         await c.message.edit_text(f"Главное меню\n{gofra_info['emoji']} {gofra_info['name']} | 🏗️ {gofra_info['length_display']} | 🔌 {format_length(p.get('cable_mm', 10.0))}\n\n🌀 Атмосферы: {p.get('atm_count',0)}/12\n🐍 Змий: {p.get('zmiy_grams',0):.0f}г\n\nВыбери действие:", reply_markup=main_keyboard())
     except Exception as e:
-        logger.error(f"Ошибка главного: {e}")
+        logger.error("Ошибка главного: %s", e)
         await c.message.edit_text("Главное меню\n\nБот работает!", reply_markup=main_keyboard())
 
 # ==================== CHAT COMMANDS ====================
@@ -611,9 +616,9 @@ async def group_rademka_command(message: types.Message):
     text += f"За победу: +0.2 мм к кабелю, +5-12 мм к гофрошке\n\n"
 
     try:
-        chat_stats = await ChatManager.get_chat_stats(message.chat.id)
+        chat_stats = await get_chat_stats_cached(message.chat.id)
         if chat_stats['total_players'] > 1:
-            top_players = await ChatManager.get_chat_top(message.chat.id, limit=20)
+            top_players = await get_chat_top_cached(message.chat.id, limit=20)
             opponents = [p for p in top_players if p['user_id'] != message.from_user.id]
 
             if opponents:
@@ -629,7 +634,7 @@ async def group_rademka_command(message: types.Message):
         else:
             text += "😕 В чате пока только ты один!\nПриведи друзей для радёмок!"
     except Exception as e:
-        logger.error(f"Error getting chat players: {e}")
+        logger.error("Error getting chat players: %s", e)
         text += "\nОшибка загрузки списка игроков"
 
     await message.answer(text, reply_markup=get_chat_menu_keyboard())
@@ -665,12 +670,7 @@ async def fight_command(message: types.Message, command: CommandObject):
 
     chance = await calculate_pvp_chance(attacker_data, target_data)
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Протащить!", callback_data=f"chat_fight_{target_user.id}"),
-            InlineKeyboardButton(text="❌ Отмена", callback_data="chat_menu")
-        ]
-    ])
+    keyboard = chat_fight_keyboard(target_user.id)
 
     gofra_info_att = get_gofra_info(attacker_data.get('gofra_mm', 10.0))
     gofra_info_tar = get_gofra_info(target_data.get('gofra_mm', 10.0))
@@ -737,7 +737,7 @@ async def handle_chat_callbacks(callback: types.CallbackQuery):
             await callback.answer("❌ Неизвестное действие", show_alert=True)
 
     except Exception as e:
-        logger.error(f"Error in chat callback {callback_data}: {e}")
+        logger.error("Error in chat callback %s: %s", callback_data, e)
         await callback.answer("❌ Ошибка, попробуй позже", show_alert=True)
 
 # ==================== CHAT FIGHT HANDLER ====================
@@ -753,67 +753,59 @@ async def handle_chat_fight(callback: types.CallbackQuery):
             await callback.answer("❌ Нельзя драться с самим собой!", show_alert=True)
             return
 
-        can_fight, fight_msg = await can_fight_pvp(attacker_id)
-        if not can_fight:
-            await callback.answer(f"❌ {fight_msg}", show_alert=True)
-            return
-
-        attacker = await get_patsan(attacker_id)
-        target = await get_patsan(target_id)
-
-        if not attacker or not target:
-            await callback.answer("❌ Ошибка: игрок не найден!", show_alert=True)
-            return
+        # Как в rademka_confirm: лимит проверяется уже в очередях обоих игроков
+        async with get_user_executor().lock(attacker_id, target_id):
+            can_fight, fight_msg = await can_fight_pvp(attacker_id)
+            if not can_fight:
+                await callback.answer(f"❌ {fight_msg}", show_alert=True)
+                return
 
-        chance = await calculate_pvp_chance(attacker, target)
-        success = random.random() < (chance / 100)
+            attacker = await get_patsan(attacker_id)
+            target = await get_patsan(target_id)
 
-        winner_id = attacker_id if success else target_id
-        loser_id = target_id if success else attacker_id
+            if not attacker or not target:
+                await callback.answer("❌ Ошибка: игрок не найден!", show_alert=True)
+                return
 
-        winner = await get_patsan(winner_id)
-        loser = await get_patsan(loser_id)
+            chance = await calculate_pvp_chance(attacker, target)
+            success = random.random() < (chance / 100)
 
-        if success:
-            cable_gain_mm = 0.2
-            attacker["cable_mm"] = attacker.get("cable_mm", 10.0) + cable_gain_mm
+            winner_id = attacker_id if success else target_id
+            loser_id = target_id if success else attacker_id
 
-            level_diff = target.get("gofra_mm", 10.0) - attacker.get("gofra_mm", 10.0)
-            if level_diff > 0:
-                gofra_gain_mm = 12.0 + min(level_diff / 100, 8.0)
-            else:
-                gofra_gain_mm = max(5.0, 12.0 + level_diff / 200)
+            winner = await get_patsan(winner_id)
+            loser = await get_patsan(loser_id)
 
-            gofra_gain_mm = round(gofra_gain_mm, 2)
-            attacker["gofra_mm"] = attacker.get("gofra_mm", 10.0) + gofra_gain_mm
+            if success:
+                cable_gain_mm = PVP_ATTACK_REWARD["cable_mm"]
+                attacker["cable_mm"] = attacker.get("cable_mm", 10.0) + cable_gain_mm
 
-            attacker["cable_power"] = int(attacker["cable_mm"] / 5)
-            attacker["gofra"] = int(attacker["gofra_mm"] / 10)
+                gofra_gain_mm = pvp_gofra_gain(attacker.get("gofra_mm", 10.0), target.get("gofra_mm", 10.0))
+                attacker["gofra_mm"] = attacker.get("gofra_mm", 10.0) + gofra_gain_mm
 
-            await save_patsan(attacker)
-            winner_nick = attacker.get('nickname', callback.from_user.first_name)
-            loser_nick = target.get('nickname', 'Неизвестно')
-        else:
-            cable_gain_mm = 0.1
-            target["cable_mm"] = target.get("cable_mm", 10.0) + cable_gain_mm
+                attacker["cable_power"] = int(attacker["cable_mm"] / 5)
+                attacker["gofra"] = int(attacker["gofra_mm"] / 10)
 
-            level_diff = attacker.get("gofra_mm", 10.0) - target.get("gofra_mm", 10.0)
-            if level_diff > 0:
-                gofra_gain_mm = 6.0 + min(level_diff / 200, 4.0)
+                await save_patsan(attacker)
+                winner_nick = attacker.get('nickname', callback.from_user.first_name)
+                loser_nick = target.get('nickname', 'Неизвестно')
             else:
-                gofra_gain_mm = max(2.5, 6.0 + level_diff / 400)
+                cable_gain_mm = PVP_DEFENCE_REWARD["cable_mm"]
+                target["cable_mm"] = target.get("cable_mm", 10.0) + cable_gain_mm
 
-            gofra_gain_mm = round(gofra_gain_mm, 2)
-            target["gofra_mm"] = target.get("gofra_mm", 10.0) + gofra_gain_mm
+                gofra_gain_mm = pvp_gofra_gain(
+                    target.get("gofra_mm", 10.0), attacker.get("gofra_mm", 10.0), PVP_DEFENCE_REWARD
+                )
+                target["gofra_mm"] = target.get("gofra_mm", 10.0) + gofra_gain_mm
 
-            target["cable_power"] = int(target["cable_mm"] / 5)
-            target["gofra"] = int(target["gofra_mm"] / 10)
+                target["cable_power"] = int(target["cable_mm"] / 5)
+                target["gofra"] = int(target["gofra_mm"] / 10)
 
-            await save_patsan(target)
-            winner_nick = target.get('nickname', 'Неизвестно')
-            loser_nick = attacker.get('nickname', callback.from_user.first_name)
+                await save_patsan(target)
+                winner_nick = target.get('nickname', 'Неизвестно')
+                loser_nick = attacker.get('nickname', callback.from_user.first_name)
 
-        await save_rademka_fight(winner_id=winner_id, loser_id=loser_id)
+            await save_rademka_fight(winner_id=winner_id, loser_id=loser_id)
 
         if success:
             result_text = f"🎉 РАДЁМКА ЗАВЕРШЕНА!\n\n"
@@ -848,7 +840,7 @@ async def handle_chat_fight(callback: types.CallbackQuery):
             pass
 
     except Exception as e:
-        logger.error(f"Error in chat fight: {e}", exc_info=True)
+        logger.error("Error in chat fight: %s", e, exc_info=True)
         await callback.answer("❌ Ошибка в радёмке!", show_alert=True)
 
 # ==================== GROUP KEYWORDS ====================
@@ -2,8 +2,11 @@
 Общие утилиты для всех обработчиков
 """
 
-from typing import Any
-from aiogram.exceptions import TelegramBadRequest
+import functools
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import CallbackQuery, TelegramObject
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,9 +26,46 @@ def pb(c: float, t: float, l: int = 10) -> str:
     return Display.progress_bar(pct, l, 'default')
 
 
+def is_not_modified_error(error: Exception) -> bool:
+    """Telegram refused an edit because the text and keyboard are unchanged"""
+    return isinstance(error, TelegramBadRequest) and "message is not modified" in str(error)
+
+
+class NotModifiedMiddleware(BaseMiddleware):
+    """
+    Outer middleware for callback queries: swallows "message is not modified"
+    and answers the callback so the button stops spinning.
+
+    Registered once on the root router, it covers every callback handler;
+    aiogram already matches handler kwargs to the signature at registration.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        except TelegramBadRequest as e:
+            if not is_not_modified_error(e):
+                raise
+            if isinstance(event, CallbackQuery):
+                try:
+                    await event.answer()
+                except TelegramAPIError:
+                    # Callback already answered or expired - nothing to do
+                    pass
+            return None
+
+
 def ignore_not_modified_error(func):
     """
-    Decorator to ignore TelegramBadRequest errors when message is not modified
+    Decorator to ignore "message is not modified" in a single coroutine.
+
+    Handlers registered on routers are covered by NotModifiedMiddleware;
+    this is for helpers called outside of the dispatcher.
 
     Args:
         func: function to wrap
@@ -33,22 +73,18 @@ def ignore_not_modified_error(func):
     Returns:
         wrapper function
     """
+    @functools.wraps(func)
     async def wrapper(*args, **kwargs):
         try:
-            # Only pass kwargs that the function can actually accept
-            import inspect
-            sig = inspect.signature(func)
-            filtered_kwargs = {
-                k: v for k, v in kwargs.items()
-                if k in sig.parameters
-            }
-            return await func(*args, **filtered_kwargs)
+            return await func(*args, **kwargs)
         except TelegramBadRequest as e:
-            if "message is not modified" in str(e):
-                if len(args) > 0 and hasattr(args[0], 'callback_query'):
-                    await args[0].callback_query.answer()
-                return
-            raise
+            if not is_not_modified_error(e):
+                raise
+            for arg in args:
+                if isinstance(arg, CallbackQuery):
+                    await arg.answer()
+                    break
+            return None
     return wrapper
 
 
@@ -88,4 +124,4 @@ def validate_nickname(nickname: str) -> tuple[bool, str]:
     return True, "OK"
 
 # Экспорт
-__all__ = ['ft', 'pb', 'ignore_not_modified_error', 'validate_nickname']
+__all__ = ['ft', 'pb', 'NotModifiedMiddleware', 'is_not_modified_error', 'ignore_not_modified_error', 'validate_nickname']
@@ -48,7 +48,7 @@ async def cmd_timing(message: Message):
         await timing_manager.start_countdown(user_id, message.chat.id, message.message_id + 1, message.bot)
         
     except Exception as e:
-        logger.error(f"Error in cmd_timing: {e}")
+        logger.error("Error in cmd_timing: %s", e)
         await message.answer("❌ Произошла ошибка при получении таймеров")
 
 @router.message(Command("stats", "statistics"))
@@ -85,7 +85,7 @@ async def cmd_stats(message: Message):
             await message.answer(message_text, reply_markup=main_keyboard())
         
     except Exception as e:
-        logger.error(f"Error in cmd_stats: {e}")
+        logger.error("Error in cmd_stats: %s", e)
         await message.answer("❌ Произошла ошибка при получении статистики")
 
 @router.message(Command("countdown"))
@@ -113,7 +113,7 @@ async def cmd_countdown(message: Message):
         await timing_manager.start_countdown(user_id, message.chat.id, message.message_id + 1, message.bot)
         
     except Exception as e:
-        logger.error(f"Error in cmd_countdown: {e}")
+        logger.error("Error in cmd_countdown: %s", e)
         await message.answer("❌ Произошла ошибка при получении обратного отсчёта")
 
 @router.callback_query(F.data == "timing_refresh")
@@ -149,7 +149,7 @@ async def callback_timing_refresh(callback: CallbackQuery):
         # Сообщение не изменилось
         await callback.answer("⏳ Таймеры уже обновлены")
     except Exception as e:
-        logger.error(f"Error in callback_timing_refresh: {e}")
+        logger.error("Error in callback_timing_refresh: %s", e)
         await callback.answer("❌ Ошибка обновления таймеров")
 
 @router.callback_query(F.data == "timing_stats")
@@ -176,7 +176,7 @@ async def callback_timing_stats(callback: CallbackQuery):
         await callback.answer("📊 Статистика загружена")
         
     except Exception as e:
-        logger.error(f"Error in callback_timing_stats: {e}")
+        logger.error("Error in callback_timing_stats: %s", e)
         await callback.answer("❌ Ошибка получения статистики")
 
 @router.callback_query(F.data == "timing_stop")
@@ -200,7 +200,7 @@ async def callback_timing_stop(callback: CallbackQuery):
         await callback.answer("✅ Таймеры остановлены")
         
     except Exception as e:
-        logger.error(f"Error in callback_timing_stop: {e}")
+        logger.error("Error in callback_timing_stop: %s", e)
         await callback.answer("❌ Ошибка остановки таймеров")
 
 async def _format_timing_message(davka_info: dict, atm_info: dict) -> str:
@@ -3,9 +3,104 @@
 Все клавиатуры в едином красивом стиле
 """
 
-from typing import List
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+from aiohttp import FormData
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+# ============================================
+# РЕЕСТР ГОТОВЫХ КЛАВИАТУР
+# ============================================
+#
+# Клавиатуры без параметров строятся один раз при импорте, с параметрами -
+# запоминаются в ограниченном LRU. Функции возвращают один и тот же объект,
+# поэтому менять полученную клавиатуру нельзя. Для зарегистрированных
+# клавиатур PreparedMarkupSession сериализует reply_markup один раз и дальше
+# кладёт в запрос готовую JSON-строку.
+
+PARAMETRIZED_CACHE_SIZE = 512
+
+# id(клавиатуры) -> [клавиатура, готовый JSON или None до первой отправки]
+_PREPARED: Dict[int, list] = {}
+
+def _register(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    _PREPARED[id(markup)] = [markup, None]
+    return markup
+
+def _unregister(markup: InlineKeyboardMarkup):
+    entry = _PREPARED.get(id(markup))
+    if entry is not None and entry[0] is markup:
+        del _PREPARED[id(markup)]
+
+def _static(builder: Callable[[], InlineKeyboardMarkup]) -> Callable[[], InlineKeyboardMarkup]:
+    """Строит клавиатуру один раз при импорте."""
+    markup = _register(builder())
+
+    @wraps(builder)
+    def get() -> InlineKeyboardMarkup:
+        return markup
+    return get
+
+def _memoized(builder: Callable[..., InlineKeyboardMarkup]) -> Callable[..., InlineKeyboardMarkup]:
+    """Запоминает клавиатуры с параметрами (LRU на PARAMETRIZED_CACHE_SIZE штук)."""
+    cache: OrderedDict = OrderedDict()
+
+    @wraps(builder)
+    def get(*args) -> InlineKeyboardMarkup:
+        markup = cache.get(args)
+        if markup is not None:
+            cache.move_to_end(args)
+            return markup
+        markup = cache[args] = _register(builder(*args))
+        if len(cache) > PARAMETRIZED_CACHE_SIZE:
+            _, evicted = cache.popitem(last=False)
+            _unregister(evicted)
+        return markup
+    get.cache_info = lambda: {'size': len(cache), 'max_size': PARAMETRIZED_CACHE_SIZE}
+    return get
+
+def prepared_keyboards_count() -> int:
+    return len(_PREPARED)
+
+
+class PreparedMarkupSession(AiohttpSession):
+    """
+    Сессия бота, которая берёт готовый JSON для клавиатур из реестра.
+
+    build_form_data базовой сессии сначала делает method.model_dump(), и
+    клавиатура доходит до prepare_value уже словарём - узнать её в реестре
+    там нельзя. Поэтому reply_markup ищется по исходному объекту метода
+    до дампа, а остальные поля готовятся как обычно.
+    """
+
+    def prepared_markup(self, markup: Any, bot) -> Optional[str]:
+        """JSON зарегистрированной клавиатуры (сериализуется при первой отправке)."""
+        entry = _PREPARED.get(id(markup))
+        if entry is None or entry[0] is not markup:
+            return None
+        if entry[1] is None:
+            entry[1] = self.prepare_value(markup, bot=bot, files={})
+        return entry[1]
+
+    def build_form_data(self, bot, method) -> FormData:
+        prepared = self.prepared_markup(getattr(method, "reply_markup", None), bot)
+        if prepared is None:
+            return super().build_form_data(bot, method)
+        form = FormData(quote_fields=False)
+        files: Dict[str, Any] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", prepared)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
+
+
 # ============================================
 # УНИФИЦИРОВАННЫЕ КЛАВИАТУРЫ
 # ============================================
@@ -24,6 +119,7 @@ def _mk(*rows: List[InlineKeyboardButton]) -> InlineKeyboardMarkup:
 
 
 # ========== ГЛАВНОЕ МЕНЮ ==========
+@_static
 def main_keyboard() -> InlineKeyboardMarkup:
     """Главное меню - все действия"""
     return _mk(
@@ -34,6 +130,7 @@ def main_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ НИКНЕЙМА ==========
+@_static
 def nickname_keyboard() -> InlineKeyboardMarkup:
     """Меню никнейма"""
     return _mk(
@@ -43,6 +140,7 @@ def nickname_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ РАДЁМКИ ==========
+@_static
 def rademka_keyboard() -> InlineKeyboardMarkup:
     """Меню радёмки"""
     return _mk(
@@ -52,6 +150,7 @@ def rademka_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ ГОФРЫ ==========
+@_static
 def gofra_info_keyboard() -> InlineKeyboardMarkup:
     """Меню информации о гофрошке"""
     return _mk(
@@ -61,6 +160,7 @@ def gofra_info_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ КАБЕЛЯ ==========
+@_static
 def cable_info_keyboard() -> InlineKeyboardMarkup:
     """Меню информации о кабеле"""
     return _mk(
@@ -70,6 +170,7 @@ def cable_info_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ АТМОСФЕР ==========
+@_static
 def atm_status_keyboard() -> InlineKeyboardMarkup:
     """Меню атмосфер"""
     return _mk(
@@ -79,6 +180,7 @@ def atm_status_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ ТОПА ==========
+@_static
 def top_sort_keyboard() -> InlineKeyboardMarkup:
     """Меню выбора сортировки топа"""
     return _mk(
@@ -89,6 +191,7 @@ def top_sort_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== МЕНЮ ЧАТА ==========
+@_static
 def chat_menu_keyboard() -> InlineKeyboardMarkup:
     """Главное меню для чата"""
     return _mk(
@@ -101,6 +204,7 @@ def chat_menu_keyboard() -> InlineKeyboardMarkup:
 
 
 # ========== КЛАВИАТУРЫ ПОДТВЕРЖДЕНИЯ ==========
+@_memoized
 def rademka_fight_keyboard(target_id: int) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения радёмки"""
     return _mk(
@@ -111,6 +215,7 @@ def rademka_fight_keyboard(target_id: int) -> InlineKeyboardMarkup:
     )
 
 
+@_memoized
 def chat_fight_keyboard(target_id: int) -> InlineKeyboardMarkup:
     """Клавиатура подтверждения радёмки в чате"""
     return _mk(
@@ -121,6 +226,7 @@ def chat_fight_keyboard(target_id: int) -> InlineKeyboardMarkup:
     )
 
 
+@_memoized
 def confirmation_keyboard(action: str, confirm_text: str = "Да", cancel_text: str = "Нет") -> InlineKeyboardMarkup:
     """Универсальная клавиатура подтверждения"""
     return _mk(
@@ -132,6 +238,7 @@ def confirmation_keyboard(action: str, confirm_text: str = "Да", cancel_text:
 
 
 # ========== КНОПКА НАЗАД ==========
+@_memoized
 def back_keyboard(to: str = "back_main") -> InlineKeyboardMarkup:
     """Клавиатура только с кнопкой назад"""
     return _mk(
@@ -139,6 +246,7 @@ def back_keyboard(to: str = "back_main") -> InlineKeyboardMarkup:
     )
 
 # ========== АДМИН-ПАНЕЛЬ ==========
+@_static
 def admin_keyboard() -> InlineKeyboardMarkup:
     """Админ-панель"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -155,10 +263,12 @@ def admin_keyboard() -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="⚙️ Настройки", callback_data="admin_settings"),
         ],
         [
+            InlineKeyboardButton(text="🐌 SQL-запросы", callback_data="admin_queries"),
             InlineKeyboardButton(text="🔙 Выход", callback_data="admin_exit"),
         ]
     ])
 
+@_static
 def admin_system_keyboard() -> InlineKeyboardMarkup:
     """Меню системных настроек"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -176,6 +286,16 @@ def admin_system_keyboard() -> InlineKeyboardMarkup:
     ])
 
 
+# ========== ТАЙМЕРЫ ==========
+@_static
+def countdown_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура живого таймера (обновляется на каждом тике)"""
+    return _mk(
+        _row(_btn("🐍 Давить", "davka"), _btn("🔄 Обновить", "timing_refresh")),
+        _row(_btn("📊 Статистика", "timing_stats"), _btn("❌ Стоп", "timing_stop"))
+    )
+
+
 # ========== АЛИАСЫ ==========
 back_kb = back_keyboard
 atm_status_kb = atm_status_keyboard
@@ -185,9 +305,9 @@ profile_extended_kb = main_keyboard
 chat_menu_kb = chat_menu_keyboard
 top_sort_kb = top_sort_keyboard
 
-back_to_main_keyboard = lambda: back_keyboard("back_main")
-back_to_profile_keyboard = lambda: back_keyboard("profile")
-back_to_rademka_keyboard = lambda: back_keyboard("rademka")
+back_to_main_keyboard = _static(lambda: back_keyboard("back_main"))
+back_to_profile_keyboard = _static(lambda: back_keyboard("profile"))
+back_to_rademka_keyboard = _static(lambda: back_keyboard("rademka"))
 
 
 # ========== ЭКСПОРТ ==========
@@ -210,6 +330,9 @@ __all__ = [
     # Назад
     'back_keyboard',
     
+    # Таймеры
+    'countdown_keyboard',
+    
     # Алиасы
     'back_kb',
     'atm_status_kb', 'gofra_info_kb', 'cable_info_kb', 'profile_extended_kb',
@@ -219,4 +342,7 @@ __all__ = [
     # Админ
     'admin_keyboard',
     'admin_system_keyboard',
+    
+    # Сессия с готовым JSON клавиатур
+    'PreparedMarkupSession',
 ]
@@ -0,0 +1,208 @@
+"""
+Логирование, которое не блокирует цикл событий.
+
+Обработчики пишут в очередь (QueueHandler) - это только put в память;
+файл и консоль обслуживает QueueListener в отдельном потоке. Файл
+ротируется по размеру (LOGGING_CONFIG max_size/backup_count), формат -
+текст или JSON по строке на запись. Повторяющиеся предупреждения и ошибки
+прореживаются: одинаковым считается одинаковый шаблон сообщения, поэтому
+вызовы пишутся в %-стиле - logger.error("... %s", e), а не f-строкой.
+"""
+
+import copy
+import json
+import logging
+import os
+import queue
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+
+from config import LOGGING_CONFIG
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Шумные библиотеки - только предупреждения и выше
+QUIET_LOGGERS = ('aiogram', 'asyncio', 'httpx')
+
+_listener: Optional[QueueListener] = None
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Кладёт в очередь копию записи с готовым текстом сообщения и трейсбека.
+
+    Сообщение собирается в вызывающем потоке: аргументы могут измениться,
+    пока запись ждёт в очереди. Стандартный prepare() вклеивает трейсбек в
+    текст сообщения - здесь он остаётся в exc_text, чтобы JSON-формат
+    положил его в отдельное поле.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON (для сборщиков логов)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _SuppressedMixin:
+    """Дописывает к тексту записи, сколько таких же было пропущено."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{text} (пропущено похожих: {suppressed})" if suppressed else text
+
+
+class _TextFormatter(_SuppressedMixin, logging.Formatter):
+    pass
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживание повторяющихся записей уровня level и выше.
+
+    За окно window секунд одинаковая запись (логгер, уровень, шаблон
+    сообщения) проходит burst раз, остальные отбрасываются и считаются;
+    первая запись следующего окна несёт число пропущенных в suppressed.
+    """
+
+    def __init__(self, level: int = logging.WARNING, window: float = 60.0, burst: int = 5,
+                 max_keys: int = 10000):
+        super().__init__()
+        self.level = level
+        self.window = window
+        self.burst = burst
+        self.max_keys = max_keys
+        # ключ -> [начало окна, сколько прошло, сколько отброшено]
+        self._seen: Dict[Tuple[str, int, str], List] = {}
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        seen = self._seen.get(key)
+        if seen is None or now - seen[0] >= self.window:
+            if seen is None and len(self._seen) >= self.max_keys:
+                self._seen.clear()
+            if seen is not None and seen[2]:
+                record.suppressed = seen[2]
+            self._seen[key] = [now, 1, 0]
+            return True
+        if seen[1] < self.burst:
+            seen[1] += 1
+            return True
+        seen[2] += 1
+        self.dropped += 1
+        return False
+
+
+def _console_handler(use_colorlog: bool) -> logging.Handler:
+    if use_colorlog:
+        try:
+            import colorlog
+            handler = colorlog.StreamHandler()
+            formatter_class = type('_ColoredFormatter', (_SuppressedMixin, colorlog.ColoredFormatter), {})
+            handler.setFormatter(formatter_class(
+                f'%(log_color)s{LOG_FORMAT}',
+                datefmt=DATE_FORMAT,
+                log_colors={
+                    'DEBUG': 'cyan',
+                    'INFO': 'green',
+                    'WARNING': 'yellow',
+                    'ERROR': 'red',
+                    'CRITICAL': 'red,bg_white',
+                }
+            ))
+            return handler
+        except ImportError:
+            pass
+    handler = logging.StreamHandler()
+    handler.setFormatter(_TextFormatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+    return handler
+
+
+def setup_logging() -> logging.Logger:
+    """Очередь логов + поток записи: консоль и файл с ротацией по LOGGING_CONFIG."""
+    global _listener
+    stop_logging()
+
+    log_file = LOGGING_CONFIG.get("file", "storage/logs/bot_{date}.log").format(
+        date=datetime.now().strftime('%Y%m%d')
+    )
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=LOGGING_CONFIG.get("max_size", 10 * 1024 * 1024),
+        backupCount=LOGGING_CONFIG.get("backup_count", 5),
+        encoding='utf-8',
+    )
+    use_json = LOGGING_CONFIG.get("json", False)
+    file_handler.setFormatter(JsonFormatter() if use_json else _TextFormatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+    console_handler = _console_handler(LOGGING_CONFIG.get("use_colorlog", True))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    sampling = LOGGING_CONFIG.get("sampling")
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(
+            level=logging.getLevelName(sampling.get("level", "WARNING")),
+            window=sampling.get("window", 60),
+            burst=sampling.get("burst", 5),
+        ))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOGGING_CONFIG.get("level", "INFO"))
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger(__name__)
+    logger.info("📝 Логирование настроено. Файл: %s (%s)", log_file, "JSON" if use_json else "текст")
+    return logger
+
+
+def stop_logging():
+    """Дописывает очередь логов и останавливает поток записи."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
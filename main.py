@@ -3,75 +3,62 @@ import os
 import logging
 import gc
 import signal
-from datetime import datetime
+import time
+from contextlib import asynccontextmanager
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.storage.file import FileStorage
+from fsm_storage import create_fsm_storage
+from logging_setup import setup_logging, stop_logging
 from aiogram.types import BotCommand, BotCommandScopeDefault, BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats
-from db_manager import init_db, close_pool, stop_auto_backup, create_backup, start_auto_backup, upload_backup_to_telegram, ADMIN_CONFIG
+from db_manager import (
+    init_db, close_pool, stop_auto_backup, create_backup, start_auto_backup, upload_backup_to_telegram,
+    start_fight_archiver, stop_fight_archiver,
+    start_chat_stats_flusher, stop_chat_stats_flusher, ADMIN_CONFIG
+)
+from cache_manager import initialize_cache, close_cache, warmup_from_database
+from action_log import start_action_log, stop_action_log
+from tracing import TracingRequestMiddleware, TracingUpdateMiddleware, start_tracing, stop_tracing
+from config import CACHE_WARMUP_CONFIG, TRACING_CONFIG
 from dotenv import load_dotenv
-from handlers import router
+from handlers import router, include_secondary_routers
+from keyboards import PreparedMarkupSession
 
 load_dotenv()
 
 # Глобальные переменные для graceful shutdown
 _shutdown_event = None
 _bot_instance = None
+_warmup_task = None
+_commands_task = None
+_fsm_storage = None
 
-def setup_logging():
-    log_dir = "storage/logs"
-    os.makedirs(log_dir, exist_ok=True)
-    
-    try:
-        import colorlog
-        
-        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        date_format = '%Y-%m-%d %H:%M:%S'
-        
-        console_handler = colorlog.StreamHandler()
-        console_handler.setFormatter(colorlog.ColoredFormatter(
-            f'%(log_color)s{log_format}',
-            datefmt=date_format,
-            log_colors={
-                'DEBUG': 'cyan',
-                'INFO': 'green',
-                'WARNING': 'yellow',
-                'ERROR': 'red',
-                'CRITICAL': 'red,bg_white',
-            }
-        ))
-        
-        log_file = os.path.join(log_dir, f"bot_{datetime.now().strftime('%Y%m%d')}.log")
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setFormatter(logging.Formatter(log_format, datefmt=date_format))
-        
-        logger = colorlog.getLogger()
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
-        logger.setLevel(logging.INFO)
-        
-        logging.getLogger('aiogram').setLevel(logging.WARNING)
-        logging.getLogger('asyncio').setLevel(logging.WARNING)
-        logging.getLogger('httpx').setLevel(logging.WARNING)
-        
-        logger.info(f"📝 Логирование настроено. Файл: {log_file}")
-        
-        return logger
-        
-    except ImportError:
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(os.path.join(log_dir, f"bot_{datetime.now().strftime('%Y%m%d')}.log"), encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
-        logger = logging.getLogger(__name__)
-        logger.info("📝 Обычное логирование (colorlog не установлен)")
-        return logger
+# Логирование настраивается в main(), а не при импорте модуля
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """Замер шагов запуска: сколько занял каждый шаг и весь старт до polling."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps: list = []
 
-logger = setup_logging()
+    @asynccontextmanager
+    async def step(self, name: str):
+        step_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - step_started))
+
+    async def measure(self, name: str, coro):
+        """Выполняет корутину как шаг запуска (удобно внутри asyncio.gather)."""
+        async with self.step(name):
+            return await coro
+
+    def report(self) -> None:
+        total = time.perf_counter() - self.started
+        details = ", ".join(f"{name} {seconds * 1000:.0f}мс" for name, seconds in self.steps)
+        logger.info("⏱️ Запуск до polling за %.0fмс: %s", total * 1000, details)
 
 async def set_bot_commands(bot: Bot):
     private_commands = [
@@ -110,13 +97,27 @@ async def set_bot_commands(bot: Bot):
     
     logger.info("✅ Команды бота установлены (разные для лички и групп)")
 
+async def set_bot_commands_safe(bot: Bot):
+    """Фоновая установка команд: ошибка сети не должна ронять запуск."""
+    try:
+        await set_bot_commands(bot)
+    except Exception as e:
+        logger.error("❌ Не удалось установить команды бота: %s", e)
+
 async def graceful_shutdown(signal_name: str):
     """Корректное завершение работы бота."""
     global _bot_instance
     
-    logger.info(f"🛑 Получен сигнал {signal_name}, начинаю корректное завершение...")
+    logger.info("🛑 Получен сигнал %s, начинаю корректное завершение...", signal_name)
     
     try:
+        # 0. Дописываем накопленные в памяти счётчики чатов и журнал действий
+        await stop_chat_stats_flusher()
+        await stop_action_log()
+        await stop_tracing()
+        if _fsm_storage is not None:
+            await _fsm_storage.close()
+
         # 1. Создаём финальный бэкап
         logger.info("💾 Создаём финальный бэкап...")
         await create_backup()
@@ -128,7 +129,7 @@ async def graceful_shutdown(signal_name: str):
                 admin_id = admin_ids[0]  # Первый админ
                 try:
                     admin_id = int(admin_id)
-                    logger.info(f"📤 Отправляем бэкап админу {admin_id}...")
+                    logger.info("📤 Отправляем бэкап админу %s...", admin_id)
                     await upload_backup_to_telegram(_bot_instance, admin_id)
                 except (ValueError, TypeError):
                     logger.warning("⚠️ ADMIN_ID неверный формат")
@@ -138,18 +139,25 @@ async def graceful_shutdown(signal_name: str):
         # 3. Останавливаем автобэкап
         logger.info("🛑 Останавливаем автобэкап...")
         await stop_auto_backup()
+        await stop_fight_archiver()
+        
+        # 4. Закрываем кэш и пул соединений Redis
+        if _warmup_task is not None and not _warmup_task.done():
+            _warmup_task.cancel()
+        logger.info("🔌 Закрываем кэш...")
+        await close_cache()
         
-        # 4. Закрываем пул соединений с БД
+        # 5. Закрываем пул соединений с БД
         logger.info("🔌 Закрываем соединения с базой данных...")
         await close_pool()
         
-        # 5. Принудительный сборщик мусора
+        # 6. Принудительный сборщик мусора
         gc.collect()
         
         logger.info("✅ Корректное завершение работы бота выполнено!")
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при завершении работы: {e}", exc_info=True)
+        logger.error("❌ Ошибка при завершении работы: %s", e, exc_info=True)
 
 def setup_signal_handlers(loop):
     """Настройка обработчиков сигналов."""
@@ -158,7 +166,7 @@ def setup_signal_handlers(loop):
     _shutdown_event = asyncio.Event()
     
     def signal_handler(sig):
-        logger.info(f"📡 Получен сигнал {sig.name}")
+        logger.info("📡 Получен сигнал %s", sig.name)
         loop.create_task(graceful_shutdown(sig.name))
         _shutdown_event.set()
     
@@ -181,36 +189,68 @@ async def main():
     setup_signal_handlers(loop)
     
     gc.collect()
+    timer = StartupTimer()
     
     try:
         logger.info("🚀 Запуск бота на bothost.ru")
-        logger.info(f"📁 Рабочая директория: {os.getcwd()}")
-        logger.info(f"📂 Содержимое: {os.listdir('.')}")
-
-        await init_db()
-
-        # Запускаем автобэкап
-        await start_auto_backup(interval_seconds=3600)
+        logger.info("📁 Рабочая директория: %s", os.getcwd())
 
         BOT_TOKEN = os.getenv("BOT_TOKEN")
         if not BOT_TOKEN:
             logger.error("BOT_TOKEN не найден в переменных окружения")
             raise ValueError("BOT_TOKEN не найден в переменных окружения")
 
-        global _bot_instance
-        bot = Bot(token=BOT_TOKEN)
+        # База (миграции пропускаются при совпадении версии) и кэш независимы
+        await asyncio.gather(
+            timer.measure("init_db", init_db()),
+            # Кэш: Redis с пулом соединений или локальный fallback
+            timer.measure("cache", initialize_cache()),
+        )
+
+        # Прогрев кэша идёт в фоне, polling его не ждёт
+        global _warmup_task
+        if CACHE_WARMUP_CONFIG.get("enabled", True):
+            _warmup_task = asyncio.create_task(warmup_from_database(
+                users_limit=CACHE_WARMUP_CONFIG.get("users_limit", 500),
+                chats_limit=CACHE_WARMUP_CONFIG.get("chats_limit", 100),
+                batch_size=CACHE_WARMUP_CONFIG.get("batch_size", 200),
+            ))
+
+        # Запускаем автобэкап
+        await start_auto_backup(interval_seconds=3600)
+        # Старые бои радёмок уходят из горячей таблицы в архив
+        await start_fight_archiver()
+        # Счётчики чатов копятся в памяти и пишутся пачкой
+        await start_chat_stats_flusher()
+        # Журнал действий: снимок проекций + хвост журнала, затем фоновая запись
+        await start_action_log()
+        await start_tracing()
+
+        global _bot_instance, _fsm_storage
+        # Сессия берёт готовый JSON для клавиатур из keyboards
+        bot = Bot(token=BOT_TOKEN, session=PreparedMarkupSession())
         _bot_instance = bot
         
-        # Используем FileStorage для сохранения FSM между перезагрузками
-        fsm_dir = "storage/fsm"
-        os.makedirs(fsm_dir, exist_ok=True)
-        dp = Dispatcher(storage=FileStorage(path=fsm_dir))
+        # Состояния FSM переживают перезагрузку: SQLite с отложенной записью или Redis
+        async with timer.step("dispatcher"):
+            _fsm_storage = await create_fsm_storage()
+            dp = Dispatcher(storage=_fsm_storage)
+            # Трасса на каждый апдейт и спаны вокруг запросов к Bot API
+            if TRACING_CONFIG.get("enabled", True):
+                dp.update.outer_middleware(TracingUpdateMiddleware())
+                bot.session.middleware(TracingRequestMiddleware())
+            dp.include_router(router)
 
-        await set_bot_commands(bot)
+        # Админка и тайминг - отдельным шагом: импорт стоит времени до первого апдейта
+        async with timer.step("routers"):
+            include_secondary_routers()
 
-        dp.include_router(router)
+        # Команды меню - два сетевых запроса, polling их не ждёт
+        global _commands_task
+        _commands_task = asyncio.create_task(set_bot_commands_safe(bot))
 
         logger.info("Бот запускается...")
+        timer.report()
         
         # Запускаем polling с возможностью graceful shutdown
         dp.shutdown.register(graceful_shutdown, "DP_SHUTDOWN")
@@ -225,14 +265,17 @@ async def main():
             await _shutdown_event.wait()
 
     except Exception as e:
-        logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
+        logger.error("Ошибка при запуске бота: %s", e, exc_info=True)
 
     finally:
         gc.collect()
         logger.info("👋 Бот полностью остановлен")
 
 if __name__ == "__main__":
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("\n🛑 Бот остановлен пользователем (Ctrl+C)")
+    finally:
+        stop_logging()
@@ -0,0 +1,275 @@
+"""
+Статистика SQL-запросов и журнал медленных запросов.
+
+InstrumentedConnection оборачивает общее соединение aiosqlite: execute и
+executemany (и выборка строк из их курсоров) замеряются и складываются в
+QueryStats по нормализованному тексту - литералы заменены на ?, списки
+IN (?, ?, ?) свёрнуты, пробелы схлопнуты. Так запросы db_manager и
+встроенные запросы обработчиков (rademka_top, admin_players) попадают
+в одну таблицу независимо от того, кто их выполнил.
+
+Запрос дольше slow_ms пишется в лог вместе с EXPLAIN QUERY PLAN (план
+одного оператора - не чаще раза в explain_interval секунд).
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from config import QUERY_STATS_CONFIG
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_NORMALIZED_CACHE_SIZE = 2048
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+_normalized: "OrderedDict[str, str]" = OrderedDict()
+
+
+def normalize_sql(sql: str) -> str:
+    """Текст запроса без литералов и лишних пробелов - ключ статистики."""
+    cached = _normalized.get(sql)
+    if cached is not None:
+        _normalized.move_to_end(sql)
+        return cached
+    normalized = _STRING_LITERAL.sub("?", sql)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _PLACEHOLDER_LIST.sub("(?, ...)", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip()
+    # Запросы в коде - почти всегда константы, нормализуем каждый один раз
+    _normalized[sql] = normalized
+    if len(_normalized) > _NORMALIZED_CACHE_SIZE:
+        _normalized.popitem(last=False)
+    return normalized
+
+
+class StatementStats:
+    """Счётчики одного оператора; p99 - по последним samples замерам."""
+
+    __slots__ = ("count", "total", "max", "errors", "samples")
+
+    def __init__(self, samples: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.samples: deque = deque(maxlen=samples)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class QueryStats:
+    """
+    Статистика по нормализованным операторам и журнал медленных запросов.
+
+    Замер оператора - время execute (для SQLite это первый шаг: сортировка
+    и агрегаты без индекса уже посчитаны); выборка строк курсором
+    добавляется к общему времени оператора.
+    """
+
+    def __init__(self, slow_ms: float = 100.0, explain_interval: float = 300.0,
+                 samples: int = 256, slow_log_size: int = 50):
+        self.slow_seconds = slow_ms / 1000
+        self.explain_interval = explain_interval
+        self.sample_size = samples
+        self.statements: Dict[str, StatementStats] = {}
+        self.slow_log: deque = deque(maxlen=slow_log_size)
+        self._explained: Dict[str, float] = {}
+
+    def _stats(self, key: str) -> StatementStats:
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = StatementStats(self.sample_size)
+        return stats
+
+    def record(self, key: str, seconds: float, error: bool = False):
+        stats = self._stats(key)
+        stats.count += 1
+        stats.total += seconds
+        stats.samples.append(seconds)
+        if seconds > stats.max:
+            stats.max = seconds
+        if error:
+            stats.errors += 1
+
+    def record_fetch(self, key: str, seconds: float):
+        self._stats(key).total += seconds
+
+    def is_slow(self, seconds: float) -> bool:
+        return seconds >= self.slow_seconds
+
+    def should_explain(self, key: str) -> bool:
+        if key.split(" ", 1)[0].upper() not in _EXPLAINABLE:
+            return False
+        now = time.monotonic()
+        if now - self._explained.get(key, -self.explain_interval) < self.explain_interval:
+            return False
+        self._explained[key] = now
+        return True
+
+    def top(self, limit: int = 10, order_by: str = "total") -> List[Dict[str, Any]]:
+        """Операторы с наибольшим total / max / count / p99 (время в мс)."""
+        rows = [
+            {
+                'statement': key,
+                'count': stats.count,
+                'total_ms': stats.total * 1000,
+                'avg_ms': stats.total / stats.count * 1000 if stats.count else 0.0,
+                'max_ms': stats.max * 1000,
+                'p99_ms': stats.percentile(0.99) * 1000,
+                'errors': stats.errors,
+            }
+            for key, stats in self.statements.items()
+        ]
+        rows.sort(key=lambda row: row[f"{order_by}_ms" if order_by != "count" else "count"], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        self.statements.clear()
+        self.slow_log.clear()
+        self._explained.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'statements': len(self.statements),
+            'queries': sum(stats.count for stats in self.statements.values()),
+            'total_ms': f"{sum(stats.total for stats in self.statements.values()) * 1000:.0f}",
+            'slow': len(self.slow_log),
+        }
+
+
+_query_stats: Optional[QueryStats] = None
+
+
+def get_query_stats() -> QueryStats:
+    """Глобальная статистика запросов с настройками из QUERY_STATS_CONFIG"""
+    global _query_stats
+    if _query_stats is None:
+        _query_stats = QueryStats(
+            slow_ms=QUERY_STATS_CONFIG.get("slow_ms", 100),
+            explain_interval=QUERY_STATS_CONFIG.get("explain_interval", 300),
+            samples=QUERY_STATS_CONFIG.get("samples", 256),
+            slow_log_size=QUERY_STATS_CONFIG.get("slow_log_size", 50),
+        )
+    return _query_stats
+
+
+class _TimedCursor:
+    """Курсор aiosqlite, у которого выборка строк идёт в статистику оператора."""
+
+    __slots__ = ("_cursor", "_owner", "_key", "_sql", "_params", "_elapsed", "_reported")
+
+    def __init__(self, cursor, owner: "InstrumentedConnection", key: str, sql: str, params, elapsed: float):
+        self._cursor = cursor
+        self._owner = owner
+        self._key = key
+        self._sql = sql
+        self._params = params
+        self._elapsed = elapsed
+        self._reported = owner.stats.is_slow(elapsed)
+
+    async def _timed(self, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            spent = time.perf_counter() - started
+            self._elapsed += spent
+            self._owner.stats.record_fetch(self._key, spent)
+            if not self._reported and self._owner.stats.is_slow(self._elapsed):
+                self._reported = True
+                self._owner.report_slow(self._key, self._sql, self._params, self._elapsed)
+
+    async def fetchone(self):
+        return await self._timed(self._cursor.fetchone())
+
+    async def fetchall(self):
+        return await self._timed(self._cursor.fetchall())
+
+    async def fetchmany(self, size: Optional[int] = None):
+        return await self._timed(self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany())
+
+    def __aiter__(self):
+        return self._cursor.__aiter__()
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """
+    Прокси над aiosqlite.Connection: execute/executemany замеряются,
+    всё остальное (commit, rollback, backup, row_factory...) - как есть.
+    """
+
+    def __init__(self, conn, stats: Optional[QueryStats] = None):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "stats", stats or get_query_stats())
+
+    async def _run(self, coro, sql: str, params):
+        key = normalize_sql(sql)
+        started = time.perf_counter()
+        error = False
+        try:
+            with get_tracer().span("sql", statement=key):
+                return await coro, key, time.perf_counter() - started
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats.record(key, elapsed, error)
+            if self.stats.is_slow(elapsed):
+                self.report_slow(key, sql, params, elapsed)
+
+    async def execute(self, sql: str, parameters=None):
+        coro = self._conn.execute(sql, parameters) if parameters is not None else self._conn.execute(sql)
+        cursor, key, elapsed = await self._run(coro, sql, parameters)
+        return _TimedCursor(cursor, self, key, sql, parameters, elapsed)
+
+    async def executemany(self, sql: str, parameters):
+        # Параметры могут быть генератором - для EXPLAIN берём первую строку заранее
+        parameters = list(parameters)
+        cursor, _, _ = await self._run(
+            self._conn.executemany(sql, parameters), sql, parameters[0] if parameters else None
+        )
+        return cursor
+
+    def report_slow(self, key: str, sql: str, params, seconds: float):
+        entry = {'statement': key, 'ms': seconds * 1000, 'at': time.time(), 'plan': None}
+        self.stats.slow_log.append(entry)
+        logger.warning("🐌 Медленный запрос %.1f мс: %s", seconds * 1000, key)
+        if self.stats.should_explain(key):
+            asyncio.get_running_loop().create_task(self._explain(entry, sql, params))
+
+    async def _explain(self, entry: Dict[str, Any], sql: str, params):
+        key = entry['statement']
+        try:
+            args = (f"EXPLAIN QUERY PLAN {sql}",) + ((params,) if params is not None else ())
+            cursor = await self._conn.execute(*args)
+            plan = [row[-1] for row in await cursor.fetchall()]
+        except Exception as e:
+            logger.debug("Не удалось получить план для %s: %s", key, e)
+            return
+        if not plan:
+            return
+        entry['plan'] = plan
+        logger.warning("🐌 План запроса %s:\n  %s", key, "\n  ".join(plan))
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._conn, name, value)
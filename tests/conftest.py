@@ -0,0 +1,37 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    # Блокировки db_manager и очереди игроков - модульные: один цикл на все тесты,
+    # как у работающего бота
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+async def db(tmp_path, monkeypatch):
+    """Свежая база во временном каталоге и пустые кэши в памяти."""
+    import db_manager
+    from cache_manager import get_cache_manager
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_manager, "DB_PATH", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(db_manager, "_chat_deltas", {})
+    monkeypatch.setattr(db_manager, "_activity_windows", db_manager.ChatActivityWindows())
+    await get_cache_manager().clear()
+    db_manager._nickname_registry.clear()
+    db_manager.get_matchmaker().clear()
+    await db_manager.init_db()
+    try:
+        yield db_manager
+    finally:
+        await db_manager.close_pool()
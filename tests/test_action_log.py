@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from action_log import ACTION_DAVKA, ActionLog
+
+CHAT_ID = -100
+
+
+def projections(log):
+    return log.timing.users, log.chats.chats, log.leaderboard.players
+
+
+async def test_append_during_snapshot_write_is_not_counted_twice(tmp_path):
+    log = ActionLog(directory=str(tmp_path))
+    await log.start()
+    log.append(ACTION_DAVKA, 1, CHAT_ID, 50.0, timestamp=1000)
+
+    write = log._write
+
+    def slow_write(records, snapshot):
+        time.sleep(0.2)
+        write(records, snapshot)
+
+    log._write = slow_write
+    flushing = asyncio.create_task(log.flush(force_snapshot=True))
+    await asyncio.sleep(0.05)
+    # Давка, пока снимок пишется в потоке: в снимок попасть не должна
+    log.append(ACTION_DAVKA, 1, CHAT_ID, 100.0, timestamp=2000)
+    await flushing
+    log._write = write
+    await log.flush()
+
+    reloaded = ActionLog(directory=str(tmp_path))
+    await reloaded.start()
+    assert projections(reloaded) == projections(log)
+    assert reloaded.chats.totals(CHAT_ID)['zmiy_grams'] == 150.0
+    assert reloaded.timing.users[1][0] == 2
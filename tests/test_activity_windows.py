@@ -0,0 +1,54 @@
+import time
+
+from db_manager import ACTIVE_WINDOW_DAY, ACTIVE_WINDOW_WEEK, ChatActivityWindows
+
+CHAT_ID = -100
+
+
+def test_counts_split_day_and_week():
+    now = 1_000_000
+    windows = ChatActivityWindows()
+    windows._windows[CHAT_ID] = {}
+    windows.touch(CHAT_ID, 1, now)
+    windows.touch(CHAT_ID, 2, now - ACTIVE_WINDOW_DAY - 1)
+    windows.touch(CHAT_ID, 3, now - ACTIVE_WINDOW_WEEK - 1)
+
+    assert windows.counts(CHAT_ID, now) == (1, 2)
+    # Через сутки первый игрок ещё в недельном окне
+    assert windows.counts(CHAT_ID, now + ACTIVE_WINDOW_DAY + 1) == (0, 2)
+
+
+def test_touch_ignores_unloaded_chat_and_prune_drops_stale():
+    now = 1_000_000
+    windows = ChatActivityWindows()
+    windows.touch(CHAT_ID, 1, now)
+    assert not windows.is_loaded(CHAT_ID)
+
+    windows._windows[CHAT_ID] = {1: now - ACTIVE_WINDOW_WEEK - 1, 2: now}
+    windows.prune(now)
+    assert windows._windows[CHAT_ID] == {2: now}
+    windows.prune(now + ACTIVE_WINDOW_WEEK + 1)
+    assert windows.loaded_chats() == []
+
+
+async def test_window_loads_from_db_and_is_flushed(db):
+    now = int(time.time())
+    await db.ChatManager.register_chat(CHAT_ID, "Гофроцентрал", "supergroup")
+    conn = await db.get_connection()
+    for user_id, last_activity in [(1, now - 60), (2, now - 2 * ACTIVE_WINDOW_DAY), (3, now - 2 * ACTIVE_WINDOW_WEEK)]:
+        await db.save_patsan({'user_id': user_id})
+        await conn.execute(
+            "INSERT INTO user_chat_stats (user_id, chat_id, last_activity, davki) VALUES (?, ?, ?, 1)",
+            (user_id, CHAT_ID, last_activity)
+        )
+    await conn.commit()
+
+    stats = await db.ChatManager.get_chat_stats(CHAT_ID)
+    assert (stats['active_players'], stats['active_players_7d']) == (1, 2)
+
+    await db.ChatManager.update_user_chat_stats(2, CHAT_ID, 1.0)
+    await db.ChatManager.flush()
+    cursor = await conn.execute(
+        "SELECT active_players, active_players_7d FROM chat_stats WHERE chat_id = ?", (CHAT_ID,)
+    )
+    assert tuple(await cursor.fetchone()) == (2, 2)
@@ -0,0 +1,52 @@
+import pytest
+
+from cache_manager import CacheManager, InMemoryInvalidationBus, InvalidationBus
+
+
+@pytest.fixture
+async def managers():
+    bus = InMemoryInvalidationBus()
+    first = CacheManager(invalidation_bus=bus)
+    second = CacheManager(invalidation_bus=bus)
+    await first.initialize()
+    await second.initialize()
+    try:
+        yield first, second
+    finally:
+        await first.close()
+        await second.close()
+
+
+def test_invalidation_bus_is_abstract():
+    with pytest.raises(TypeError):
+        InvalidationBus()
+
+
+async def test_set_evicts_other_l1(managers):
+    first, second = managers
+    await second.set('user', '1', {'gofra': 1})
+    await first.set('user', '1', {'gofra': 2})
+
+    assert second.local_cache.get('user:1') is None
+    assert second.stats['invalidations_received'] == 1
+    assert await first.get('user', '1') == {'gofra': 2}
+
+
+async def test_delete_evicts_other_l1(managers):
+    first, second = managers
+    await first.set('chat', '-100', {'total': 5})
+    await second.set('chat', '-100', {'total': 5})
+    await first.delete('chat', '-100')
+
+    assert await second.get('chat', '-100') is None
+
+
+async def test_stale_version_is_rejected(managers):
+    first, second = managers
+    # Версия значения, прочитанного вторым процессом до чужой записи
+    stale_version = second._next_version()
+    await first.set('user', '1', {'gofra': 2})
+
+    second._fill_local('user:1', {'gofra': 1}, 60, stale_version)
+    assert second.local_cache.get('user:1') is None
+    assert second.stats['stale_rejected'] == 1
@@ -0,0 +1,59 @@
+import sqlite3
+from contextlib import asynccontextmanager
+
+import pytest
+
+CHAT_ID = -100
+
+
+async def chat_row(db):
+    conn = await db.get_connection()
+    cursor = await conn.execute(
+        "SELECT total_players, total_davki_all, total_zmiy_all FROM chat_stats WHERE chat_id = ?", (CHAT_ID,)
+    )
+    return tuple(await cursor.fetchone())
+
+
+async def davki(db, *players):
+    await db.ChatManager.register_chat(CHAT_ID, "Гофроцентрал", "supergroup")
+    for user_id in set(players):
+        await db.save_patsan({'user_id': user_id})
+    for user_id in players:
+        await db.ChatManager.update_user_chat_stats(user_id, CHAT_ID, 1.5)
+
+
+async def test_counters_are_batched_until_flush(db):
+    await davki(db, 1, 1, 2)
+
+    # В базе ещё ничего, но чтение уже видит приращения
+    assert await chat_row(db) == (0, 0, 0.0)
+    stats = await db.ChatManager.get_chat_stats(CHAT_ID)
+    assert (stats['total_players'], stats['total_davki_all'], stats['total_zmiy_all']) == (2, 3, 4.5)
+
+    assert await db.ChatManager.flush() == 1
+    assert db._chat_deltas == {}
+    assert await chat_row(db) == (2, 3, 4.5)
+    # Повторный flush не удваивает счётчики
+    await db.ChatManager.flush()
+    assert await chat_row(db) == (2, 3, 4.5)
+
+
+async def test_failed_flush_keeps_deltas(db, monkeypatch):
+    await davki(db, 1, 2)
+    write_transaction = db.write_transaction
+
+    @asynccontextmanager
+    async def failing_transaction():
+        raise sqlite3.OperationalError("database is locked")
+        yield
+
+    monkeypatch.setattr(db, "write_transaction", failing_transaction)
+    with pytest.raises(sqlite3.OperationalError):
+        await db.ChatManager.flush()
+    # Давка между неудачной и удачной записью складывается с возвращёнными приращениями
+    monkeypatch.setattr(db, "write_transaction", write_transaction)
+    await db.ChatManager.update_user_chat_stats(1, CHAT_ID, 1.5)
+
+    assert db._chat_deltas[CHAT_ID]['total_davki_all'] == 3
+    await db.ChatManager.flush()
+    assert await chat_row(db) == (2, 3, 4.5)
@@ -0,0 +1,64 @@
+import asyncio
+
+from config import ATM_MAX
+
+CHAT_ID = -100
+
+
+async def register(db, *players):
+    await db.ChatManager.register_chat(CHAT_ID, "Гофроцентрал", "supergroup")
+    for user_id, atm_count in players:
+        await db.save_patsan({'user_id': user_id, 'atm_count': atm_count})
+
+
+async def fetch(db, sql, params=()):
+    conn = await db.get_connection()
+    cursor = await conn.execute(sql, params)
+    return await cursor.fetchall()
+
+
+async def test_davka_updates_player_and_chat_row(db):
+    await register(db, (1, ATM_MAX))
+
+    ok, patsan, result = await db.davka_zmiy(1, CHAT_ID)
+
+    assert ok
+    assert patsan['atm_count'] == 0
+    [row] = await fetch(db, "SELECT atm_count, total_zmiy_grams FROM users WHERE user_id = 1")
+    assert tuple(row) == (0, result['zmiy_grams'])
+    [chat_row] = await fetch(db, "SELECT davki, total_zmiy_grams FROM user_chat_stats WHERE user_id = 1")
+    assert tuple(chat_row) == (1, result['zmiy_grams'])
+    assert db._chat_deltas[CHAT_ID]['total_players'] == 1
+
+
+async def test_davka_without_atm_changes_nothing(db):
+    await register(db, (1, ATM_MAX - 1))
+
+    ok, _, result = await db.davka_zmiy(1, CHAT_ID)
+
+    assert not ok and "12 атмосфер" in result['error']
+    assert await fetch(db, "SELECT * FROM user_chat_stats") == []
+
+
+async def test_failed_davka_does_not_roll_back_concurrent_one(db):
+    await register(db, (1, ATM_MAX), (2, 0))
+
+    (ok, _, result), (failed, _, _) = await asyncio.gather(
+        db.davka_zmiy(1, CHAT_ID), db.davka_zmiy(2, CHAT_ID)
+    )
+
+    assert ok and not failed
+    [row] = await fetch(db, "SELECT atm_count, total_zmiy_grams FROM users WHERE user_id = 1")
+    assert tuple(row) == (0, result['zmiy_grams'])
+    [chat_row] = await fetch(db, "SELECT user_id, davki FROM user_chat_stats")
+    assert tuple(chat_row) == (1, 1)
+
+
+async def test_second_davka_of_same_player_fails(db):
+    await register(db, (1, ATM_MAX))
+
+    results = await asyncio.gather(db.davka_zmiy(1, CHAT_ID), db.davka_zmiy(1, CHAT_ID))
+
+    assert sorted(ok for ok, _, _ in results) == [False, True]
+    [chat_row] = await fetch(db, "SELECT davki FROM user_chat_stats WHERE user_id = 1")
+    assert chat_row[0] == 1
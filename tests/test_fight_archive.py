@@ -0,0 +1,48 @@
+import time
+
+DAY = 86400
+
+
+async def fetch(db, sql, params=()):
+    conn = await db.get_connection()
+    cursor = await conn.execute(sql, params)
+    return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def fights(db, *results):
+    for user_id in (1, 2):
+        await db.save_patsan({'user_id': user_id})
+    for winner_id, loser_id, money in results:
+        await db.save_rademka_fight(winner_id, loser_id, money)
+
+
+async def test_old_fights_move_to_monthly_archive(db):
+    await fights(db, (1, 2, 10), (1, 2, 20), (2, 1, 5))
+    old = int(time.time()) - 40 * DAY
+    conn = await db.get_connection()
+    await conn.execute("UPDATE rademka_fights SET created_at = ? WHERE id IN (1, 2)", (old,))
+    await conn.commit()
+
+    # Порция меньше числа старых боёв - перенос идёт в несколько транзакций
+    assert await db.archive_old_fights(retention_seconds=2 * DAY, batch_size=1) == 2
+
+    assert await fetch(db, "SELECT id FROM rademka_fights") == [(3,)]
+    archive = db.fight_archive_table(old)
+    assert await fetch(db, f"SELECT id, money_taken FROM {archive} ORDER BY id") == [(1, 10), (2, 20)]
+    assert await db.archive_old_fights(retention_seconds=2 * DAY) == 0
+
+
+async def test_lifetime_aggregates_survive_archiving_and_rebuild(db):
+    await fights(db, (1, 2, 10), (1, 2, 20), (2, 1, 5))
+    expected = [(1, 2, 1, 30, 5), (2, 1, 2, 5, 30)]
+    sql = "SELECT user_id, wins, losses, money_won, money_lost FROM rademka_player_stats ORDER BY user_id"
+    assert await fetch(db, sql) == expected
+
+    await db.archive_old_fights(retention_seconds=-1)
+    assert await fetch(db, "SELECT COUNT(*) FROM rademka_fights") == [(0,)]
+    assert (await db.get_rademka_stats(1))['wins'] == 2
+
+    # Пересчёт с нуля по архивам даёт те же агрегаты
+    async with db._write_lock:
+        await db.rebuild_rademka_player_stats(await db.get_connection())
+    assert await fetch(db, sql) == expected
@@ -0,0 +1,51 @@
+from aiogram.fsm.storage.base import StorageKey
+
+import db_manager
+from db_manager import close_pool, init_db
+from fsm_storage import SQLiteStorage
+
+
+def storage_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+async def test_read_misses_are_not_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_manager, "DB_PATH", str(tmp_path / "bot.db"))
+    storage = SQLiteStorage(flush_interval=60)
+    try:
+        await init_db()
+        for user_id in range(100):
+            assert await storage.get_state(storage_key(user_id)) is None
+            assert await storage.get_data(storage_key(user_id)) == {}
+        assert storage._entries == {}
+
+        await storage.set_state(storage_key(1), "NickStates:waiting")
+        assert await storage.get_state(storage_key(1)) == "NickStates:waiting"
+        assert len(storage._entries) == 1
+    finally:
+        await storage.close()
+        await close_pool()
+
+    reloaded = SQLiteStorage()
+    try:
+        assert await reloaded.get_state(storage_key(1)) == "NickStates:waiting"
+    finally:
+        await reloaded.close()
+        await close_pool()
+
+
+async def test_second_close_does_not_reopen_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_manager, "DB_PATH", str(tmp_path / "bot.db"))
+    storage = SQLiteStorage(flush_interval=60)
+    try:
+        await init_db()
+        await storage.set_data(storage_key(1), {"nick": "gofra"})
+        # Порядок graceful_shutdown: хранилище, затем пул; Dispatcher закрывает хранилище ещё раз
+        await storage.close()
+        await close_pool()
+        await storage.close()
+        assert db_manager._db_connection is None
+    finally:
+        await close_pool()
@@ -0,0 +1,44 @@
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from keyboards import _PREPARED, PreparedMarkupSession, main_keyboard
+
+BOT_TOKEN = "42:TEST"
+
+
+def form_fields(form):
+    return {options["name"]: value for options, _, value in form._fields}
+
+
+def test_registered_keyboard_json_is_built_once_and_reused():
+    session = PreparedMarkupSession()
+    bot = Bot(token=BOT_TOKEN, session=session)
+    markup = main_keyboard()
+    _PREPARED[id(markup)][1] = None
+
+    first = form_fields(session.build_form_data(bot, SendMessage(chat_id=1, text="a", reply_markup=markup)))
+    prepared = _PREPARED[id(markup)][1]
+    assert prepared is not None
+    assert first["reply_markup"] is prepared
+
+    second = form_fields(session.build_form_data(
+        bot, EditMessageText(chat_id=1, message_id=2, text="b", reply_markup=markup)
+    ))
+    assert second["reply_markup"] is prepared
+
+
+def test_prepared_form_matches_default_session():
+    bot = Bot(token=BOT_TOKEN, session=PreparedMarkupSession())
+    method = SendMessage(chat_id=1, text="a", reply_markup=main_keyboard())
+    expected = form_fields(AiohttpSession().build_form_data(bot, method))
+    assert form_fields(bot.session.build_form_data(bot, method)) == expected
+
+
+def test_unregistered_keyboard_uses_default_path():
+    markup = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="x", callback_data="x")]])
+    bot = Bot(token=BOT_TOKEN, session=PreparedMarkupSession())
+    fields = form_fields(bot.session.build_form_data(bot, SendMessage(chat_id=1, text="a", reply_markup=markup)))
+    assert id(markup) not in _PREPARED
+    assert '"callback_data":"x"' in fields["reply_markup"].replace(" ", "")
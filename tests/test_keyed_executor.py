@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from utils.keyed_executor import KeyedExecutor, serialized_by_user
+
+
+async def test_same_key_runs_in_arrival_order():
+    executor = KeyedExecutor()
+    order = []
+
+    async def job(n):
+        async with executor.lock(1):
+            order.append(('start', n))
+            await asyncio.sleep(0.01)
+            order.append(('end', n))
+
+    await asyncio.gather(*(job(n) for n in range(4)))
+
+    assert order == [(step, n) for n in range(4) for step in ('start', 'end')]
+    assert executor.depth(1) == 0 and executor.get_stats()['active_keys'] == 0
+    assert executor.completed == 4 and executor.contended == 3
+
+
+async def test_different_keys_run_in_parallel():
+    executor = KeyedExecutor()
+    inside = asyncio.Event()
+
+    async def first():
+        async with executor.lock(1):
+            await asyncio.wait_for(inside.wait(), 1)
+
+    async def second():
+        async with executor.lock(2):
+            inside.set()
+
+    await asyncio.gather(first(), second())
+
+
+async def test_nested_lock_in_same_task_is_reentrant():
+    executor = KeyedExecutor()
+
+    async with executor.lock(1):
+        async with asyncio.timeout(1):
+            async with executor.lock(1, 2):
+                assert executor.depth(1) == 1 and executor.depth(2) == 1
+        assert executor.depth(2) == 0
+
+    assert executor.depth(1) == 0
+
+
+async def test_child_task_does_not_inherit_held_keys():
+    executor = KeyedExecutor()
+    order = []
+
+    async def child():
+        async with executor.lock(1):
+            order.append('child')
+
+    async with executor.lock(1):
+        task = asyncio.create_task(child())
+        await asyncio.sleep(0.01)
+        # Дочерняя задача ждёт в очереди, а не проходит по ключам родителя
+        assert executor.depth(1) == 2
+        order.append('parent')
+    await task
+
+    assert order == ['parent', 'child']
+
+
+async def test_crossing_multi_key_locks_do_not_deadlock():
+    executor = KeyedExecutor()
+    done = []
+
+    async def fight(attacker, target):
+        async with executor.lock(attacker, target):
+            await asyncio.sleep(0.01)
+            done.append((attacker, target))
+
+    async with asyncio.timeout(1):
+        await asyncio.gather(*(fight(a, b) for a, b in [(1, 2), (2, 1)] * 3))
+
+    assert len(done) == 6 and executor.get_stats()['active_keys'] == 0
+
+
+async def test_cancelled_waiter_leaves_queue():
+    executor = KeyedExecutor()
+
+    async def waiter():
+        async with executor.lock(1):
+            pass
+
+    async with executor.lock(1):
+        task = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert executor.depth(1) == 2
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert executor.depth(1) == 1
+
+    assert executor.depth(1) == 0
+
+
+async def test_serialized_updates_of_one_player_are_not_lost(db):
+    await db.save_patsan({'user_id': 1, 'zmiy_grams': 0.0})
+
+    @serialized_by_user
+    async def add_zmiy(user_id, grams):
+        patsan = await db.get_patsan(user_id)
+        await asyncio.sleep(0.01)
+        patsan['zmiy_grams'] += grams
+        await db.save_patsan(patsan)
+
+    await asyncio.gather(*(add_zmiy(1, 1.0) for _ in range(5)))
+
+    assert (await db.get_patsan(1))['zmiy_grams'] == 5.0
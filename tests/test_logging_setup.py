@@ -0,0 +1,82 @@
+import json
+import logging
+import queue
+
+import pytest
+
+import logging_setup
+from logging_setup import JsonFormatter, SamplingFilter, _QueueHandler
+
+
+def make_record(msg, *args, level=logging.ERROR, name="bot", exc_info=None):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, exc_info)
+
+
+def test_queue_handler_freezes_message_and_traceback():
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    data = {'gofra': 1}
+    try:
+        raise ValueError("плохая гофра")
+    except ValueError as e:
+        record = make_record("Игрок %s: %s", data, e, exc_info=(type(e), e, e.__traceback__))
+    handler.handle(record)
+    data['gofra'] = 2
+
+    queued = log_queue.get_nowait()
+    assert queued.getMessage() == "Игрок {'gofra': 1}: плохая гофра"
+    assert queued.exc_info is None and "ValueError" in queued.exc_text
+    entry = json.loads(JsonFormatter().format(queued))
+    assert entry['message'] == queued.getMessage()
+    assert entry['exception'].endswith("ValueError: плохая гофра")
+
+
+def test_sampling_drops_repeats_and_reports_them():
+    sampling = SamplingFilter(window=60, burst=2)
+
+    # Одинаковый шаблон с разными аргументами - одна и та же запись
+    passed = [sampling.filter(make_record("❌ Ошибка: %s", n)) for n in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert sampling.filter(make_record("❌ Другая ошибка"))
+    assert sampling.filter(make_record("❌ Ошибка: %s", 0, level=logging.INFO))
+
+    # Окно истекло - первая запись несёт число пропущенных
+    for seen in sampling._seen.values():
+        seen[0] -= 60
+    record = make_record("❌ Ошибка: %s", 5)
+    assert sampling.filter(record)
+    assert record.suppressed == 3 and sampling.dropped == 3
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    try:
+        yield
+    finally:
+        logging_setup.stop_logging()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+
+def test_setup_writes_json_lines_through_listener(tmp_path, monkeypatch, restore_root_logger):
+    log_file = tmp_path / "logs" / "bot.log"
+    monkeypatch.setitem(logging_setup.LOGGING_CONFIG, "file", str(log_file))
+    monkeypatch.setitem(logging_setup.LOGGING_CONFIG, "json", True)
+    monkeypatch.setitem(logging_setup.LOGGING_CONFIG, "use_colorlog", False)
+    monkeypatch.setitem(logging_setup.LOGGING_CONFIG, "sampling", {"level": "WARNING", "window": 60, "burst": 1})
+
+    logging_setup.setup_logging()
+    logger = logging.getLogger("gofra.test")
+    for n in range(3):
+        logger.warning("⚠️ Медленный запрос %s", n)
+    logging_setup.stop_logging()
+
+    entries = [json.loads(line) for line in log_file.read_text(encoding='utf-8').splitlines()]
+    warnings = [entry for entry in entries if entry['logger'] == "gofra.test"]
+    assert [entry['message'] for entry in warnings] == ["⚠️ Медленный запрос 0"]
+    assert warnings[0]['level'] == "WARNING"
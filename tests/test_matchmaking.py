@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from utils.matchmaking import MatchmakingIndex, pvp_strength
+
+
+def index_with(*players, band_width=100.0, fights_per_hour=2):
+    index = MatchmakingIndex(band_width=band_width, samples_per_band=4, fights_per_hour=fights_per_hour)
+    for user_id, gofra_mm in players:
+        index.update(user_id, gofra_mm, 0.0)
+    index.loaded = True
+    return index
+
+
+def test_update_moves_player_between_bands():
+    index = index_with((1, 50.0))
+    assert index._positions[1] == (0, 0)
+
+    index.update(1, 250.0, 0.0)
+
+    assert index._positions[1] == (2, 0)
+    assert 0 not in index._bands
+    assert index._bands[2] == [1]
+
+
+def test_remove_swaps_last_player_into_hole():
+    index = index_with((1, 10.0), (2, 20.0), (3, 30.0))
+
+    index.remove(1)
+
+    assert index._bands[0] == [3, 2]
+    assert index._positions[3] == (0, 0)
+    assert index._positions[2] == (0, 1)
+    index.remove(3)
+    index.remove(2)
+    assert index._bands == {} and len(index) == 0
+
+
+def test_find_opponent_skips_self_and_blocked_players():
+    index = index_with((1, 10.0), (2, 20.0), (3, 30.0))
+    now = int(time.time())
+    index.record_fight(2, 4, now)
+    index.record_fight(2, 5, now)
+
+    for _ in range(20):
+        assert index.find_opponent(1, 10.0, 0.0) == 3
+
+
+def test_old_fights_stop_blocking():
+    index = index_with((1, 10.0), (2, 20.0))
+    hour_ago = int(time.time()) - 3600
+    index.record_fight(2, 4, hour_ago)
+    index.record_fight(2, 5, hour_ago)
+
+    assert index.find_opponent(1, 10.0, 0.0) == 2
+    assert index.get_stats()['tracked_fighters'] == 2
+
+
+def test_find_opponent_widens_to_nearest_band():
+    index = index_with((1, 10.0), (2, 350.0), (3, 950.0))
+
+    for _ in range(20):
+        assert index.find_opponent(1, 10.0, 0.0) == 2
+    index.remove(2)
+    assert index.find_opponent(1, 10.0, 0.0) == 3
+    index.remove(3)
+    assert index.find_opponent(1, 10.0, 0.0) is None
+
+
+def test_band_uses_cable_strength():
+    index = MatchmakingIndex(band_width=100.0)
+    assert index.band_of(10.0, 40.0) == int(pvp_strength(10.0, 40.0) // 100.0)
+
+
+def test_changes_during_load_are_replayed():
+    index = MatchmakingIndex(band_width=100.0, fights_per_hour=2)
+    index.player_saved(1, 500.0, 0.0)
+    assert len(index) == 0
+
+    index.begin_load()
+    now = int(time.time())
+    index.player_saved(1, 500.0, 0.0)
+    index.fight_saved(1, 2, now)
+    index.fight_saved(1, 3, now)
+    # Снимок прочитан до сохранения игрока 1, но после первого боя
+    index.finish_load([(1, 10.0, 0.0), (2, 10.0, 0.0)], [(1, 2, now)])
+
+    assert index.loaded and not index.loading
+    assert index._positions[1][0] == 5
+    assert len(index._fights[1]) == 2
+    assert index.is_blocked(1)
+
+
+def test_clear_during_load_discards_snapshot():
+    index = MatchmakingIndex()
+    index.begin_load()
+    index.clear()
+    index.finish_load([(1, 10.0, 0.0)], [])
+
+    assert not index.loaded and len(index) == 0
+
+
+async def test_save_during_matchmaker_load_is_kept(db, monkeypatch):
+    await db.save_patsan({'user_id': 1, 'gofra_mm': 10.0})
+    await db.save_patsan({'user_id': 2, 'gofra_mm': 10.0})
+    conn = await db.get_connection()
+    execute = type(conn).execute
+
+    async def slow_execute(self, sql, *args):
+        cursor = await execute(self, sql, *args)
+        if sql.startswith("SELECT user_id, gofra_mm, cable_mm FROM users"):
+            await asyncio.sleep(0.05)
+        return cursor
+
+    monkeypatch.setattr(type(conn), "execute", slow_execute)
+    loading = asyncio.create_task(db._ensure_matchmaker())
+    await asyncio.sleep(0.01)
+    await db.save_patsan({'user_id': 1, 'gofra_mm': 5000.0})
+    await db.save_rademka_fight(winner_id=1, loser_id=2)
+    index = await loading
+
+    assert index._positions[1][0] == index.band_of(5000.0, 10.0)
+    assert len(index._fights[1]) == 1
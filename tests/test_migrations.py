@@ -0,0 +1,94 @@
+import aiosqlite
+import pytest
+
+from db_manager import backfill_in_chunks
+
+
+async def user_version(conn) -> int:
+    cursor = await conn.execute("PRAGMA user_version")
+    return (await cursor.fetchone())[0]
+
+
+async def table_exists(conn, name: str) -> bool:
+    cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return await cursor.fetchone() is not None
+
+
+@pytest.fixture
+def next_version(db, monkeypatch):
+    """Номер для временной миграции поверх актуальной схемы."""
+    version = db.DATABASE_VERSION + 1
+    monkeypatch.setattr(db, "DATABASE_VERSION", version)
+    return version
+
+
+async def test_fresh_database_gets_latest_version(db):
+    conn = await db.get_connection()
+    assert await user_version(conn) == max(db.MIGRATIONS)
+    # Повторный запуск на актуальной схеме ничего не делает
+    await db.init_db()
+    assert await user_version(conn) == max(db.MIGRATIONS)
+
+
+async def test_backfill_in_chunks_commits_each_chunk():
+    async with aiosqlite.connect(":memory:") as conn:
+        await conn.execute("CREATE TABLE items (value INTEGER)")
+        await conn.executemany("INSERT INTO items (value) VALUES (?)", [(None,)] * 25)
+        await conn.commit()
+
+        updated = await backfill_in_chunks(conn, "items", "value = ?", "value IS NULL", (7,), chunk_size=10)
+
+        assert updated == 25
+        assert not conn.in_transaction
+        cursor = await conn.execute("SELECT COUNT(*) FROM items WHERE value = 7")
+        assert (await cursor.fetchone())[0] == 25
+
+
+async def test_failed_schema_step_is_rolled_back(db, monkeypatch, next_version):
+    async def broken_step(conn):
+        await conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("сбой шага")
+
+    monkeypatch.setitem(db.MIGRATIONS, next_version, ("сломанный шаг", broken_step, None))
+    conn = await db.get_connection()
+
+    with pytest.raises(RuntimeError):
+        async with db._write_lock:
+            await db.run_migrations(conn)
+
+    assert await user_version(conn) == next_version - 1
+    assert not await table_exists(conn, "half_done")
+
+
+async def test_interrupted_backfill_resumes(db, monkeypatch, next_version):
+    conn = await db.get_connection()
+    for user_id in range(1, 6):
+        await db.save_patsan({'user_id': user_id})
+    failures = [RuntimeError("процесс упал")]
+
+    async def add_column(conn):
+        cursor = await conn.execute("PRAGMA table_info(users)")
+        if 'migrated' not in {row[1] for row in await cursor.fetchall()}:
+            await conn.execute("ALTER TABLE users ADD COLUMN migrated INTEGER")
+
+    async def backfill(conn):
+        await backfill_in_chunks(conn, "users", "migrated = 1", "migrated IS NULL", chunk_size=2)
+        if failures:
+            raise failures.pop()
+
+    monkeypatch.setitem(db.MIGRATIONS, next_version, ("новая колонка", add_column, backfill))
+
+    with pytest.raises(RuntimeError):
+        async with db._write_lock:
+            await db.run_migrations(conn)
+    # Колонка и порции остались, но версия не поднята - шаг повторится
+    assert await user_version(conn) == next_version - 1
+    cursor = await conn.execute("SELECT COUNT(*) FROM users WHERE migrated = 1")
+    assert (await cursor.fetchone())[0] == 5
+
+    async with db._write_lock:
+        await db.run_migrations(conn)
+
+    assert await user_version(conn) == next_version
+    cursor = await conn.execute("SELECT COUNT(*) FROM users WHERE migrated = 1")
+    assert (await cursor.fetchone())[0] == 5
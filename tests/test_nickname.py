@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from handlers.commands import process_nickname_input
+
+
+class FakeMessage:
+    def __init__(self, user_id: int, text: str):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = text
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+class FakeState:
+    def __init__(self):
+        self.cleared = False
+
+    async def clear(self):
+        self.cleared = True
+
+
+async def test_default_nickname_is_invalid_not_taken(db):
+    assert db.normalize_nickname("неизвестно") is None
+    assert not await db.is_nickname_taken("неизвестно", 1)
+
+    message, state = FakeMessage(1, "Неизвестно"), FakeState()
+    await process_nickname_input(message, state)
+
+    assert message.answers[0].startswith("❌ Этот никнейм недоступен")
+    # Игрок остаётся в ожидании ника, как при любой ошибке формата
+    assert not state.cleared
+
+
+async def test_nickname_of_other_player_is_taken(db):
+    await db.save_patsan({'user_id': 1})
+    await db.save_patsan({'user_id': 2})
+    assert (await db.change_nickname(1, "Гофромастер"))[0]
+
+    assert await db.is_nickname_taken("гофромастер", 2)
+    assert not await db.is_nickname_taken("гофромастер", 1)
+
+    message, state = FakeMessage(2, "ГОФРОМАСТЕР"), FakeState()
+    await process_nickname_input(message, state)
+
+    assert message.answers[0].startswith("❌ Ник уже занят")
+    assert not state.cleared
@@ -0,0 +1,54 @@
+import asyncio
+
+from cache_manager import get_cache_manager, warmup_from_database
+from utils.keyed_executor import get_user_executor
+
+
+async def locked_save(db, user_id: int, gofra_mm: float):
+    """Запись как в обработчиках: чтение и сохранение в очереди игрока."""
+    async with get_user_executor().lock(user_id):
+        patsan = await db.get_patsan(user_id)
+        patsan['gofra_mm'] = gofra_mm
+        await db.save_patsan(patsan)
+
+
+async def test_slow_read_does_not_overwrite_fresh_save(db, monkeypatch):
+    await db.save_patsan({'user_id': 1, 'gofra_mm': 10.0})
+    await get_cache_manager().delete('user', '1')
+    load = db._load_patsan
+    slow_calls = [1]
+
+    async def slow_load(user_id):
+        row = await load(user_id)
+        # Медленная только первая загрузка - у читателя без очереди
+        if slow_calls:
+            slow_calls.pop()
+            await asyncio.sleep(0.05)
+        return row
+
+    monkeypatch.setattr(db, "_load_patsan", slow_load)
+    reader = asyncio.create_task(db.get_patsan(1))
+    await asyncio.sleep(0)
+    await locked_save(db, 1, 99.0)
+    await reader
+
+    assert (await db.get_patsan(1))['gofra_mm'] == 99.0
+
+
+async def test_warmup_does_not_overwrite_fresh_save(db, monkeypatch):
+    await db.save_patsan({'user_id': 1, 'gofra_mm': 10.0})
+    await get_cache_manager().clear('user')
+    get_multiple_users = db.get_multiple_users
+
+    async def slow_get_multiple_users(user_ids):
+        rows = await get_multiple_users(user_ids)
+        await asyncio.sleep(0.05)
+        return rows
+
+    monkeypatch.setattr(db, "get_multiple_users", slow_get_multiple_users)
+    warmup = asyncio.create_task(warmup_from_database())
+    await asyncio.sleep(0.01)
+    await locked_save(db, 1, 99.0)
+    assert (await warmup)['users'] == 1
+
+    assert (await db.get_patsan(1))['gofra_mm'] == 99.0
@@ -0,0 +1,17 @@
+import db_manager
+from db_manager import HOT_QUERIES, check_hot_query_plans, close_pool, init_db
+
+
+async def test_hot_queries_use_indexes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_manager, "DB_PATH", str(tmp_path / "bot.db"))
+    try:
+        await init_db()
+        assert await check_hot_query_plans() == []
+    finally:
+        await close_pool()
+
+
+def test_handler_queries_are_checked():
+    for name in ("admin_players_total", "admin_rademka_players", "chat_rademka_opponents"):
+        assert name in HOT_QUERIES
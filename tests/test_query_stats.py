@@ -0,0 +1,64 @@
+import asyncio
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from query_stats import InstrumentedConnection, QueryStats, normalize_sql
+
+
+def test_normalize_sql_folds_literals_and_lists():
+    assert normalize_sql("SELECT * FROM users\n   WHERE user_id IN (1, 2, 3) AND nickname = 'Гоф''ра'") == (
+        "SELECT * FROM users WHERE user_id IN (?, ...) AND nickname = ?"
+    )
+    assert normalize_sql("DELETE FROM rademka_fights WHERE id IN (?,?,?)") == (
+        "DELETE FROM rademka_fights WHERE id IN (?, ...)"
+    )
+    # Числа внутри имён не трогаются
+    assert normalize_sql("SELECT * FROM rademka_fights_archive_202401 LIMIT 10") == (
+        "SELECT * FROM rademka_fights_archive_202401 LIMIT ?"
+    )
+
+
+@pytest.fixture
+async def instrumented():
+    conn = await aiosqlite.connect(":memory:")
+    stats = QueryStats(slow_ms=10_000)
+    try:
+        yield InstrumentedConnection(conn, stats), stats
+    finally:
+        await conn.close()
+
+
+async def test_statements_are_grouped_by_normalized_text(instrumented):
+    conn, stats = instrumented
+    await conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY)")
+    await conn.executemany("INSERT INTO users (user_id) VALUES (?)", ((n,) for n in range(5)))
+    for user_id in (1, 2):
+        cursor = await conn.execute(f"SELECT user_id FROM users WHERE user_id = {user_id}")
+        assert (await cursor.fetchone())[0] == user_id
+    with pytest.raises(sqlite3.OperationalError):
+        await conn.execute("SELECT * FROM missing")
+
+    rows = {row['statement']: row for row in stats.top(limit=10, order_by="count")}
+    assert rows["SELECT user_id FROM users WHERE user_id = ?"]['count'] == 2
+    assert rows["INSERT INTO users (user_id) VALUES (?)"]['count'] == 1
+    assert rows["SELECT * FROM missing"]['errors'] == 1
+    assert stats.get_stats()['queries'] == 5
+    assert not stats.slow_log
+
+
+async def test_slow_query_is_logged_with_plan_once(instrumented):
+    conn, stats = instrumented
+    stats.slow_seconds = 0
+    await conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, gofra_mm REAL)")
+    for _ in range(2):
+        cursor = await conn.execute("SELECT user_id FROM users ORDER BY gofra_mm DESC")
+        await cursor.fetchall()
+    await asyncio.sleep(0.05)
+
+    slow = [entry for entry in stats.slow_log if entry['statement'].startswith("SELECT")]
+    assert len(slow) == 2
+    # План запрашивается не чаще раза в explain_interval
+    assert slow[0]['plan'] and any("SCAN" in step for step in slow[0]['plan'])
+    assert slow[1]['plan'] is None
@@ -0,0 +1,10 @@
+import handlers
+
+
+def test_secondary_routers_follow_main_ones():
+    handlers.include_secondary_routers()
+    handlers.include_secondary_routers()
+
+    names = [sub.name for sub in handlers.router.sub_routers]
+    assert len(names) == 2 + len(handlers.SECONDARY_ROUTERS)
+    assert names[:2] == [handlers.commands_router.name, handlers.callbacks_router.name]
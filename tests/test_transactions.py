@@ -0,0 +1,27 @@
+import asyncio
+
+
+async def test_failed_transaction_keeps_concurrent_writes(db):
+    await db.save_patsan({'user_id': 3})
+
+    async def failing():
+        async with db.write_transaction() as conn:
+            await conn.execute("INSERT INTO users (user_id) VALUES (1)")
+            await asyncio.sleep(0.05)
+            raise RuntimeError("сбой посреди транзакции")
+
+    results = await asyncio.gather(
+        failing(),
+        db.save_patsan({'user_id': 2}),
+        db.save_rademka_fight(winner_id=2, loser_id=3),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [None, None]
+    conn = await db.get_connection()
+    # Чужой commit не зафиксировал строку 1, а откат не забрал строку 2 и бой
+    cursor = await conn.execute("SELECT user_id FROM users ORDER BY user_id")
+    assert [row[0] for row in await cursor.fetchall()] == [2, 3]
+    cursor = await conn.execute("SELECT winner_id, loser_id FROM rademka_fights")
+    assert [tuple(row) for row in await cursor.fetchall()] == [(2, 3)]
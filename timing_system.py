@@ -7,13 +7,14 @@ import time
 import asyncio
 import logging
 from typing import Dict, Any, Optional, Tuple, List
-from datetime import datetime, timedelta
+from datetime import datetime
 from dataclasses import dataclass
-from aiogram import types
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardMarkup
 from aiogram.exceptions import TelegramBadRequest
 from db_manager import get_patsan, save_patsan, get_gofra_info
+from keyboards import countdown_keyboard
 from config import TIMING_CONFIG
+from action_log import get_action_log
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +85,7 @@ class PreciseTimingManager:
             }
             
         except Exception as e:
-            logger.error(f"Error calculating precise davka time: {e}")
+            logger.error("Error calculating precise davka time: %s", e)
             return {'error': str(e)}
     
     async def get_realtime_atm_status(self, user_id: int) -> Dict[str, Any]:
@@ -131,7 +132,7 @@ class PreciseTimingManager:
             }
             
         except Exception as e:
-            logger.error(f"Error getting realtime atm status: {e}")
+            logger.error("Error getting realtime atm status: %s", e)
             return {'error': str(e)}
     
     async def _calculate_activity_bonus(self, user_id: int, current_time: float) -> float:
@@ -153,57 +154,15 @@ class PreciseTimingManager:
                 return 0.8  # 20% штраф за долгую неактивность
                 
         except Exception as e:
-            logger.error(f"Error calculating activity bonus: {e}")
+            logger.error("Error calculating activity bonus: %s", e)
             return 1.0
     
     async def get_timing_statistics(self, user_id: int) -> Dict[str, Any]:
-        """Получить статистику по времени"""
+        """Получить статистику по времени (из проекции журнала действий)"""
         try:
-            patsan = await get_patsan(user_id)
-            
-            davki_history = patsan.get('davki_history', [])
-            if not davki_history:
-                return {
-                    'total_davki': 0,
-                    'avg_wait_time': 0,
-                    'last_davka_time': 0,
-                    'longest_wait': 0,
-                    'shortest_wait': 0,
-                    'efficiency': 0
-                }
-            
-            # Рассчитываем временные интервалы
-            wait_times = []
-            for i in range(1, len(davki_history)):
-                wait_time = davki_history[i] - davki_history[i-1]
-                wait_times.append(wait_time)
-            
-            if wait_times:
-                avg_wait = sum(wait_times) / len(wait_times)
-                longest_wait = max(wait_times)
-                shortest_wait = min(wait_times)
-            else:
-                avg_wait = 0
-                longest_wait = 0
-                shortest_wait = 0
-            
-            # Эффективность использования времени (сколько процентов времени можно было давить)
-            current_time = time.time()
-            total_possible_davki = (current_time - davki_history[0]) / TIMING_CONFIG["base_davka_cooldown"]
-            actual_davki = len(davki_history)
-            efficiency = min(100, (actual_davki / total_possible_davki) * 100) if total_possible_davki > 0 else 0
-            
-            return {
-                'total_davki': len(davki_history),
-                'avg_wait_time': avg_wait,
-                'last_davka_time': davki_history[-1] if davki_history else 0,
-                'longest_wait': longest_wait,
-                'shortest_wait': shortest_wait,
-                'efficiency': efficiency
-            }
-            
+            return get_action_log().timing.stats(user_id)
         except Exception as e:
-            logger.error(f"Error getting timing statistics: {e}")
+            logger.error("Error getting timing statistics: %s", e)
             return {'error': str(e)}
     
     async def format_precise_time(self, seconds: float) -> str:
@@ -317,14 +276,14 @@ class PreciseTimingManager:
                     # Сообщение не изменилось, пропускаем
                     pass
                 except Exception as e:
-                    logger.error(f"Error updating countdown message: {e}")
+                    logger.error("Error updating countdown message: %s", e)
                     await self.stop_countdown(user_id)
                     break
                     
         except asyncio.CancelledError:
             pass
         except Exception as e:
-            logger.error(f"Error in countdown loop: {e}")
+            logger.error("Error in countdown loop: %s", e)
     
     async def _format_countdown_message(self, davka_info: Dict, atm_info: Dict) -> str:
         """Форматировать сообщение с таймерами с улучшенной визуализацией"""
@@ -376,17 +335,8 @@ class PreciseTimingManager:
         return message
     
     def _get_countdown_keyboard(self) -> InlineKeyboardMarkup:
-        """Получить клавиатуру для таймеров"""
-        return InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="🐍 Давить", callback_data="davka"),
-                InlineKeyboardButton(text="🔄 Обновить", callback_data="timing_refresh")
-            ],
-            [
-                InlineKeyboardButton(text="📊 Статистика", callback_data="timing_stats"),
-                InlineKeyboardButton(text="❌ Стоп", callback_data="timing_stop")
-            ]
-        ])
+        """Получить клавиатуру для таймеров (один объект на все тики)"""
+        return countdown_keyboard()
 
 # Глобальный экземпляр менеджера тайминга
 timing_manager = PreciseTimingManager()
@@ -0,0 +1,432 @@
+"""
+Трассировка апдейтов: на что ушло время одной команды.
+
+Каждый апдейт Telegram получает trace id (TracingUpdateMiddleware), он
+переходит через contextvars во все вызовы внутри обработчика - в том числе
+в задачи, созданные из него. Спаны открываются вокруг функций db_manager,
+методов кэша (instrument_module / instrument_class) и запросов к Bot API
+(TracingRequestMiddleware). Вне трассы span() ничего не делает, так что
+фоновые циклы и миграции не платят за учёт.
+
+Готовые трассы лежат в памяти (последние keep_traces) для админской
+команды и выгружаются фоновой задачей в JSONL-файл или в коллектор по
+OTLP/HTTP JSON (TRACING_CONFIG).
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import TRACING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Вид спана в терминах OTLP: внутренний вызов, входящий апдейт, исходящий запрос
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+
+class Span:
+    """Один замер внутри трассы."""
+
+    __slots__ = ("name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Все спаны одного апдейта; корневой спан - первый."""
+
+    __slots__ = ("trace_id", "spans", "finished")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+        self.finished = False
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": round(self.duration_ms, 3),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+
+class Tracer:
+    """Открывает трассы и спаны, хранит последние трассы и очередь на выгрузку."""
+
+    def __init__(self, keep_traces: int = 200, sample_rate: float = 1.0, export_min_ms: float = 0.0):
+        self.sample_rate = sample_rate
+        self.export_min_ms = export_min_ms
+        self.recent: deque = deque(maxlen=keep_traces)
+        self.pending: List[Trace] = []
+        # Очередь на выгрузку копится, только пока запущен экспортёр
+        self.exporting = False
+        self.started = 0
+        self.dropped = 0
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Корневой спан апдейта; вложенный вызов просто открывает спан."""
+        if _current_trace.get() is not None:
+            with self.span(name, **attributes):
+                yield
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            yield
+            return
+        trace = Trace()
+        trace_token = _current_trace.set(trace)
+        self.started += 1
+        try:
+            with self.span(name, kind=KIND_SERVER, **attributes):
+                yield
+        finally:
+            _current_trace.reset(trace_token)
+            trace.finished = True
+            self.recent.append(trace)
+            if self.exporting and trace.duration_ms >= self.export_min_ms:
+                self.pending.append(trace)
+
+    @contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, **attributes):
+        trace = _current_trace.get()
+        # Вне трассы и в задачах, переживших свой апдейт, спаны не пишутся
+        if trace is None or trace.finished:
+            yield
+            return
+        parent = _current_span.get()
+        span = Span(name, parent.span_id if parent else None, kind, attributes)
+        trace.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+
+    def current_trace_id(self) -> Optional[str]:
+        trace = _current_trace.get()
+        return trace.trace_id if trace else None
+
+    def slowest(self, limit: int = 5) -> List[Trace]:
+        return sorted(self.recent, key=lambda trace: trace.duration_ms, reverse=True)[:limit]
+
+    def take_pending(self) -> List[Trace]:
+        pending, self.pending = self.pending, []
+        return pending
+
+    def get_stats(self) -> Dict[str, Any]:
+        durations = sorted(trace.duration_ms for trace in self.recent)
+        return {
+            'traces': self.started,
+            'recent': len(durations),
+            'pending': len(self.pending),
+            'dropped': self.dropped,
+            'p50_ms': f"{durations[len(durations) // 2] if durations else 0:.1f}",
+            'max_ms': f"{durations[-1] if durations else 0:.1f}",
+        }
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    """Глобальный трассировщик с настройками из TRACING_CONFIG"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(
+            keep_traces=TRACING_CONFIG.get("keep_traces", 200),
+            sample_rate=TRACING_CONFIG.get("sample_rate", 1.0),
+            export_min_ms=TRACING_CONFIG.get("export_min_ms", 0.0),
+        )
+    return _tracer
+
+
+def traced(name: str, kind: int = KIND_INTERNAL):
+    """Декоратор: спан вокруг корутины."""
+    def decorator(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return await func(*args, **kwargs)
+            with get_tracer().span(name, kind):
+                return await func(*args, **kwargs)
+        wrapper.__traced__ = True
+        return wrapper
+    return decorator
+
+
+def instrument_module(namespace: Dict[str, Any], prefix: str, exclude: Iterable[str] = ()):
+    """
+    Оборачивает публичные корутины модуля в спаны "prefix.имя".
+
+    Вызывается в конце модуля с globals(): обработчики импортируют имена
+    уже после этого и получают обёрнутые функции, вызовы внутри модуля
+    тоже идут через глобальные имена и попадают в трассу вложенными спанами.
+    """
+    module_name = namespace.get("__name__")
+    skip = set(exclude)
+    for name, value in list(namespace.items()):
+        if (name.startswith("_") or name in skip or not inspect.iscoroutinefunction(value)
+                or getattr(value, "__module__", None) != module_name or getattr(value, "__traced__", False)):
+            continue
+        namespace[name] = traced(f"{prefix}.{name}")(value)
+
+
+def instrument_class(cls: type, prefix: str, names: Optional[Iterable[str]] = None):
+    """Спаны вокруг async-методов класса (обычных и staticmethod)."""
+    for name in names if names is not None else list(vars(cls)):
+        if name.startswith("_"):
+            continue
+        raw = inspect.getattr_static(cls, name)
+        is_static = isinstance(raw, staticmethod)
+        func = raw.__func__ if is_static else raw
+        if not inspect.iscoroutinefunction(func) or getattr(func, "__traced__", False):
+            continue
+        wrapped = traced(f"{prefix}.{name}")(func)
+        setattr(cls, name, staticmethod(wrapped) if is_static else wrapped)
+
+
+def _update_name(update: Update) -> str:
+    """Имя трассы: команда, префикс callback-данных или тип апдейта."""
+    if update.message and update.message.text:
+        text = update.message.text
+        if text.startswith("/"):
+            return text.split(None, 1)[0].split("@", 1)[0]
+        return "message"
+    if update.callback_query and update.callback_query.data:
+        return f"callback:{update.callback_query.data.split('_', 1)[0]}"
+    return update.event_type
+
+
+class TracingUpdateMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: одна трасса на каждый входящий апдейт."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        with get_tracer().trace(
+            _update_name(event),
+            update_id=event.update_id,
+            user_id=user.id if user else None,
+            chat_id=chat.id if chat else None,
+        ):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии: клиентский спан вокруг каждого запроса к Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        if _current_trace.get() is None:
+            return await make_request(bot, method)
+        with get_tracer().span(f"bot.{method.__api_method__}", KIND_CLIENT):
+            return await make_request(bot, method)
+
+
+# ============================================
+# ВЫГРУЗКА
+# ============================================
+
+class FileExporter:
+    """Трасса - строка JSON в файле (удобно грепать по trace_id)."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: List[str]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def export(self, traces: List[Trace]):
+        lines = [json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n" for trace in traces]
+        await asyncio.to_thread(self._write, lines)
+
+    async def close(self):
+        pass
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(trace: Trace, span: Span) -> Dict[str, Any]:
+    otlp = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)}
+                       for key, value in span.attributes.items() if value is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+class OTLPExporter:
+    """POST в коллектор OpenTelemetry (OTLP/HTTP, JSON) - без зависимости от SDK."""
+
+    def __init__(self, endpoint: str, service_name: str = "gofrobot", timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self._session = None
+
+    def payload(self, traces: List[Trace]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": [_otlp_span(trace, span) for trace in traces for span in trace.spans],
+            }],
+        }]}
+
+    async def export(self, traces: List[Trace]):
+        import aiohttp
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.post(self.endpoint, json=self.payload(traces)) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"коллектор ответил {response.status}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def create_exporter():
+    """Выгрузка по TRACING_CONFIG["exporter"]: "file", "otlp" или None."""
+    exporter = TRACING_CONFIG.get("exporter")
+    if exporter == "file":
+        return FileExporter(TRACING_CONFIG.get("file", "storage/logs/traces.jsonl"))
+    if exporter == "otlp":
+        return OTLPExporter(TRACING_CONFIG.get("otlp_endpoint", "http://localhost:4318/v1/traces"))
+    return None
+
+
+_exporter = None
+_export_task = None
+
+
+async def export_pending(exporter) -> int:
+    tracer = get_tracer()
+    traces = tracer.take_pending()
+    if not traces:
+        return 0
+    try:
+        await exporter.export(traces)
+    except Exception as e:
+        tracer.dropped += len(traces)
+        logger.warning("⚠️ Не удалось выгрузить %s трасс: %s", len(traces), e)
+        return 0
+    return len(traces)
+
+
+async def trace_export_loop(exporter, interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await export_pending(exporter)
+
+
+async def start_tracing(interval_seconds: Optional[float] = None):
+    """Запускает фоновую выгрузку трасс (если экспортёр настроен)."""
+    global _exporter, _export_task
+    if not TRACING_CONFIG.get("enabled", True):
+        return
+    _exporter = create_exporter()
+    if _exporter is None or (_export_task is not None and not _export_task.done()):
+        return
+    interval = interval_seconds or TRACING_CONFIG.get("export_interval", 10)
+    get_tracer().exporting = True
+    _export_task = asyncio.create_task(trace_export_loop(_exporter, interval))
+    logger.info("✅ Выгрузка трасс запущена: %s (каждые %s сек)", TRACING_CONFIG.get("exporter"), interval)
+
+
+async def stop_tracing():
+    """Останавливает выгрузку и отправляет то, что осталось."""
+    global _exporter, _export_task
+    if _export_task is not None:
+        _export_task.cancel()
+        try:
+            await _export_task
+        except asyncio.CancelledError:
+            pass
+        _export_task = None
+    get_tracer().exporting = False
+    if _exporter is not None:
+        await export_pending(_exporter)
+        await _exporter.close()
+        _exporter = None
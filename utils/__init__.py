@@ -2,8 +2,46 @@ from .display import (
     format_length,
     Display,
 )
+from .gofra_levels import (
+    GofraLevel,
+    GOFRA_LEVELS,
+    GOFRA_THRESHOLDS,
+    get_gofra_info,
+    get_gofra_infos,
+)
+from .game_formulas import (
+    davka_gains,
+    pvp_chance,
+    pvp_gofra_gain,
+)
+from .matchmaking import (
+    MatchmakingIndex,
+    get_matchmaker,
+    pvp_strength,
+)
+from .render_cache import (
+    RenderCache,
+    StateVersions,
+    state_versions,
+    get_render_cache,
+)
 
 __all__ = [
     'format_length',
     'Display',
+    'GofraLevel',
+    'GOFRA_LEVELS',
+    'GOFRA_THRESHOLDS',
+    'get_gofra_info',
+    'get_gofra_infos',
+    'davka_gains',
+    'pvp_chance',
+    'pvp_gofra_gain',
+    'MatchmakingIndex',
+    'get_matchmaker',
+    'pvp_strength',
+    'RenderCache',
+    'StateVersions',
+    'state_versions',
+    'get_render_cache',
 ]
@@ -0,0 +1,70 @@
+"""
+Игровые формулы: прирост за давку, шанс и награды радёмки.
+
+Функции одинаково считают одно значение (float) и целый массив NumPy,
+поэтому бот и симулятор баланса (balance_simulator.py) используют одни
+и те же формулы и константы.
+"""
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Давка: 0.025 мм гофры за грамм (70-100 мм за месяц),
+# 150 мм кабеля за килограмм (300-500 мм за месяц)
+DAVKA_GOFRA_MM_PER_GRAM = 0.025
+DAVKA_CABLE_MM_PER_KG = 150.0
+
+# Радёмка: 50% базово, 2% за 100 мм разницы гофры, 0.2% за 10 мм кабеля, 10-90%
+PVP_BASE_CHANCE = 50.0
+PVP_GOFRA_BONUS_PER_MM = 0.02
+PVP_CABLE_BONUS_PER_MM = 0.02
+PVP_MIN_CHANCE = 10.0
+PVP_MAX_CHANCE = 90.0
+
+# Награды радёмки: победа нападающего и отбившейся цели.
+# Прирост гофры = base + min(разница / up_divisor, up_cap) против более сильного
+# и max(floor, base + разница / down_divisor) против более слабого
+PVP_ATTACK_REWARD = {"cable_mm": 0.2, "base": 12.0, "up_divisor": 100, "up_cap": 8.0,
+                     "down_divisor": 200, "floor": 5.0}
+PVP_DEFENCE_REWARD = {"cable_mm": 0.1, "base": 6.0, "up_divisor": 200, "up_cap": 4.0,
+                      "down_divisor": 400, "floor": 2.5}
+
+
+def _is_array(value) -> bool:
+    return NUMPY_AVAILABLE and isinstance(value, np.ndarray)
+
+
+def _clip(value, low, high):
+    if _is_array(value):
+        return np.clip(value, low, high)
+    return max(low, min(high, value))
+
+
+def davka_gains(zmiy_grams):
+    """(прирост гофры мм, прирост кабеля мм) за змия весом zmiy_grams."""
+    return zmiy_grams * DAVKA_GOFRA_MM_PER_GRAM, (zmiy_grams / 1000) * DAVKA_CABLE_MM_PER_KG
+
+
+def pvp_chance(attacker_gofra_mm, attacker_cable_mm, defender_gofra_mm, defender_cable_mm):
+    """Шанс победы нападающего в процентах."""
+    gofra_bonus = (attacker_gofra_mm - defender_gofra_mm) * PVP_GOFRA_BONUS_PER_MM
+    cable_bonus = (attacker_cable_mm - defender_cable_mm) * PVP_CABLE_BONUS_PER_MM
+    return _clip(PVP_BASE_CHANCE + gofra_bonus + cable_bonus, PVP_MIN_CHANCE, PVP_MAX_CHANCE)
+
+
+def pvp_gofra_gain(winner_gofra_mm, loser_gofra_mm, reward=PVP_ATTACK_REWARD):
+    """Прирост гофры победителю радёмки (мм, до сотых)."""
+    diff = loser_gofra_mm - winner_gofra_mm
+    if _is_array(diff):
+        up = reward["base"] + np.minimum(diff / reward["up_divisor"], reward["up_cap"])
+        down = np.maximum(reward["floor"], reward["base"] + diff / reward["down_divisor"])
+        return np.round(np.where(diff > 0, up, down), 2)
+    if diff > 0:
+        gain = reward["base"] + min(diff / reward["up_divisor"], reward["up_cap"])
+    else:
+        gain = max(reward["floor"], reward["base"] + diff / reward["down_divisor"])
+    return round(gain, 2)
@@ -0,0 +1,89 @@
+"""
+Уровни гофрошки: таблица строится один раз из config.GOFRY_MM
+"""
+
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from config import GOFRY_MM
+
+
+class GofraLevel(NamedTuple):
+    """Уровень гофрошки (неизменяемый)"""
+    threshold: float
+    name: str
+    emoji: str
+    atm_speed: float
+    min_grams: int
+    max_grams: int
+
+
+# Уровни по возрастанию порога и отдельный кортеж порогов для bisect
+GOFRA_LEVELS: Tuple[GofraLevel, ...] = tuple(
+    GofraLevel(
+        threshold=float(threshold),
+        name=level["name"],
+        emoji=level["emoji"],
+        atm_speed=level["atm_speed"],
+        min_grams=level["min_grams"],
+        max_grams=level["max_grams"],
+    )
+    for threshold, level in sorted(GOFRY_MM.items())
+)
+GOFRA_THRESHOLDS: Tuple[float, ...] = tuple(level.threshold for level in GOFRA_LEVELS)
+
+
+def level_index(gofra_mm: float) -> int:
+    """Номер уровня для длины гофрошки (ниже первого порога - первый уровень)"""
+    return max(bisect_right(GOFRA_THRESHOLDS, gofra_mm) - 1, 0)
+
+
+def get_level(gofra_mm: float) -> GofraLevel:
+    return GOFRA_LEVELS[level_index(gofra_mm)]
+
+
+def next_levels(gofra_mm: float, count: int) -> Tuple[GofraLevel, ...]:
+    """Следующие count уровней после текущего"""
+    start = bisect_right(GOFRA_THRESHOLDS, gofra_mm)
+    return GOFRA_LEVELS[start:start + count]
+
+
+@lru_cache(maxsize=4096)
+def _gofra_info(gofra_mm: float) -> Tuple[Tuple[str, Any], ...]:
+    """Все поля get_gofra_info для длины; одинаковые длины считаются один раз"""
+    index = level_index(gofra_mm)
+    level = GOFRA_LEVELS[index]
+    if index + 1 < len(GOFRA_LEVELS):
+        next_threshold = GOFRA_LEVELS[index + 1].threshold
+        progress = max((gofra_mm - level.threshold) / (next_threshold - level.threshold), 0.0)
+    else:
+        next_threshold = None
+        progress = 1.0
+    return (
+        ("name", level.name),
+        ("emoji", level.emoji),
+        ("atm_speed", level.atm_speed),
+        ("min_grams", level.min_grams),
+        ("max_grams", level.max_grams),
+        ("threshold", level.threshold),
+        ("level", index),
+        ("length_display", f"{gofra_mm/10:.1f} см"),
+        ("width_display", f"{gofra_mm:.1f} см"),
+        ("progress", progress),
+        ("next_threshold", next_threshold),
+    )
+
+
+def get_gofra_info(gofra_mm: float) -> Dict[str, Any]:
+    """Информация о гофрошке: уровень, прогресс и готовые строки для вывода"""
+    # Новый словарь на каждый вызов: вызывающий код может его менять
+    return dict(_gofra_info(float(gofra_mm)))
+
+
+def get_gofra_infos(values: Iterable[float]) -> List[Dict[str, Any]]:
+    """get_gofra_info для целой страницы топа за один вызов"""
+    values = [float(value) for value in values]
+    # Одинаковые длины (новички с 10 мм) считаются один раз
+    unique = {value: _gofra_info(value) for value in set(values)}
+    return [dict(unique[value]) for value in values]
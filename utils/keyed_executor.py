@@ -0,0 +1,134 @@
+"""
+Очереди работ по ключу: действия одного игрока выполняются по порядку,
+разных игроков - параллельно
+"""
+
+import asyncio
+import contextvars
+import functools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Hashable, Optional, Tuple
+
+
+# Ключи, которые уже держит текущая задача: вложенный вызов с тем же ключом
+# (davka_zmiy внутри обработчика, который держит игрока) не ждёт сам себя.
+# Рядом хранится сама задача - дочерние задачи копируют контекст, но очередь
+# не держат и должны вставать в неё как все
+_held_keys: contextvars.ContextVar[Tuple[Optional["asyncio.Task"], FrozenSet[Hashable]]] = contextvars.ContextVar(
+    "keyed_executor_held", default=(None, frozenset())
+)
+
+
+class _Lane:
+    """Очередь одного ключа: FIFO-замок и сколько задач держат или ждут его."""
+
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class KeyedExecutor:
+    """
+    Последовательное выполнение по ключу (обычно user_id).
+
+    У каждого ключа своя очередь - asyncio.Lock, который пропускает ждущих
+    в порядке прихода. Очередь создаётся при первом обращении и удаляется,
+    как только её никто не держит и не ждёт, так что память тратится только
+    на игроков, у которых прямо сейчас что-то выполняется.
+    Несколько ключей (радёмка: нападающий и цель) берутся в порядке
+    сортировки, поэтому встречные бои A->B и B->A не блокируют друг друга.
+    """
+
+    def __init__(self):
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self.completed = 0
+        self.contended = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+
+    @asynccontextmanager
+    async def lock(self, *keys: Hashable):
+        """Держит очереди всех ключей на время блока."""
+        task = asyncio.current_task()
+        owner, held = _held_keys.get()
+        if owner is not task:
+            held = frozenset()
+        ordered = sorted({key for key in keys if key not in held}, key=repr)
+        acquired = []
+        token = None
+        started = time.monotonic()
+        try:
+            for key in ordered:
+                lane = self._lanes.get(key)
+                if lane is None:
+                    lane = self._lanes[key] = _Lane()
+                lane.depth += 1
+                if lane.depth > 1:
+                    self.contended += 1
+                    self.max_depth = max(self.max_depth, lane.depth)
+                try:
+                    await lane.lock.acquire()
+                except BaseException:
+                    self._leave(key, lane)
+                    raise
+                acquired.append((key, lane))
+            self.total_wait += time.monotonic() - started
+            token = _held_keys.set((task, held | frozenset(ordered)))
+            yield
+        finally:
+            if token is not None:
+                _held_keys.reset(token)
+            for key, lane in reversed(acquired):
+                lane.lock.release()
+                self._leave(key, lane)
+            if token is not None:
+                self.completed += 1
+
+    def _leave(self, key: Hashable, lane: _Lane):
+        lane.depth -= 1
+        if lane.depth == 0 and self._lanes.get(key) is lane:
+            del self._lanes[key]
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        async with self.lock(key):
+            return await func(*args, **kwargs)
+
+    def depth(self, key: Hashable) -> int:
+        """Сколько задач держат или ждут очередь ключа."""
+        lane = self._lanes.get(key)
+        return lane.depth if lane else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        depths = sorted((lane.depth for lane in self._lanes.values()), reverse=True)
+        return {
+            'active_keys': len(depths),
+            'queued': sum(depth - 1 for depth in depths),
+            'deepest': depths[0] if depths else 0,
+            'max_depth': self.max_depth,
+            'completed': self.completed,
+            'contended': self.contended,
+            'avg_wait_ms': f"{(self.total_wait / self.completed * 1000) if self.completed else 0:.2f}",
+        }
+
+
+_user_executor: Optional[KeyedExecutor] = None
+
+
+def get_user_executor() -> KeyedExecutor:
+    """Глобальные очереди по user_id"""
+    global _user_executor
+    if _user_executor is None:
+        _user_executor = KeyedExecutor()
+    return _user_executor
+
+
+def serialized_by_user(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Выполняет корутину в очереди игрока; user_id - первый аргумент."""
+    @functools.wraps(func)
+    async def wrapper(user_id, *args, **kwargs):
+        async with get_user_executor().lock(user_id):
+            return await func(user_id, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,204 @@
+"""
+Индекс подбора соперников для радёмки: игроки по полосам силы
+"""
+
+import random
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from config import MATCHMAKING_CONFIG
+from utils.game_formulas import PVP_CABLE_BONUS_PER_MM, PVP_GOFRA_BONUS_PER_MM
+
+
+def pvp_strength(gofra_mm: float, cable_mm: float) -> float:
+    """
+    Сила игрока в радёмке в мм гофры.
+
+    Шанс победы зависит только от разницы сил (utils.game_formulas.pvp_chance),
+    поэтому при равной силе бой честный - 50 на 50.
+    """
+    return gofra_mm + cable_mm * (PVP_CABLE_BONUS_PER_MM / PVP_GOFRA_BONUS_PER_MM)
+
+
+class MatchmakingIndex:
+    """
+    Игроки, разложенные по полосам силы шириной band_width.
+
+    В полосе - список и позиции в нём: добавление, удаление и случайный выбор
+    за O(1). Соперника ищем в полосе игрока и дальше по соседним, пропуская
+    самого игрока и тех, кто уже выбрал лимит боёв за час. Индекс обновляется
+    из мест сохранения игроков и боёв (player_saved, fight_saved), а не
+    перечитывается из базы; пока идёт первая загрузка, эти изменения копятся
+    и применяются поверх прочитанного снимка.
+    """
+
+    def __init__(self, band_width: float = 250.0, samples_per_band: int = 4, fights_per_hour: int = 10):
+        self.band_width = band_width
+        self.samples_per_band = samples_per_band
+        self.fights_per_hour = fights_per_hour
+        self.loaded = False
+        self.loading = False
+        # Изменения, пришедшие во время загрузки: ("player" | "fight", аргументы)
+        self._pending: List[Tuple[str, tuple]] = []
+        self._bands: Dict[int, List[int]] = {}
+        # user_id -> (полоса, позиция в её списке)
+        self._positions: Dict[int, Tuple[int, int]] = {}
+        # user_id -> время боёв за последний час
+        self._fights: Dict[int, Deque[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def band_of(self, gofra_mm: float, cable_mm: float) -> int:
+        return int(pvp_strength(gofra_mm, cable_mm) // self.band_width)
+
+    def update(self, user_id: int, gofra_mm: float, cable_mm: float):
+        """Кладёт игрока в полосу по его текущим гофре и кабелю."""
+        band = self.band_of(gofra_mm, cable_mm)
+        position = self._positions.get(user_id)
+        if position is not None:
+            if position[0] == band:
+                return
+            self.remove(user_id)
+        members = self._bands.setdefault(band, [])
+        self._positions[user_id] = (band, len(members))
+        members.append(user_id)
+
+    def remove(self, user_id: int):
+        position = self._positions.pop(user_id, None)
+        if position is None:
+            return
+        band, index = position
+        members = self._bands[band]
+        # Последний игрок полосы встаёт на место удалённого
+        last = members.pop()
+        if last != user_id:
+            members[index] = last
+            self._positions[last] = (band, index)
+        if not members:
+            del self._bands[band]
+
+    def begin_load(self):
+        """Начало загрузки из базы: изменения до finish_load откладываются."""
+        self.loading = True
+        self._pending = []
+
+    def finish_load(self, players: Iterable[Tuple[int, float, float]],
+                    fights: Iterable[Tuple[int, int, int]]):
+        """Снимок из базы плюс изменения, пришедшие, пока он читался."""
+        if not self.loading:
+            # clear() во время загрузки (восстановление из бэкапа) - снимок устарел
+            return
+        for user_id, gofra_mm, cable_mm in players:
+            self.update(user_id, gofra_mm, cable_mm)
+        in_snapshot = Counter()
+        for winner_id, loser_id, created_at in fights:
+            self.record_fight(winner_id, loser_id, created_at)
+            in_snapshot[(winner_id, loser_id, created_at)] += 1
+        for kind, args in self._pending:
+            if kind == "player":
+                self.update(*args)
+            elif in_snapshot[args]:
+                # Бой закоммичен до чтения боёв и уже попал в снимок
+                in_snapshot[args] -= 1
+            else:
+                self.record_fight(*args)
+        self._pending = []
+        self.loading = False
+        self.loaded = True
+
+    def abort_load(self):
+        self.loading = False
+        self._pending = []
+
+    def player_saved(self, user_id: int, gofra_mm: float, cable_mm: float):
+        """Игрок сохранён: до загрузки индекс не нужен, во время неё - в очередь."""
+        if self.loaded:
+            self.update(user_id, gofra_mm, cable_mm)
+        elif self.loading:
+            self._pending.append(("player", (user_id, gofra_mm, cable_mm)))
+
+    def fight_saved(self, winner_id: int, loser_id: int, timestamp: int):
+        """Бой записан в базу; как player_saved."""
+        if self.loaded:
+            self.record_fight(winner_id, loser_id, timestamp)
+        elif self.loading:
+            self._pending.append(("fight", (winner_id, loser_id, timestamp)))
+
+    def record_fight(self, winner_id: int, loser_id: int, timestamp: Optional[int] = None):
+        timestamp = timestamp or int(time.time())
+        for user_id in (winner_id, loser_id):
+            self._fights.setdefault(user_id, deque()).append(timestamp)
+
+    def is_blocked(self, user_id: int, now: Optional[int] = None) -> bool:
+        """Выбрал ли игрок лимит боёв за последний час."""
+        fights = self._fights.get(user_id)
+        if not fights:
+            return False
+        since = (now or int(time.time())) - 3600
+        while fights and fights[0] <= since:
+            fights.popleft()
+        if not fights:
+            del self._fights[user_id]
+            return False
+        return len(fights) >= self.fights_per_hour
+
+    def _pick(self, band: int, user_id: int, now: int) -> Optional[int]:
+        members = self._bands.get(band)
+        if not members:
+            return None
+        if len(members) <= self.samples_per_band:
+            candidates = random.sample(members, len(members))
+        else:
+            candidates = (random.choice(members) for _ in range(self.samples_per_band))
+        for candidate in candidates:
+            if candidate != user_id and not self.is_blocked(candidate, now):
+                return candidate
+        return None
+
+    def find_opponent(self, user_id: int, gofra_mm: float, cable_mm: float) -> Optional[int]:
+        """Случайный соперник как можно ближе по силе, или None."""
+        if not self._bands:
+            return None
+        now = int(time.time())
+        band = self.band_of(gofra_mm, cable_mm)
+        farthest = max(abs(band - min(self._bands)), abs(max(self._bands) - band))
+        for distance in range(farthest + 1):
+            sides = [band - distance, band + distance] if distance else [band]
+            random.shuffle(sides)
+            for side in sides:
+                opponent = self._pick(side, user_id, now)
+                if opponent is not None:
+                    return opponent
+        return None
+
+    def clear(self):
+        self.loaded = False
+        self.abort_load()
+        self._bands.clear()
+        self._positions.clear()
+        self._fights.clear()
+
+    def get_stats(self):
+        return {
+            'players': len(self._positions),
+            'bands': len(self._bands),
+            'largest_band': max((len(members) for members in self._bands.values()), default=0),
+            'tracked_fighters': len(self._fights),
+        }
+
+
+_matchmaker: Optional[MatchmakingIndex] = None
+
+
+def get_matchmaker() -> MatchmakingIndex:
+    """Глобальный индекс подбора соперников"""
+    global _matchmaker
+    if _matchmaker is None:
+        _matchmaker = MatchmakingIndex(
+            band_width=MATCHMAKING_CONFIG.get("band_width", 250.0),
+            samples_per_band=MATCHMAKING_CONFIG.get("samples_per_band", 4),
+            fights_per_hour=MATCHMAKING_CONFIG.get("fights_per_hour", 10),
+        )
+    return _matchmaker
@@ -0,0 +1,104 @@
+"""
+Кэш готовых текстов сообщений по версии состояния
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import RENDER_CACHE_CONFIG
+
+
+class StateVersions:
+    """
+    Счётчики версий состояния: ('user', user_id), ('chat', chat_id), ('users',) ...
+
+    Запись в базу увеличивает версию, и все тексты, собранные по старой
+    версии, перестают совпадать по ключу. Версии живут в памяти процесса;
+    после перезапуска всё начинается с нуля вместе с пустым кэшем текстов.
+    """
+
+    def __init__(self):
+        self._versions: Dict[Tuple[Hashable, ...], int] = {}
+
+    def get(self, *key: Hashable) -> int:
+        return self._versions.get(key, 0)
+
+    def bump(self, *key: Hashable) -> int:
+        version = self._versions.get(key, 0) + 1
+        self._versions[key] = version
+        return version
+
+    def forget(self, *key: Hashable):
+        """Убирает счётчик (после удаления сущности); следующая версия начнётся заново"""
+        self._versions.pop(key, None)
+
+
+class RenderCache:
+    """
+    LRU кэш отрисованных сообщений: (вид, сущность, версия) -> значение.
+
+    TTL ограничивает, сколько живёт текст, собранный из данных stale-while-revalidate
+    кэша: версия могла не измениться, а данные под ней обновиться в фоне.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, view: str, entity: Hashable, version: Hashable) -> Optional[Any]:
+        key = (view, entity)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, view: str, entity: Hashable, version: Hashable, value: Any) -> Any:
+        # Одна запись на (вид, сущность): новая версия вытесняет старую
+        key = (view, entity)
+        self._entries[key] = (version, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def get_or_render(self, view: str, entity: Hashable, version: Hashable,
+                      render: Callable[[], Any]) -> Any:
+        cached = self.get(view, entity, version)
+        if cached is not None:
+            return cached
+        return self.put(view, entity, version, render())
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': f"{(self.hits / total * 100) if total else 0:.1f}%",
+        }
+
+
+state_versions = StateVersions()
+_render_cache: Optional[RenderCache] = None
+
+
+def get_render_cache() -> RenderCache:
+    """Глобальный кэш текстов"""
+    global _render_cache
+    if _render_cache is None:
+        _render_cache = RenderCache(
+            max_size=RENDER_CACHE_CONFIG.get("max_size", 2000),
+            ttl=RENDER_CACHE_CONFIG.get("ttl", 60),
+        )
+    return _render_cache